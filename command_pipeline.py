@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+下行命令确认与重发
+
+下行帧通过UDP发送，设备不回复确认帧，只能根据之后收到的上行帧判断命令是否生效：
+修改ID命令在收到目标IP以新ID上报时完成，立即上报命令在收到目标设备的任意上行帧时完成。
+在途命令按 (目标IP, 设备ID, 命令) 登记，相同命令在途时不重复发送；
+超时未得到应答按指数退避重发，重发次数用尽后判定失败。每个设备的在途命令数有上限。
+已结束的命令保留在最近记录中，供接口查询完成状态。
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_IP = '255.255.255.255'
+# 首次等待应答的时间(秒)，之后每次重发按退避倍数增长
+RETRY_TIMEOUT = 2.0
+BACKOFF_FACTOR = 2.0
+# 单次等待时间上限(秒)
+MAX_RETRY_TIMEOUT = 16.0
+# 最多发送次数（含首次发送）
+MAX_ATTEMPTS = 4
+# 每个设备同时在途的命令数上限
+MAX_INFLIGHT_PER_DEVICE = 2
+# 保留的已结束命令条数
+HISTORY_SIZE = 200
+
+STATE_PENDING = 'pending'
+STATE_ACKED = 'acked'
+STATE_FAILED = 'failed'
+
+# 提交被拒绝的原因：同类命令参数不同且仍在途 / 设备在途命令已满
+REJECT_CONFLICT = 'conflict'
+REJECT_BUSY = 'busy'
+
+class _Command:
+    __slots__ = ('id', 'cmd', 'device_id', 'status', 'target_ip', 'reply_id', 'name', 'state',
+                 'attempts', 'send_errors', 'created', 'first_sent', 'last_sent', 'next_retry',
+                 'finished', 'reply_ip', 'reply_cmd')
+
+    def __init__(self, command_id: int, cmd: int, device_id: int, status: int, target_ip: str,
+                 reply_id: Optional[int], name: str):
+        self.id = command_id
+        self.cmd = cmd
+        self.device_id = device_id
+        self.status = status
+        self.target_ip = target_ip
+        self.reply_id = reply_id
+        self.name = name
+        self.state = STATE_PENDING
+        self.attempts = 0
+        self.send_errors = 0
+        self.created = time.time()
+        self.first_sent = None
+        self.last_sent = None
+        self.next_retry = None
+        self.finished = None
+        self.reply_ip = None
+        self.reply_cmd = None
+
+    @property
+    def key(self) -> Tuple[str, int, int]:
+        return (self.target_ip, self.device_id, self.cmd)
+
+    def matches(self, source_ip: str, device_id: int) -> bool:
+        """上行帧是否为本命令的应答"""
+        if self.first_sent is None:
+            return False
+        if self.target_ip != BROADCAST_IP and source_ip != self.target_ip:
+            return False
+        return self.reply_id is None or device_id == self.reply_id
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'cmd': self.cmd,
+            'name': self.name,
+            'device_id': self.device_id,
+            'status': self.status,
+            'target_ip': self.target_ip,
+            'reply_id': self.reply_id,
+            'state': self.state,
+            'attempts': self.attempts,
+            'send_errors': self.send_errors,
+            'created': self.created,
+            'first_sent': self.first_sent,
+            'next_retry': self.next_retry if self.state == STATE_PENDING else None,
+            'finished': self.finished,
+            'latency': round(self.finished - self.first_sent, 3)
+                       if self.state == STATE_ACKED and self.first_sent else None,
+            'reply_ip': self.reply_ip,
+            'reply_cmd': self.reply_cmd
+        }
+
+
+class CommandPipeline:
+    """带应答确认、指数退避重发和设备在途上限的下行命令队列
+
+    send(cmd, device_id, status, target_ip) 发送一个下行帧并返回是否发送成功；
+    on_complete(command) 在命令应答或失败后调用，参数为命令状态字典；describe(cmd) 返回命令名称。
+    """
+
+    def __init__(self, send: Callable[[int, int, int, str], bool],
+                 on_complete: Optional[Callable[[Dict], None]] = None,
+                 describe: Optional[Callable[[int], str]] = None,
+                 retry_timeout: float = RETRY_TIMEOUT, backoff: float = BACKOFF_FACTOR,
+                 max_retry_timeout: float = MAX_RETRY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS,
+                 max_inflight_per_device: int = MAX_INFLIGHT_PER_DEVICE,
+                 history_size: int = HISTORY_SIZE):
+        self.send = send
+        self.on_complete = on_complete
+        self.describe = describe or (lambda cmd: f'0x{cmd:02X}')
+        self.retry_timeout = retry_timeout
+        self.backoff = backoff
+        self.max_retry_timeout = max_retry_timeout
+        self.max_attempts = max_attempts
+        self.max_inflight_per_device = max_inflight_per_device
+        self.history_size = history_size
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.inflight = {}  # {(目标IP, 设备ID, 命令): _Command}
+        self.history = OrderedDict()  # {命令编号: _Command}，已结束的命令
+        self.next_id = 1
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'sent': 0,
+                      'retries': 0, 'acked': 0, 'failed': 0}
+        self.running = True
+        self.thread = threading.Thread(target=self._retry_loop, daemon=True)
+        self.thread.start()
+
+    def _timeout_for(self, attempts: int) -> float:
+        """第 attempts 次发送后的等待时间"""
+        return min(self.retry_timeout * self.backoff ** (attempts - 1), self.max_retry_timeout)
+
+    def _transmit(self, command: _Command):
+        """发送一次命令（在锁外调用），并登记下一次重发时间
+
+        命令在重发前或发送期间已得到应答时不再发送、不再修改其状态。
+        """
+        with self.lock:
+            if command.state != STATE_PENDING:
+                return
+            if command.attempts:
+                self.stats['retries'] += 1
+                logger.info(f"下行命令未应答，第 {command.attempts + 1} 次发送: #{command.id} {command.name} "
+                            f"设备 {command.device_id} -> {command.target_ip}")
+        try:
+            sent = self.send(command.cmd, command.device_id, command.status, command.target_ip)
+        except Exception as e:
+            logger.error(f"发送下行命令失败 {command.name} -> {command.target_ip}: {e}")
+            sent = False
+
+        now = time.time()
+        with self.lock:
+            if command.state != STATE_PENDING:
+                return
+            command.attempts += 1
+            if sent:
+                self.stats['sent'] += 1
+                command.last_sent = now
+                if command.first_sent is None:
+                    command.first_sent = now
+            else:
+                command.send_errors += 1
+            command.next_retry = now + self._timeout_for(command.attempts)
+            self.changed.notify_all()
+
+    def submit(self, cmd: int, device_id: int, status: int = 0x00, target_ip: str = BROADCAST_IP,
+               reply_id: Optional[int] = None) -> Tuple[Optional[Dict], Optional[str], Optional[str]]:
+        """提交一个下行命令
+
+        reply_id 为应答上行帧中预期的设备ID，None 表示任意设备ID。
+        返回 (命令状态, 错误信息, 拒绝原因)：相同命令已在途时返回在途命令；
+        同类命令参数不同且仍在途时拒绝原因为 REJECT_CONFLICT，设备在途命令已满时为 REJECT_BUSY。
+        """
+        with self.lock:
+            key = (target_ip, device_id, cmd)
+            existing = self.inflight.get(key)
+            if existing is not None:
+                if existing.status == status:
+                    self.stats['deduplicated'] += 1
+                    return existing.to_dict(), None, None
+                self.stats['rejected'] += 1
+                return (None, f'设备 {device_id} 的{existing.name}命令 #{existing.id} 尚未完成，请等待结果后重试',
+                        REJECT_CONFLICT)
+
+            device_inflight = sum(
+                1 for command in self.inflight.values()
+                if command.target_ip == target_ip and command.device_id == device_id
+            )
+            if device_inflight >= self.max_inflight_per_device:
+                self.stats['rejected'] += 1
+                return None, f'设备 {device_id} 已有 {device_inflight} 个命令等待应答，请稍后重试', REJECT_BUSY
+
+            command = _Command(self.next_id, cmd, device_id, status, target_ip, reply_id,
+                               self.describe(cmd))
+            self.next_id += 1
+            self.inflight[key] = command
+            self.stats['submitted'] += 1
+
+        self._transmit(command)
+        logger.info(f"下行命令已登记: #{command.id} {command.name} 设备 {device_id} -> {target_ip}")
+        with self.lock:
+            return command.to_dict(), None, None
+
+    def on_uplink(self, source_ip: str, device_id: int, cmd: int):
+        """收到上行帧：完成所有与之匹配的在途命令"""
+        with self.lock:
+            if not self.inflight:
+                return
+            now = time.time()
+            done = []
+            for key, command in list(self.inflight.items()):
+                if command.matches(source_ip, device_id):
+                    command.state = STATE_ACKED
+                    command.finished = now
+                    command.reply_ip = source_ip
+                    command.reply_cmd = cmd
+                    self._finish(key, command)
+                    self.stats['acked'] += 1
+                    done.append(command.to_dict())
+            if done:
+                self.changed.notify_all()
+
+        for result in done:
+            logger.info(
+                f"下行命令已确认: #{result['id']} {result['name']} 设备 {result['device_id']}，"
+                f"发送 {result['attempts']} 次，耗时 {result['latency']}秒"
+            )
+            self._notify(result)
+
+    def _finish(self, key, command: _Command):
+        """将命令从在途表移入最近记录（假设已经获得锁）"""
+        del self.inflight[key]
+        self.history[command.id] = command
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+
+    def _notify(self, result: Dict):
+        if self.on_complete is not None:
+            try:
+                self.on_complete(result)
+            except Exception as e:
+                logger.error(f"处理下行命令结果错误: {e}")
+
+    def _retry_loop(self):
+        """等待最近的重发时间，超时的命令重发或判定失败"""
+        while True:
+            resend = []
+            failed = []
+            with self.lock:
+                while self.running:
+                    now = time.time()
+                    due = [c for c in self.inflight.values() if c.next_retry is not None and c.next_retry <= now]
+                    if due:
+                        break
+                    deadlines = [c.next_retry for c in self.inflight.values() if c.next_retry is not None]
+                    self.changed.wait(min(deadlines) - now if deadlines else None)
+                if not self.running:
+                    return
+
+                for command in due:
+                    if command.attempts >= self.max_attempts:
+                        command.state = STATE_FAILED
+                        command.finished = now
+                        self._finish(command.key, command)
+                        self.stats['failed'] += 1
+                        failed.append(command.to_dict())
+                    else:
+                        # 重发期间不再重复触发
+                        command.next_retry = None
+                        resend.append(command)
+
+            for command in resend:
+                self._transmit(command)
+            for result in failed:
+                logger.warning(f"下行命令无应答，已放弃: #{result['id']} {result['name']} 设备 {result['device_id']} "
+                               f"-> {result['target_ip']}，共发送 {result['attempts']} 次")
+                self._notify(result)
+
+    def get_command(self, command_id: int) -> Optional[Dict]:
+        """按编号查询命令状态"""
+        with self.lock:
+            command = self.history.get(command_id)
+            if command is None:
+                command = next((c for c in self.inflight.values() if c.id == command_id), None)
+            return command.to_dict() if command is not None else None
+
+    def list_commands(self, device_id: Optional[int] = None) -> List[Dict]:
+        """在途命令与最近结束的命令，按编号倒序"""
+        with self.lock:
+            commands = list(self.inflight.values()) + list(self.history.values())
+            if device_id is not None:
+                commands = [c for c in commands if c.device_id == device_id]
+            return [c.to_dict() for c in sorted(commands, key=lambda c: c.id, reverse=True)]
+
+    def get_stats(self) -> Dict:
+        """命令发送、重发、确认与失败统计"""
+        with self.lock:
+            return dict(self.stats, inflight=len(self.inflight))
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.changed.notify_all()
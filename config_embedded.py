@@ -35,7 +35,9 @@ EMBEDDED_CONFIG = {
         "broadcast_port": 5439,
         "listen_port": 5439,
         "web_port": 8081,
-        "max_connections": 50,  # 限制并发连接数
+        "max_connections": 50,  # 限制并发连接数（生产模式下的请求线程数）
+        "stream_connections": 100,  # SSE/长轮询连接上限，单独的线程池
+        "server_mode": "production",  # production 有界线程池 / development Flask开发服务器
         "socket_timeout": 30,
         "buffer_size": 1024
     },
@@ -59,6 +61,7 @@ EMBEDDED_CONFIG = {
         "flush_interval": 5,  # 刷新间隔(秒)
         "compression": True,  # 启用压缩
         "async_logging": True,  # 异步日志
+        "sse_batch_window": 0.005,  # SSE批量模式合并事件的等待窗口(秒)
     },
     
     # 硬件接口配置
@@ -79,6 +82,17 @@ EMBEDDED_CONFIG = {
         "backup_interval": 3600,  # 1小时备份一次
         "backup_retention": 7,  # 保留7天备份
         "sync_interval": 60,  # 同步间隔(秒)
+        "log_retention_days": 7,  # 数据库设备日志保留天数
+        "cleanup_chunk_size": 500,  # 每次清理删除的最大日志行数
+        "heartbeat_aggregation": True,  # 心跳合并为区间聚合记录，只完整记录状态变化
+        "heartbeat_bucket_seconds": 300,  # 心跳聚合区间(秒)
+        # 各类磁盘数据的配额，超出后从最旧的数据开始淘汰
+        "quotas": {
+            "app_log": "60MB",  # 应用日志及其轮转文件
+            "database": "100MB",  # SQLite数据库有效数据
+            "backups": "200MB",  # 备份目录
+            "captures": "50MB",  # 抓包等诊断数据
+        },
     }
 }
 
@@ -329,6 +343,7 @@ class EmbeddedConfig:
         
         # 优化网络
         self.config["network"]["max_connections"] = 20
+        self.config["network"]["stream_connections"] = 50
         self.config["network"]["socket_timeout"] = 15
         
         self.logger.info("配置已针对嵌入式环境优化")
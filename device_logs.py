@@ -1,169 +1,1103 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-import json
-import os
-import threading
-from datetime import datetime
-from typing import Dict, List, Optional
-
-class DeviceLogManager:
-    """设备日志管理器"""
-    
-    def __init__(self, log_dir: str = "device_logs"):
-        self.log_dir = log_dir
-        self.lock = threading.Lock()
-        
-        # 创建日志目录
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-    
-    def _get_log_file_path(self, device_id: int) -> str:
-        """获取设备日志文件路径"""
-        return os.path.join(self.log_dir, f"device_{device_id}.json")
-    
-    def _load_device_logs(self, device_id: int) -> List[Dict]:
-        """加载设备日志"""
-        log_file = self._get_log_file_path(device_id)
-        if not os.path.exists(log_file):
-            return []
-        
-        try:
-            with open(log_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return []
-    
-    def _save_device_logs(self, device_id: int, logs: List[Dict]) -> bool:
-        """保存设备日志"""
-        log_file = self._get_log_file_path(device_id)
-        try:
-            with open(log_file, 'w', encoding='utf-8') as f:
-                json.dump(logs, f, ensure_ascii=False, indent=2)
-            return True
-        except IOError:
-            return False
-    
-    def add_log_entry(self, device_id: int, log_type: str, message: str, 
-                     wifi_rssi: int = 0, source_ip: str = "", 
-                     additional_data: Optional[Dict] = None) -> bool:
-        """添加日志条目"""
-        with self.lock:
-            logs = self._load_device_logs(device_id)
-            
-            log_entry = {
-                "timestamp": datetime.now().isoformat(),
-                "type": log_type,
-                "message": message,
-                "wifi_rssi": wifi_rssi,
-                "source_ip": source_ip
-            }
-            
-            if additional_data:
-                log_entry.update(additional_data)
-            
-            logs.append(log_entry)
-            
-            # 限制日志条目数量，保留最近的1000条
-            if len(logs) > 1000:
-                logs = logs[-1000:]
-            
-            return self._save_device_logs(device_id, logs)
-    
-    def get_device_logs(self, device_id: int, limit: int = 100) -> List[Dict]:
-        """获取设备日志"""
-        with self.lock:
-            logs = self._load_device_logs(device_id)
-            return logs[-limit:] if logs else []
-    
-    def get_device_log_summary(self, device_id: int) -> Dict:
-        """获取设备日志摘要"""
-        with self.lock:
-            logs = self._load_device_logs(device_id)
-            
-            if not logs:
-                return {
-                    "total_logs": 0,
-                    "first_log": None,
-                    "last_log": None,
-                    "log_types": {}
-                }
-            
-            # 统计日志类型
-            log_types = {}
-            for log in logs:
-                log_type = log.get("type", "unknown")
-                log_types[log_type] = log_types.get(log_type, 0) + 1
-            
-            return {
-                "total_logs": len(logs),
-                "first_log": logs[0]["timestamp"] if logs else None,
-                "last_log": logs[-1]["timestamp"] if logs else None,
-                "log_types": log_types
-            }
-    
-    def search_logs(self, device_id: int, log_type: Optional[str] = None, 
-                   start_time: Optional[str] = None, end_time: Optional[str] = None,
-                   limit: int = 100) -> List[Dict]:
-        """搜索设备日志"""
-        with self.lock:
-            logs = self._load_device_logs(device_id)
-            
-            if not logs:
-                return []
-            
-            # 过滤日志
-            filtered_logs = []
-            for log in logs:
-                # 过滤日志类型
-                if log_type and log.get("type") != log_type:
-                    continue
-                
-                # 过滤时间范围
-                log_time = log.get("timestamp", "")
-                if start_time and log_time < start_time:
-                    continue
-                if end_time and log_time > end_time:
-                    continue
-                
-                filtered_logs.append(log)
-            
-            return filtered_logs[-limit:] if filtered_logs else []
-    
-    def clear_device_logs(self, device_id: int) -> bool:
-        """清空设备日志"""
-        with self.lock:
-            log_file = self._get_log_file_path(device_id)
-            try:
-                if os.path.exists(log_file):
-                    os.remove(log_file)
-                return True
-            except OSError:
-                return False
-    
-    def get_all_device_ids(self) -> List[int]:
-        """获取所有有日志的设备ID"""
-        device_ids = []
-        for filename in os.listdir(self.log_dir):
-            if filename.startswith("device_") and filename.endswith(".json"):
-                try:
-                    device_id = int(filename[7:-5])  # 提取device_XXX.json中的XXX
-                    device_ids.append(device_id)
-                except ValueError:
-                    continue
-        return sorted(device_ids)
-    
-    def backup_logs(self, backup_dir: str = "backup_logs") -> bool:
-        """备份所有日志"""
-        try:
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"device_logs_backup_{timestamp}")
-            
-            import shutil
-            shutil.copytree(self.log_dir, backup_path)
-            return True
-        except Exception:
-            return False 
\ No newline at end of file
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import heapq
+import json
+import logging
+import lzma
+import mmap
+import os
+import shutil
+import threading
+import time
+import zlib
+from datetime import datetime
+from itertools import islice
+from queue import Queue, Empty, Full
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from incremental_backup import SnapshotWriter
+
+logger = logging.getLogger(__name__)
+
+# 每个日志段最多保存的条目数，写满后封存并压缩
+SEGMENT_MAX_ENTRIES = 1000
+# 封存段内每个压缩块的条目数，按时间范围读取时只解压覆盖到的块
+BLOCK_ENTRIES = 100
+# 每个设备最多保留的日志段数量（含当前写入段）
+MAX_SEGMENTS = 30
+# 封存段压缩算法: zlib / lzma
+COMPRESSION = "zlib"
+# 锁分片数量，不同分片的设备日志读写互不阻塞
+LOCK_STRIPES = 16
+# 后台写入队列容量
+LOG_QUEUE_SIZE = 10000
+# 后台写入线程单次最多合并处理的条目数
+WRITE_BATCH_SIZE = 200
+# 队列已满时入队的最长等待时间(秒)，超时后丢弃该条目并计数
+LOG_QUEUE_PUT_TIMEOUT = 5
+# 备份前等待队列写盘的最长时间(秒)，未写盘的日志留到下一次备份
+BACKUP_FLUSH_TIMEOUT = 5
+
+# 日志段文件后缀：写入中的明文段 / 封存的压缩段 / 压缩段的块索引
+HOT_SUFFIX = ".jsonl"
+COLD_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx.json"
+
+_CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+def encode_cursor(data: Dict) -> str:
+    """将翻页位置编码为不透明游标"""
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Dict:
+    """解析游标，格式错误时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except ValueError as e:
+        # 包括base64填充错误、非ASCII字符、JSON格式错误
+        raise ValueError(f"无效的游标: {cursor}") from e
+    if not isinstance(data, dict) or data.get("dir") not in ("before", "after"):
+        raise ValueError(f"无效的游标: {cursor}")
+    return data
+
+def _empty_summary() -> Dict:
+    """空的日志摘要"""
+    return {
+        "total_logs": 0,
+        "first_log": None,
+        "last_log": None,
+        "last_alarm": None,
+        "log_types": {}
+    }
+
+class DeviceLogManager:
+    """设备日志管理器
+    
+    每个设备一个目录，日志按段存储：当前段为逐行追加的JSON(.jsonl)，
+    写满 SEGMENT_MAX_ENTRIES 条后封存，按块压缩为 .seg 文件并生成块索引，
+    读取时按索引中的时间范围只解压需要的块。
+    """
+    
+    def __init__(self, log_dir: str = "device_logs", lock_stripes: int = LOCK_STRIPES,
+                 queue_size: int = LOG_QUEUE_SIZE, compression: str = COMPRESSION):
+        self.log_dir = log_dir
+        self.compression = compression if compression in _CODECS else COMPRESSION
+        # 按设备ID分片的锁，慢速磁盘写入只阻塞同一分片的设备
+        self.locks = [threading.Lock() for _ in range(max(1, lock_stripes))]
+        
+        # 后台日志写入队列，调用方只负责入队，不等待磁盘I/O
+        self.log_queue = Queue(maxsize=queue_size)
+        
+        # 每个设备的日志摘要计数器，随日志追加/裁剪增量维护
+        self.summaries = {}
+        self.summary_lock = threading.Lock()
+        
+        # 每个设备当前写入段: {device_id: (段序号, 条目数)}，受设备锁保护
+        self.hot_segments = {}
+        
+        # 读取方正在映射的明文段引用计数，以及因仍被映射而推迟删除的已封存明文段
+        # （Windows下无法删除仍被映射或打开的文件）
+        self.map_lock = threading.Lock()
+        self.hot_map_refs = {}
+        self.deferred_unlinks = set()
+        
+        # 压缩段读取统计
+        self.read_stats = {
+            "blocks_read": 0,
+            "entries_read": 0,
+            "bytes_decompressed": 0,
+            "seconds": 0.0
+        }
+        self.stats_lock = threading.Lock()
+        # 写盘失败或入队超时而丢弃的日志条目数
+        self.dropped_entries = 0
+        
+        # 创建日志目录
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        
+        self._migrate_legacy_logs()
+        self._load_summaries()
+        
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+    
+    def _get_device_lock(self, device_id: int) -> threading.Lock:
+        """获取设备所在分片的锁"""
+        return self.locks[device_id % len(self.locks)]
+    
+    def _get_device_dir(self, device_id: int) -> str:
+        """获取设备日志目录"""
+        return os.path.join(self.log_dir, f"device_{device_id}")
+    
+    def _get_segment_path(self, device_id: int, seq: int, suffix: str) -> str:
+        """获取日志段文件路径"""
+        return os.path.join(self._get_device_dir(device_id), f"{seq:08d}{suffix}")
+    
+    def _get_summary_file_path(self, device_id: int) -> str:
+        """获取设备日志摘要文件路径"""
+        return os.path.join(self._get_device_dir(device_id), "summary.json")
+    
+    def _get_legacy_log_file_path(self, device_id: int) -> str:
+        """获取旧版（单个JSON数组）设备日志文件路径"""
+        return os.path.join(self.log_dir, f"device_{device_id}.json")
+    
+    def _migrate_legacy_logs(self):
+        """将旧版 device_<id>.json 日志迁移为分段存储"""
+        for filename in os.listdir(self.log_dir):
+            if not (filename.startswith("device_") and filename.endswith(".json")):
+                continue
+            if filename.endswith(".summary.json"):
+                os.remove(os.path.join(self.log_dir, filename))
+                continue
+            try:
+                device_id = int(filename[7:-5])
+            except ValueError:
+                continue
+            
+            legacy_file = self._get_legacy_log_file_path(device_id)
+            try:
+                with open(legacy_file, 'r', encoding='utf-8') as f:
+                    logs = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                logs = []
+            
+            with self._get_device_lock(device_id):
+                if logs:
+                    self._write_entries(device_id, logs)
+                os.remove(legacy_file)
+    
+    def _list_segments(self, device_id: int) -> List[Tuple[int, bool]]:
+        """列出设备的日志段 [(段序号, 是否为写入中的明文段)]，按序号升序"""
+        device_dir = self._get_device_dir(device_id)
+        try:
+            filenames = os.listdir(device_dir)
+        except OSError:
+            return []
+        
+        with self.map_lock:
+            deferred = {os.path.basename(path) for path in self.deferred_unlinks
+                        if os.path.dirname(path) == device_dir}
+        
+        hot = set()
+        cold = set()
+        for filename in filenames:
+            if filename in deferred:
+                # 已封存、等待读取方释放映射后删除的明文段
+                continue
+            for suffix, target in ((HOT_SUFFIX, hot), (INDEX_SUFFIX, cold)):
+                if filename.endswith(suffix):
+                    try:
+                        target.add(int(filename[:-len(suffix)]))
+                    except ValueError:
+                        pass
+        
+        # 封存过程中断时明文段仍然存在，以明文段为准
+        segments = [(seq, True) for seq in hot]
+        segments += [(seq, False) for seq in cold - hot]
+        return sorted(segments)
+    
+    def _get_hot_segment(self, device_id: int) -> Tuple[int, int]:
+        """获取设备当前写入段 (段序号, 条目数)，调用方需持有设备锁"""
+        if device_id in self.hot_segments:
+            return self.hot_segments[device_id]
+        
+        segments = self._list_segments(device_id)
+        if segments and segments[-1][1]:
+            seq = segments[-1][0]
+            with open(self._get_segment_path(device_id, seq, HOT_SUFFIX), 'rb') as f:
+                count = sum(1 for line in f if line.strip())
+        else:
+            seq = segments[-1][0] + 1 if segments else 1
+            count = 0
+        
+        self.hot_segments[device_id] = (seq, count)
+        return seq, count
+    
+    def _write_entries(self, device_id: int, entries: List[Dict]) -> bool:
+        """将条目追加到当前写入段，写满时封存，调用方需持有设备锁
+        
+        返回本次是否封存了日志段。
+        """
+        os.makedirs(self._get_device_dir(device_id), exist_ok=True)
+        seq, count = self._get_hot_segment(device_id)
+        sealed = False
+        
+        try:
+            index = 0
+            while index < len(entries):
+                chunk = entries[index:index + SEGMENT_MAX_ENTRIES - count]
+                with open(self._get_segment_path(device_id, seq, HOT_SUFFIX), 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in chunk))
+                count += len(chunk)
+                index += len(chunk)
+                
+                if count >= SEGMENT_MAX_ENTRIES:
+                    self._seal_segment(device_id, seq)
+                    seq, count = seq + 1, 0
+                    sealed = True
+                self.hot_segments[device_id] = (seq, count)
+        except (IOError, OSError):
+            # 写入状态未知，下次重新从磁盘确定当前段
+            self.hot_segments.pop(device_id, None)
+            raise
+        
+        return sealed
+    
+    def _seal_segment(self, device_id: int, seq: int):
+        """封存日志段：按块压缩并写入块索引，然后删除明文段"""
+        hot_path = self._get_segment_path(device_id, seq, HOT_SUFFIX)
+        cold_path = self._get_segment_path(device_id, seq, COLD_SUFFIX)
+        index_path = self._get_segment_path(device_id, seq, INDEX_SUFFIX)
+        compress = _CODECS[self.compression][0]
+        
+        with open(hot_path, 'rb') as f:
+            lines = [line for line in f.read().split(b'\n') if line.strip()]
+        
+        blocks = []
+        log_types = {}
+        offset = 0
+        raw_total = 0
+        with open(cold_path + ".tmp", 'wb') as f:
+            for start in range(0, len(lines), BLOCK_ENTRIES):
+                block_lines = []
+                timestamps = []
+                for line in lines[start:start + BLOCK_ENTRIES]:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 跳过异常中断留下的残缺行
+                        continue
+                    block_lines.append(line)
+                    timestamps.append(entry.get("timestamp", ""))
+                    log_type = entry.get("type", "unknown")
+                    log_types[log_type] = log_types.get(log_type, 0) + 1
+                if not block_lines:
+                    continue
+                
+                raw = b'\n'.join(block_lines) + b'\n'
+                data = compress(raw)
+                f.write(data)
+                blocks.append({
+                    "offset": offset,
+                    "length": len(data),
+                    "count": len(block_lines),
+                    "first": min(timestamps),
+                    "last": max(timestamps),
+                })
+                offset += len(data)
+                raw_total += len(raw)
+        
+        index = {
+            "codec": self.compression,
+            "count": sum(block["count"] for block in blocks),
+            "first": min(block["first"] for block in blocks) if blocks else None,
+            "last": max(block["last"] for block in blocks) if blocks else None,
+            "raw_bytes": raw_total,
+            "stored_bytes": offset,
+            "log_types": log_types,
+            "blocks": blocks
+        }
+        
+        os.replace(cold_path + ".tmp", cold_path)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+        self._unlink_hot_segment(hot_path)
+        self._retry_deferred_unlinks()
+    
+    def _unlink_hot_segment(self, path: str):
+        """删除明文段文件，仍有读取方映射或文件被占用时推迟到释放后删除"""
+        with self.map_lock:
+            if self.hot_map_refs.get(path):
+                self.deferred_unlinks.add(path)
+                return
+            self._try_unlink(path)
+    
+    def _try_unlink(self, path: str):
+        """删除文件，失败时记入推迟删除集合，调用方需持有映射锁"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows下文件仍被其他句柄打开，稍后重试
+            self.deferred_unlinks.add(path)
+            return
+        self.deferred_unlinks.discard(path)
+    
+    def _retry_deferred_unlinks(self):
+        """重试删除已无读取方映射的推迟删除文件"""
+        with self.map_lock:
+            for path in [p for p in self.deferred_unlinks if not self.hot_map_refs.get(p)]:
+                self._try_unlink(path)
+    
+    def _load_segment_index(self, device_id: int, seq: int) -> Optional[Dict]:
+        """加载压缩段的块索引"""
+        try:
+            with open(self._get_segment_path(device_id, seq, INDEX_SUFFIX), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+    
+    def _remove_segment(self, device_id: int, seq: int):
+        """删除日志段的所有文件"""
+        for suffix in (COLD_SUFFIX, INDEX_SUFFIX):
+            path = self._get_segment_path(device_id, seq, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        self._unlink_hot_segment(self._get_segment_path(device_id, seq, HOT_SUFFIX))
+    
+    def _enforce_segment_limit(self, device_id: int, summary: Dict):
+        """删除超出 MAX_SEGMENTS 的最旧封存段，并从摘要中扣除其计数"""
+        segments = self._list_segments(device_id)
+        dropped = False
+        while len(segments) > MAX_SEGMENTS and not segments[0][1]:
+            seq = segments.pop(0)[0]
+            index = self._load_segment_index(device_id, seq)
+            self._remove_segment(device_id, seq)
+            if index:
+                self._subtract_from_summary(summary, index["log_types"])
+            dropped = True
+        
+        if dropped:
+            summary["first_log"] = self._get_first_timestamp(device_id, segments)
+    
+    def _get_first_timestamp(self, device_id: int, segments: List[Tuple[int, bool]]) -> Optional[str]:
+        """获取最旧日志段的首条时间戳"""
+        for seq, is_hot in segments:
+            if is_hot:
+                for entry in self._read_hot_entries(device_id, seq):
+                    return entry.get("timestamp")
+            else:
+                index = self._load_segment_index(device_id, seq)
+                if index and index["count"]:
+                    return index["first"]
+        return None
+    
+    def _read_hot_entries(self, device_id: int, seq: int) -> List[Dict]:
+        """读取明文段的全部条目"""
+        entries = []
+        try:
+            with open(self._get_segment_path(device_id, seq, HOT_SUFFIX), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except IOError:
+            pass
+        return entries
+    
+    def _hot_segment_extent(self, device_id: int, seq: int) -> Optional[Tuple[int, int]]:
+        """记录明文段当前已写入的范围，返回 (字节数, 段内条目数)，调用方需持有设备锁
+        
+        明文段只追加，读取时只映射该范围，释放锁后继续写入不影响读取结果。
+        """
+        path = self._get_segment_path(device_id, seq, HOT_SUFFIX)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        if size == 0:
+            return None
+        
+        hot_seq, count = self._get_hot_segment(device_id)
+        if hot_seq != seq:
+            # 封存中断遗留的旧明文段，逐行计数
+            try:
+                with open(path, 'rb') as f:
+                    count = sum(1 for line in f.read(size).split(b'\n') if line.strip())
+            except (IOError, OSError):
+                return None
+        return size, count
+    
+    def _map_hot_segment(self, path: str, size: int) -> Optional[mmap.mmap]:
+        """映射明文段的前size字节并登记引用，映射与封存删除互斥"""
+        with self.map_lock:
+            try:
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError):
+                return None
+            self.hot_map_refs[path] = self.hot_map_refs.get(path, 0) + 1
+            return mapped
+    
+    def _release_hot_map(self, path: str, mapped: mmap.mmap):
+        """关闭映射，最后一个读取方释放时执行推迟的删除"""
+        mapped.close()
+        with self.map_lock:
+            refs = self.hot_map_refs.get(path, 1) - 1
+            if refs > 0:
+                self.hot_map_refs[path] = refs
+                return
+            self.hot_map_refs.pop(path, None)
+            if path in self.deferred_unlinks:
+                self._try_unlink(path)
+    
+    def _iter_hot_entries(self, device_id: int, seq: int, extent: Tuple[int, int], reverse: bool = False,
+                          bound: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        """遍历明文段记录范围内的条目，产出 (段内序号, 条目)
+        
+        映射在开始遍历时才建立，未开始遍历的生成器不占用映射；
+        记录范围之后该段已封存删除时，改为从同一序号的压缩段读取相同范围的条目。
+        反向遍历从末尾向前查找换行符，只解析实际取用的行，读取最近N条的开销只与N有关；
+        bound 为排他边界，边界另一侧的行直接跳过不解析。
+        """
+        size, count = extent
+        path = self._get_segment_path(device_id, seq, HOT_SUFFIX)
+        mapped = self._map_hot_segment(path, size)
+        if mapped is None:
+            yield from self._iter_sealed_range(device_id, seq, count, reverse, bound)
+            return
+        
+        try:
+            if not reverse:
+                index = 0
+                start = 0
+                while start < size:
+                    end = mapped.find(b'\n', start)
+                    if end == -1:
+                        end = size
+                    line = mapped[start:end]
+                    start = end + 1
+                    if not line.strip():
+                        continue
+                    index += 1
+                    if bound is not None and index - 1 <= bound:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield index - 1, entry
+                return
+            
+            index = count
+            end = size - 1 if mapped[size - 1:size] == b'\n' else size
+            while end > 0:
+                start = mapped.rfind(b'\n', 0, end) + 1
+                line = mapped[start:end]
+                end = start - 1
+                if not line.strip():
+                    continue
+                index -= 1
+                if bound is not None and index >= bound:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                yield index, entry
+        finally:
+            self._release_hot_map(path, mapped)
+    
+    def _iter_sealed_range(self, device_id: int, seq: int, count: int, reverse: bool = False,
+                           bound: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        """明文段已封存：从压缩段读取前count条，产出 (段内序号, 条目)"""
+        index = self._load_segment_index(device_id, seq)
+        if not index or not index["count"]:
+            return
+        if reverse:
+            bound = count if bound is None else min(bound, count)
+        position = (seq, bound) if bound is not None else None
+        blocks = self._read_cold_blocks(device_id, seq, index, reverse=reverse, position=position)
+        for offset, entry in self._iter_cold_entries(blocks, reverse, bound):
+            if offset >= count:
+                if reverse:
+                    continue
+                return
+            yield offset, entry
+    
+    def _read_cold_blocks(self, device_id: int, seq: int, index: Dict,
+                          start_time: Optional[str] = None, end_time: Optional[str] = None,
+                          reverse: bool = False,
+                          position: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[int, List[Dict]]]:
+        """按块读取压缩段，只解压与时间范围有交集、且位于position之外的块
+        
+        产出 (块内首条目在段内的序号, 条目列表)。
+        """
+        decompress = _CODECS[index.get("codec", COMPRESSION)][1]
+        blocks = []
+        base = 0
+        for block in index["blocks"]:
+            blocks.append((base, block))
+            base += block["count"]
+        if reverse:
+            blocks.reverse()
+        
+        try:
+            f = open(self._get_segment_path(device_id, seq, COLD_SUFFIX), 'rb')
+        except IOError:
+            # 读取期间该段可能已被保留策略删除
+            return
+        
+        with f:
+            for base, block in blocks:
+                if start_time and block["last"] < start_time:
+                    continue
+                if end_time and block["first"] > end_time:
+                    continue
+                if position is not None and position[0] == seq:
+                    if reverse and base >= position[1]:
+                        continue
+                    if not reverse and base + block["count"] <= position[1] + 1:
+                        continue
+                
+                started = time.perf_counter()
+                f.seek(block["offset"])
+                raw = decompress(f.read(block["length"]))
+                entries = [json.loads(line) for line in raw.split(b'\n') if line]
+                elapsed = time.perf_counter() - started
+                
+                with self.stats_lock:
+                    self.read_stats["blocks_read"] += 1
+                    self.read_stats["entries_read"] += len(entries)
+                    self.read_stats["bytes_decompressed"] += len(raw)
+                    self.read_stats["seconds"] += elapsed
+                
+                yield base, entries
+    
+    def _iter_positioned_entries(self, device_id: int, start_time: Optional[str] = None,
+                                 end_time: Optional[str] = None, reverse: bool = False,
+                                 position: Optional[Tuple[int, int]] = None
+                                 ) -> Iterator[Tuple[Tuple[int, int], Dict]]:
+        """按存储顺序遍历设备日志，产出 ((段序号, 段内序号), 条目)
+        
+        position 为排他边界：正向时只返回其后的条目，反向时只返回其前的条目，
+        位于边界另一侧的段和块直接跳过，翻页开销只与页大小有关。
+        只在获取段列表和记录明文段范围时持有设备锁，明文段与压缩段都在锁外按需映射和解析。
+        """
+        with self._get_device_lock(device_id):
+            snapshot = []
+            for seq, is_hot in self._list_segments(device_id):
+                if position is not None:
+                    if reverse and seq > position[0]:
+                        continue
+                    if not reverse and seq < position[0]:
+                        continue
+                snapshot.append((seq, is_hot, self._hot_segment_extent(device_id, seq) if is_hot else None))
+        
+        if reverse:
+            snapshot.reverse()
+        
+        for seq, is_hot, extent in snapshot:
+            bound = position[1] if position is not None and position[0] == seq else None
+            if is_hot:
+                if extent is None:
+                    continue
+                indexed = self._iter_hot_entries(device_id, seq, extent, reverse, bound)
+            else:
+                # 封存段不可变，索引可以在锁外加载
+                index = self._load_segment_index(device_id, seq)
+                if not index or not index["count"]:
+                    continue
+                if start_time and index["last"] < start_time:
+                    continue
+                if end_time and index["first"] > end_time:
+                    continue
+                indexed = self._iter_cold_entries(
+                    self._read_cold_blocks(device_id, seq, index, start_time, end_time, reverse, position),
+                    reverse, bound
+                )
+            
+            for offset, entry in indexed:
+                log_time = entry.get("timestamp", "")
+                if start_time and log_time < start_time:
+                    continue
+                if end_time and log_time > end_time:
+                    continue
+                yield (seq, offset), entry
+    
+    def _iter_cold_entries(self, blocks: Iterator[Tuple[int, List[Dict]]], reverse: bool = False,
+                           bound: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        """展开压缩段的块，产出 (段内序号, 条目)，bound 为排他边界"""
+        for base, entries in blocks:
+            offsets = range(len(entries) - 1, -1, -1) if reverse else range(len(entries))
+            for offset in offsets:
+                if bound is not None and ((base + offset >= bound) if reverse else (base + offset <= bound)):
+                    continue
+                yield base + offset, entries[offset]
+    
+    def _iter_device_entries(self, device_id: int, start_time: Optional[str] = None,
+                             end_time: Optional[str] = None, reverse: bool = False) -> Iterator[Dict]:
+        """按时间顺序遍历设备日志（明文段与压缩段透明合并）"""
+        for _, entry in self._iter_positioned_entries(device_id, start_time, end_time, reverse):
+            yield entry
+    
+    def _load_summaries(self):
+        """启动时加载所有设备的日志摘要，缺失的摘要从日志段重建一次"""
+        for device_id in self.get_all_device_ids():
+            summary = None
+            try:
+                with open(self._get_summary_file_path(device_id), 'r', encoding='utf-8') as f:
+                    summary = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                pass
+            
+            if summary is None:
+                summary = _empty_summary()
+                logs = list(self._iter_device_entries(device_id))
+                self._apply_to_summary(summary, logs, 1)
+                summary["first_log"] = logs[0]["timestamp"] if logs else None
+                summary["last_log"] = logs[-1]["timestamp"] if logs else None
+                self._save_summary(device_id, summary)
+            
+            self.summaries[device_id] = summary
+    
+    def _save_summary(self, device_id: int, summary: Dict) -> bool:
+        """保存设备日志摘要"""
+        try:
+            with open(self._get_summary_file_path(device_id), 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False)
+            return True
+        except IOError:
+            return False
+    
+    def _apply_to_summary(self, summary: Dict, entries: List[Dict], sign: int):
+        """将日志条目计入(sign=1)或移出(sign=-1)摘要计数"""
+        log_types = summary["log_types"]
+        for entry in entries:
+            log_type = entry.get("type", "unknown")
+            count = log_types.get(log_type, 0) + sign
+            if count > 0:
+                log_types[log_type] = count
+            else:
+                log_types.pop(log_type, None)
+            summary["total_logs"] += sign
+            
+            # 最后报警时间只随新条目前进，裁剪旧条目不影响
+            if sign > 0 and log_type == "alarm":
+                summary["last_alarm"] = entry.get("timestamp")
+    
+    def _subtract_from_summary(self, summary: Dict, log_types: Dict):
+        """按类型计数从摘要中扣除被删除日志段的条目"""
+        for log_type, count in log_types.items():
+            remaining = summary["log_types"].get(log_type, 0) - count
+            if remaining > 0:
+                summary["log_types"][log_type] = remaining
+            else:
+                summary["log_types"].pop(log_type, None)
+            summary["total_logs"] = max(0, summary["total_logs"] - count)
+    
+    def _build_log_entry(self, log_type: str, message: str, wifi_rssi: int,
+                         source_ip: str, additional_data: Optional[Dict]) -> Dict:
+        """构造日志条目（时间戳取事件发生时间，而不是写盘时间）"""
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "type": log_type,
+            "message": message,
+            "wifi_rssi": wifi_rssi,
+            "source_ip": source_ip
+        }
+        
+        if additional_data:
+            log_entry.update(additional_data)
+        
+        return log_entry
+    
+    def _append_log_entries(self, device_id: int, entries: List[Dict]) -> bool:
+        """将一批日志条目追加到设备日志"""
+        with self._get_device_lock(device_id):
+            with self.summary_lock:
+                summary = self.summaries.get(device_id) or _empty_summary()
+                summary = dict(summary, log_types=dict(summary["log_types"]))
+            
+            try:
+                sealed = self._write_entries(device_id, entries)
+            except (IOError, OSError) as e:
+                logger.error(f"写入设备 {device_id} 日志段失败: {e}")
+                return False
+            
+            self._apply_to_summary(summary, entries, 1)
+            if summary["first_log"] is None:
+                summary["first_log"] = entries[0]["timestamp"]
+            summary["last_log"] = entries[-1]["timestamp"]
+            
+            # 只有封存了新段时才可能超出段数量上限
+            if sealed:
+                self._enforce_segment_limit(device_id, summary)
+            
+            self._save_summary(device_id, summary)
+            with self.summary_lock:
+                self.summaries[device_id] = summary
+            return True
+    
+    def add_log_entry(self, device_id: int, log_type: str, message: str,
+                     wifi_rssi: int = 0, source_ip: str = "",
+                     additional_data: Optional[Dict] = None) -> bool:
+        """添加日志条目（同步写盘）"""
+        log_entry = self._build_log_entry(log_type, message, wifi_rssi, source_ip, additional_data)
+        return self._append_log_entries(device_id, [log_entry])
+    
+    def enqueue_log_entry(self, device_id: int, log_type: str, message: str,
+                          wifi_rssi: int = 0, source_ip: str = "",
+                          additional_data: Optional[Dict] = None) -> bool:
+        """添加日志条目（放入后台队列，不等待磁盘I/O）"""
+        log_entry = self._build_log_entry(log_type, message, wifi_rssi, source_ip, additional_data)
+        try:
+            # 队列已满时等待后台线程腾出空间；不直接同步写盘，
+            # 否则该条目可能先于同一设备仍在队列中的旧条目写入，破坏日志段内的时间顺序
+            self.log_queue.put((device_id, log_entry), timeout=LOG_QUEUE_PUT_TIMEOUT)
+            return True
+        except Full:
+            self._count_dropped(1)
+            logger.error(f"日志写入队列已满，丢弃设备 {device_id} 的日志条目")
+            return False
+    
+    def _count_dropped(self, count: int):
+        with self.stats_lock:
+            self.dropped_entries += count
+    
+    def _writer_loop(self):
+        """后台写入线程：批量取出队列条目，按设备合并后一次写盘"""
+        while True:
+            batch = [self.log_queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except Empty:
+                    break
+            
+            grouped = {}
+            for device_id, log_entry in batch:
+                grouped.setdefault(device_id, []).append(log_entry)
+            
+            for device_id, entries in grouped.items():
+                try:
+                    written = self._append_log_entries(device_id, entries)
+                except Exception as e:
+                    logger.error(f"写入设备 {device_id} 日志错误: {e}")
+                    written = False
+                if not written:
+                    self._count_dropped(len(entries))
+                    logger.error(f"设备 {device_id} 的 {len(entries)} 条日志未能写入，已丢弃")
+            
+            for _ in batch:
+                self.log_queue.task_done()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待后台队列中的日志全部写盘，timeout 秒内未写完时返回False"""
+        if timeout is None:
+            self.log_queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        with self.log_queue.all_tasks_done:
+            while self.log_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.log_queue.all_tasks_done.wait(remaining)
+        return True
+    
+    def get_device_logs(self, device_id: int, limit: int = 100) -> List[Dict]:
+        """获取设备日志"""
+        if limit <= 0:
+            return []
+        logs = list(islice(self._iter_device_entries(device_id, reverse=True), limit))
+        logs.reverse()
+        return logs
+    
+    def get_device_log_summary(self, device_id: int) -> Dict:
+        """获取设备日志摘要（直接读取增量维护的计数器）"""
+        with self.summary_lock:
+            summary = self.summaries.get(device_id)
+            if not summary:
+                return _empty_summary()
+            return dict(summary, log_types=dict(summary["log_types"]))
+    
+    def get_fleet_log_summary(self) -> Dict:
+        """汇总所有设备的日志摘要（不读取任何日志文件）"""
+        fleet = _empty_summary()
+        fleet["device_count"] = 0
+        
+        with self.summary_lock:
+            summaries = list(self.summaries.values())
+        
+        for summary in summaries:
+            if not summary["total_logs"]:
+                continue
+            fleet["device_count"] += 1
+            fleet["total_logs"] += summary["total_logs"]
+            for log_type, count in summary["log_types"].items():
+                fleet["log_types"][log_type] = fleet["log_types"].get(log_type, 0) + count
+            
+            # ISO格式时间戳可以直接按字符串比较
+            for key, pick in (("first_log", min), ("last_log", max), ("last_alarm", max)):
+                if summary.get(key):
+                    fleet[key] = pick(fleet[key], summary[key]) if fleet[key] else summary[key]
+        
+        return fleet
+    
+    def search_logs(self, device_id: int, log_type: Optional[str] = None,
+                   start_time: Optional[str] = None, end_time: Optional[str] = None,
+                   limit: int = 100) -> List[Dict]:
+        """搜索设备日志（明文段和压缩段透明读取，返回最近的limit条）"""
+        if limit <= 0:
+            return []
+        
+        matched = (
+            log for log in self._iter_device_entries(device_id, start_time, end_time, reverse=True)
+            if not log_type or log.get("type") == log_type
+        )
+        logs = list(islice(matched, limit))
+        logs.reverse()
+        return logs
+    
+    def get_device_logs_page(self, device_id: int, limit: int = 100, cursor: Optional[str] = None,
+                             log_type: Optional[str] = None, start_time: Optional[str] = None,
+                             end_time: Optional[str] = None) -> Dict:
+        """按游标分页读取设备日志，从最新向更早翻页
+        
+        返回 {"logs": 按时间升序的本页条目, "next": 更早一页的游标, "prev": 更新一页的游标}，
+        没有对应页时游标为None。游标无效时抛出ValueError。
+        """
+        position = None
+        reverse = True
+        if cursor:
+            data = decode_cursor(cursor)
+            try:
+                seq, offset = data["pos"]
+                position = (int(seq), int(offset))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"无效的游标: {cursor}") from e
+            reverse = data["dir"] == "before"
+        
+        matched = (
+            (pos, log) for pos, log in self._iter_positioned_entries(
+                device_id, start_time, end_time, reverse, position)
+            if not log_type or log.get("type") == log_type
+        )
+        page = list(islice(matched, max(0, limit) + 1))
+        has_more = len(page) > limit
+        page = page[:max(0, limit)]
+        if reverse:
+            page.reverse()
+        
+        if not page:
+            return {"logs": [], "next": None, "prev": None}
+        
+        # 翻页方向上是否还有数据由多取的一条判断，另一方向在带游标时必然存在
+        older = has_more if reverse else position is not None
+        newer = position is not None if reverse else has_more
+        return {
+            "logs": [log for _, log in page],
+            "next": encode_cursor({"dir": "before", "pos": page[0][0]}) if older else None,
+            "prev": encode_cursor({"dir": "after", "pos": page[-1][0]}) if newer else None
+        }
+    
+    def iter_timeline_keyed(self, device_ids: Optional[List[int]] = None,
+                            log_type: Optional[str] = None, start_time: Optional[str] = None,
+                            end_time: Optional[str] = None, reverse: bool = False,
+                            after_key: Optional[Tuple] = None) -> Iterator[Tuple[Tuple, Dict]]:
+        """多设备合并时间线：对各设备日志做惰性k路归并，产出 (排序键, 条目)
+        
+        排序键为 (时间戳, 设备ID, 段序号, 段内序号)，可直接用作翻页游标；
+        after_key 为排他边界（反向时表示其之前）。条目附带device_id。
+        每个设备同时只驻留一个压缩块（或当前写入段），内存占用与结果数量无关。
+        """
+        if device_ids is None:
+            device_ids = self.get_all_device_ids()
+        
+        if after_key is not None:
+            # 先用边界时间缩小范围以跳过无关的段和块，再按完整排序键精确过滤
+            if reverse:
+                end_time = min(end_time, after_key[0]) if end_time else after_key[0]
+            else:
+                start_time = max(start_time, after_key[0]) if start_time else after_key[0]
+        
+        def device_stream(device_id):
+            for pos, entry in self._iter_positioned_entries(device_id, start_time, end_time, reverse):
+                if log_type and entry.get("type") != log_type:
+                    continue
+                key = (entry.get("timestamp", ""), device_id) + pos
+                if after_key is not None and ((key >= after_key) if reverse else (key <= after_key)):
+                    continue
+                entry["device_id"] = device_id
+                yield key, entry
+        
+        streams = [device_stream(device_id) for device_id in device_ids]
+        return heapq.merge(*streams, key=lambda item: item[0], reverse=reverse)
+    
+    def iter_timeline(self, device_ids: Optional[List[int]] = None, log_type: Optional[str] = None,
+                      start_time: Optional[str] = None, end_time: Optional[str] = None,
+                      reverse: bool = False) -> Iterator[Dict]:
+        """多设备合并时间线，只产出条目"""
+        for _, entry in self.iter_timeline_keyed(device_ids, log_type, start_time, end_time, reverse):
+            yield entry
+    
+    def get_storage_stats(self) -> Dict:
+        """获取日志存储统计：压缩率与压缩段读取吞吐"""
+        cold_segments = 0
+        raw_bytes = 0
+        stored_bytes = 0
+        hot_bytes = 0
+        
+        for device_id in self.get_all_device_ids():
+            for seq, is_hot in self._list_segments(device_id):
+                if is_hot:
+                    try:
+                        hot_bytes += os.path.getsize(self._get_segment_path(device_id, seq, HOT_SUFFIX))
+                    except OSError:
+                        pass
+                    continue
+                index = self._load_segment_index(device_id, seq)
+                if index:
+                    cold_segments += 1
+                    raw_bytes += index["raw_bytes"]
+                    stored_bytes += index["stored_bytes"]
+        
+        with self.stats_lock:
+            read_stats = dict(self.read_stats)
+            dropped_entries = self.dropped_entries
+        seconds = read_stats["seconds"]
+        read_stats["entries_per_second"] = round(read_stats["entries_read"] / seconds) if seconds else 0
+        read_stats["mb_per_second"] = (
+            round(read_stats["bytes_decompressed"] / seconds / (1024 * 1024), 2) if seconds else 0
+        )
+        
+        return {
+            "codec": self.compression,
+            "cold_segments": cold_segments,
+            "cold_raw_bytes": raw_bytes,
+            "cold_stored_bytes": stored_bytes,
+            "compression_ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+            "hot_bytes": hot_bytes,
+            "queued_entries": self.log_queue.qsize(),
+            "dropped_entries": dropped_entries,
+            "read": read_stats
+        }
+    
+    def get_disk_usage(self) -> int:
+        """获取日志目录占用的字节数"""
+        total = 0
+        for root, _, files in os.walk(self.log_dir):
+            for filename in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    continue
+        return total
+    
+    def evict_oldest_segment(self) -> int:
+        """删除所有设备中最旧的一个封存段，返回释放的字节数（没有可删除的封存段时返回0）"""
+        oldest = None
+        for device_id in self.get_all_device_ids():
+            for seq, is_hot in self._list_segments(device_id):
+                if is_hot:
+                    break
+                index = self._load_segment_index(device_id, seq)
+                if index and (oldest is None or index["first"] < oldest[0]):
+                    oldest = (index["first"], device_id, seq)
+                break
+        if oldest is None:
+            return 0
+        
+        _, device_id, seq = oldest
+        with self._get_device_lock(device_id):
+            segments = self._list_segments(device_id)
+            if not segments or segments[0] != (seq, False):
+                return 0
+            
+            freed = 0
+            for suffix in (COLD_SUFFIX, INDEX_SUFFIX):
+                try:
+                    freed += os.path.getsize(self._get_segment_path(device_id, seq, suffix))
+                except OSError:
+                    pass
+            index = self._load_segment_index(device_id, seq)
+            self._remove_segment(device_id, seq)
+            
+            with self.summary_lock:
+                summary = self.summaries.get(device_id) or _empty_summary()
+                summary = dict(summary, log_types=dict(summary["log_types"]))
+            if index:
+                self._subtract_from_summary(summary, index["log_types"])
+            summary["first_log"] = self._get_first_timestamp(device_id, segments[1:])
+            self._save_summary(device_id, summary)
+            with self.summary_lock:
+                self.summaries[device_id] = summary
+            return freed
+    
+    def clear_device_logs(self, device_id: int) -> bool:
+        """清空设备日志"""
+        with self._get_device_lock(device_id):
+            try:
+                device_dir = self._get_device_dir(device_id)
+                if os.path.exists(device_dir):
+                    shutil.rmtree(device_dir)
+                self.hot_segments.pop(device_id, None)
+                with self.summary_lock:
+                    self.summaries.pop(device_id, None)
+                return True
+            except OSError:
+                return False
+    
+    def get_all_device_ids(self) -> List[int]:
+        """获取所有有日志的设备ID"""
+        device_ids = []
+        for filename in os.listdir(self.log_dir):
+            if filename.startswith("device_") and \
+                    os.path.isdir(os.path.join(self.log_dir, filename)):
+                try:
+                    device_id = int(filename[7:])  # 提取device_XXX中的XXX
+                    device_ids.append(device_id)
+                except ValueError:
+                    continue
+        return sorted(device_ids)
+    
+    def backup_logs(self, backup_dir: str = "backup_logs") -> Optional[str]:
+        """增量备份所有日志，返回快照路径（失败时返回None）
+        
+        封存段不可变，与上一个快照相同的直接硬链接；写入中的明文段与摘要在设备锁内读入内存，
+        其余复制都在锁外限速进行，备份期间日志写入不受影响。
+        """
+        if not self.flush(BACKUP_FLUSH_TIMEOUT):
+            logger.warning(f"日志队列 {BACKUP_FLUSH_TIMEOUT} 秒内未写完，本次备份不包含尚未写盘的日志")
+        try:
+            writer = SnapshotWriter(backup_dir, "device_logs_backup_")
+        except Exception:
+            return None
+        
+        try:
+            for device_id in self.get_all_device_ids():
+                device_name = os.path.basename(self._get_device_dir(device_id))
+                with self._get_device_lock(device_id):
+                    segments = self._list_segments(device_id)
+                    mutable = {}
+                    for seq, is_hot in segments:
+                        if is_hot:
+                            with open(self._get_segment_path(device_id, seq, HOT_SUFFIX), 'rb') as f:
+                                mutable[f"{seq:08d}{HOT_SUFFIX}"] = f.read()
+                    try:
+                        with open(self._get_summary_file_path(device_id), 'rb') as f:
+                            mutable[os.path.basename(self._get_summary_file_path(device_id))] = f.read()
+                    except IOError:
+                        pass
+                
+                for filename, data in mutable.items():
+                    writer.add_bytes(os.path.join(device_name, filename), data)
+                for seq, is_hot in segments:
+                    if is_hot:
+                        continue
+                    try:
+                        for suffix in (COLD_SUFFIX, INDEX_SUFFIX):
+                            writer.add_immutable(os.path.join(device_name, f"{seq:08d}{suffix}"),
+                                                 self._get_segment_path(device_id, seq, suffix))
+                    except (IOError, OSError):
+                        # 备份期间该段已被保留策略删除
+                        continue
+            
+            return writer.commit()
+        except Exception:
+            writer.abort()
+            return None
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 汇总层级: (名称, 区间宽度秒, 保留时长秒)，由细到粗排列，
+# 每一层由上一层封闭的区间降采样得到
+TIERS = (
+    ("minute", 60, 2 * 86400),
+    ("hour", 3600, 90 * 86400),
+    ("day", 86400, 3 * 365 * 86400),
+)
+# 后台线程封闭过期区间并写盘的间隔(秒)
+FLUSH_INTERVAL = 30
+# 最早区间超出保留时长多少比例后才重写文件裁剪，避免每次写盘都重写
+RETENTION_SLACK = 0.1
+# 未指定step时，所选层级在查询范围内至少应有的区间数
+DEFAULT_MIN_POINTS = 12
+# 每个设备保留的RSSI采样数量
+RSSI_RING_SIZE = 1024
+# RSSI二进制导出格式头: 魔数, 版本, 采样数
+RSSI_BLOB_HEADER = struct.Struct('<4sBI')
+RSSI_BLOB_MAGIC = b'RSSI'
+
+def _new_bucket(start: int) -> Dict:
+    """空的汇总区间"""
+    return {"t": start, "counts": {}, "rssi_min": None, "rssi_max": None, "rssi_sum": 0, "rssi_n": 0}
+
+def _merge_bucket(dst: Dict, src: Dict):
+    """将src区间的计数与RSSI统计合并进dst"""
+    counts = dst["counts"]
+    for cmd, count in src["counts"].items():
+        counts[cmd] = counts.get(cmd, 0) + count
+    if src["rssi_n"]:
+        dst["rssi_min"] = src["rssi_min"] if dst["rssi_min"] is None else min(dst["rssi_min"], src["rssi_min"])
+        dst["rssi_max"] = src["rssi_max"] if dst["rssi_max"] is None else max(dst["rssi_max"], src["rssi_max"])
+        dst["rssi_sum"] += src["rssi_sum"]
+        dst["rssi_n"] += src["rssi_n"]
+
+def _format_bucket(bucket: Dict) -> Dict:
+    """汇总区间转换为API输出格式"""
+    n = bucket["rssi_n"]
+    return {
+        "start": bucket["t"],
+        "time": datetime.fromtimestamp(bucket["t"]).isoformat(),
+        "counts": bucket["counts"],
+        "rssi_min": bucket["rssi_min"],
+        "rssi_max": bucket["rssi_max"],
+        "rssi_mean": round(bucket["rssi_sum"] / n, 1) if n else None,
+        "samples": n
+    }
+
+class MetricsRollup:
+    """设备指标时序汇总
+
+    按设备维护每分钟的命令计数与RSSI最小/最大/均值，分钟区间封闭后
+    合并进当前小时区间，小时封闭后合并进当前天区间。封闭的区间追加写入
+    device_metrics/device_N/<层级>.jsonl，各层按自己的保留时长裁剪。
+    采集路径只更新内存中的当前区间，写盘由后台线程完成。
+    """
+
+    def __init__(self, metrics_dir: str = "device_metrics", flush_interval: int = FLUSH_INTERVAL):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        # 文件读写锁，与内存区间的锁分开，写盘期间采集不阻塞
+        self.io_lock = threading.Lock()
+
+        # 每个设备各层级正在累计的区间: {device_id: [分钟区间, 小时区间, 天区间]}
+        self.open_buckets = {}
+        # 已封闭待写盘的区间: [(device_id, 层级序号, 区间)]
+        self.pending = []
+        # 各设备各层级文件中最早区间的起始时间，用于判断是否需要裁剪
+        self.oldest = {}
+
+        if not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir)
+
+        self._load()
+
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def _get_tier_path(self, device_id: int, tier: int) -> str:
+        """获取设备某层级的汇总文件路径"""
+        return os.path.join(self.metrics_dir, f"device_{device_id}", f"{TIERS[tier][0]}.jsonl")
+
+    def _read_tier(self, device_id: int, tier: int, start: Optional[int] = None,
+                   end: Optional[int] = None) -> List[Dict]:
+        """读取设备某层级文件中 [start, end) 范围内的区间"""
+        buckets = []
+        try:
+            with open(self._get_tier_path(device_id, tier), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        bucket = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if start is not None and bucket["t"] + TIERS[tier][1] <= start:
+                        continue
+                    if end is not None and bucket["t"] >= end:
+                        break
+                    buckets.append(bucket)
+        except IOError:
+            pass
+        return buckets
+
+    def _read_oldest(self, device_id: int, tier: int) -> Optional[int]:
+        """读取层级文件中最早区间的起始时间"""
+        try:
+            with open(self._get_tier_path(device_id, tier), 'r', encoding='utf-8') as f:
+                return json.loads(f.readline())["t"]
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def _append_buckets(self, device_id: int, tier: int, buckets: List[Dict]):
+        """将封闭的区间追加到层级文件"""
+        path = self._get_tier_path(device_id, tier)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for bucket in buckets:
+                f.write(json.dumps(bucket, separators=(',', ':')) + '\n')
+        self.oldest.setdefault((device_id, tier), buckets[0]["t"])
+
+    def _load(self):
+        """启动时从分钟/小时文件重建尚未封闭的小时/天区间
+
+        停机期间跨过边界的区间在此直接封闭写盘。
+        """
+        for name in os.listdir(self.metrics_dir):
+            if not name.startswith("device_"):
+                continue
+            try:
+                device_id = int(name[len("device_"):])
+            except ValueError:
+                continue
+
+            open_buckets = [None] * len(TIERS)
+            for tier in range(1, len(TIERS)):
+                width = TIERS[tier][1]
+                upper = self._read_tier(device_id, tier)
+                resume = upper[-1]["t"] + width if upper else None
+                lower = self._read_tier(device_id, tier - 1, resume)
+
+                groups = {}
+                for bucket in lower:
+                    start = bucket["t"] // width * width
+                    _merge_bucket(groups.setdefault(start, _new_bucket(start)), bucket)
+                starts = sorted(groups)
+                if starts:
+                    closed = [groups[start] for start in starts[:-1]]
+                    if closed:
+                        self._append_buckets(device_id, tier, closed)
+                    open_buckets[tier] = groups[starts[-1]]
+
+            self.open_buckets[device_id] = open_buckets
+            for tier in range(len(TIERS)):
+                oldest = self._read_oldest(device_id, tier)
+                if oldest is not None:
+                    self.oldest[(device_id, tier)] = oldest
+
+    def _close_buckets(self, device_id: int, now: float, tier: int = 0):
+        """封闭设备从tier层起已过期的区间，逐层降采样（调用方持有self.lock）"""
+        open_buckets = self.open_buckets[device_id]
+        while tier < len(TIERS):
+            bucket = open_buckets[tier]
+            width = TIERS[tier][1]
+            if bucket is None or bucket["t"] + width > now:
+                return
+
+            open_buckets[tier] = None
+            self.pending.append((device_id, tier, bucket))
+            if tier + 1 < len(TIERS):
+                upper_width = TIERS[tier + 1][1]
+                start = bucket["t"] // upper_width * upper_width
+                upper = open_buckets[tier + 1]
+                if upper is not None and upper["t"] < start:
+                    # 上一层区间已经过期，先封闭再开始新区间
+                    self._close_buckets(device_id, start, tier + 1)
+                    upper = open_buckets[tier + 1]
+                if upper is None:
+                    upper = open_buckets[tier + 1] = _new_bucket(start)
+                _merge_bucket(upper, bucket)
+            tier += 1
+
+    def record(self, device_id: int, cmd: str, wifi_rssi: Optional[int], timestamp: Optional[float] = None):
+        """记录一帧设备上报（采集路径调用，只更新内存中的分钟区间）"""
+        now = timestamp if timestamp is not None else time.time()
+        start = int(now) // 60 * 60
+        with self.lock:
+            open_buckets = self.open_buckets.get(device_id)
+            if open_buckets is None:
+                open_buckets = self.open_buckets[device_id] = [None] * len(TIERS)
+
+            # 系统时间回拨时继续计入当前区间
+            bucket = open_buckets[0]
+            if bucket is not None and bucket["t"] < start:
+                self._close_buckets(device_id, start)
+                bucket = open_buckets[0]
+            if bucket is None:
+                bucket = open_buckets[0] = _new_bucket(start)
+
+            counts = bucket["counts"]
+            counts[cmd] = counts.get(cmd, 0) + 1
+            if wifi_rssi is not None:
+                bucket["rssi_min"] = wifi_rssi if bucket["rssi_min"] is None else min(bucket["rssi_min"], wifi_rssi)
+                bucket["rssi_max"] = wifi_rssi if bucket["rssi_max"] is None else max(bucket["rssi_max"], wifi_rssi)
+                bucket["rssi_sum"] += wifi_rssi
+                bucket["rssi_n"] += 1
+
+    def _enforce_retention(self, now: float):
+        """重写超出保留时长的层级文件（调用方持有self.io_lock）"""
+        for (device_id, tier), oldest in list(self.oldest.items()):
+            retention = TIERS[tier][2]
+            if oldest >= now - retention * (1 + RETENTION_SLACK):
+                continue
+
+            cutoff = now - retention
+            buckets = self._read_tier(device_id, tier, cutoff)
+            path = self._get_tier_path(device_id, tier)
+            temp_path = path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for bucket in buckets:
+                    f.write(json.dumps(bucket, separators=(',', ':')) + '\n')
+            os.replace(temp_path, path)
+            if buckets:
+                self.oldest[(device_id, tier)] = buckets[0]["t"]
+            else:
+                del self.oldest[(device_id, tier)]
+
+    def flush(self):
+        """封闭所有已过期的区间并写盘"""
+        now = time.time()
+        with self.lock:
+            for device_id in self.open_buckets:
+                self._close_buckets(device_id, now)
+            pending, self.pending = self.pending, []
+
+        with self.io_lock:
+            grouped = {}
+            for device_id, tier, bucket in pending:
+                grouped.setdefault((device_id, tier), []).append(bucket)
+            for (device_id, tier), buckets in grouped.items():
+                try:
+                    self._append_buckets(device_id, tier, buckets)
+                except IOError:
+                    pass
+            self._enforce_retention(now)
+
+    def _flush_loop(self):
+        """后台写盘线程"""
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"设备指标写盘错误: {e}")
+
+    def stop(self):
+        """停止后台线程，提前封闭当前分钟区间并写盘
+
+        同一分钟内重启后会再写出一条起始时间相同的区间，读取时按起始时间合并，不影响结果。
+        """
+        self.stop_event.set()
+        with self.lock:
+            for device_id, open_buckets in self.open_buckets.items():
+                if open_buckets[0] is not None:
+                    self._close_buckets(device_id, open_buckets[0]["t"] + TIERS[0][1])
+        self.flush()
+
+    def select_tier(self, start: int, end: int, step: Optional[int] = None) -> int:
+        """选择满足查询的最粗层级
+
+        指定step时，层级宽度需能整除step，且保留时长覆盖查询起点；都不覆盖时取能整除step的最粗层级，
+        step不是任何层级宽度的整数倍时抛出ValueError。
+        未指定step时，取查询范围内至少有 DEFAULT_MIN_POINTS 个区间的最粗层级，
+        该层级保留时长不覆盖查询起点时改用更粗的层级。
+        """
+        now = time.time()
+        if step is None:
+            tier = 0
+            for candidate, (_, width, _) in enumerate(TIERS):
+                if width * DEFAULT_MIN_POINTS <= end - start:
+                    tier = candidate
+            while tier < len(TIERS) - 1 and start < now - TIERS[tier][2]:
+                tier += 1
+            return tier
+
+        candidates = [tier for tier, (_, width, _) in enumerate(TIERS) if step % width == 0]
+        if not candidates:
+            raise ValueError(f"step必须为{TIERS[0][1]}秒的整数倍")
+        for tier in reversed(candidates):
+            if start >= now - TIERS[tier][2]:
+                return tier
+        return candidates[-1]
+
+    def query(self, device_id: int, start: int, end: int, step: Optional[int] = None) -> Dict:
+        """查询设备 [start, end) 时间范围内的指标，按step秒重新分组
+
+        step不是任何层级宽度的整数倍时抛出ValueError。
+        """
+        tier = self.select_tier(start, end, step)
+        width = TIERS[tier][1]
+        step = step or width
+
+        with self.io_lock:
+            buckets = self._read_tier(device_id, tier, start, end)
+            with self.lock:
+                # 本层已封闭待写盘的区间，以及本层和较细层级仍在累计的区间
+                # （较细层级封闭的区间已合并进上一层，不再重复计入）
+                sources = [(tier, bucket) for pending_id, pending_tier, bucket in self.pending
+                           if pending_id == device_id and pending_tier == tier]
+                open_buckets = self.open_buckets.get(device_id) or []
+                sources.extend((lower, bucket) for lower, bucket in enumerate(open_buckets[:tier + 1])
+                               if bucket is not None)
+                for lower, bucket in sources:
+                    if bucket["t"] + TIERS[lower][1] > start and bucket["t"] < end:
+                        snapshot = _new_bucket(bucket["t"])
+                        _merge_bucket(snapshot, bucket)
+                        buckets.append(snapshot)
+
+        points = {}
+        for bucket in buckets:
+            point_start = bucket["t"] // step * step
+            _merge_bucket(points.setdefault(point_start, _new_bucket(point_start)), bucket)
+
+        return {
+            "tier": TIERS[tier][0],
+            "step": step,
+            "points": [_format_bucket(points[key]) for key in sorted(points)]
+        }
+
+    def get_tiers(self) -> List[Dict]:
+        """返回各层级的宽度与保留时长"""
+        return [{"name": name, "width": width, "retention": retention} for name, width, retention in TIERS]
+
+
+class RssiRing:
+    """单个设备的RSSI采样环形缓冲区
+
+    时间戳(epoch秒, uint32)与RSSI(int8)分别存放在预分配的array中，
+    每个采样占5字节，写满后覆盖最旧的采样。
+    """
+
+    __slots__ = ("times", "values", "size", "next", "count")
+
+    def __init__(self, size: int = RSSI_RING_SIZE):
+        self.size = size
+        self.times = array('I', bytes(4 * size))
+        self.values = array('b', bytes(size))
+        self.next = 0
+        self.count = 0
+
+    def append(self, timestamp: int, rssi: int):
+        """写入一个采样"""
+        i = self.next
+        self.times[i] = timestamp
+        self.values[i] = max(-128, min(127, rssi))
+        self.next = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def snapshot(self, since: Optional[int] = None) -> Tuple[array, array]:
+        """按时间顺序返回采样的副本，since 指定时只返回该时间之后的采样"""
+        if self.count < self.size:
+            times, values = self.times[:self.count], self.values[:self.count]
+        else:
+            times = self.times[self.next:] + self.times[:self.next]
+            values = self.values[self.next:] + self.values[:self.next]
+        if since is not None:
+            start = bisect_right(times, since)
+            times, values = times[start:], values[start:]
+        return times, values
+
+
+class RssiHistory:
+    """所有设备的RSSI采样历史（仅内存，采集路径只做一次数组写入）"""
+
+    def __init__(self, ring_size: int = RSSI_RING_SIZE):
+        self.ring_size = ring_size
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def record(self, device_id: int, wifi_rssi: int, timestamp: Optional[float] = None):
+        """记录设备的一个RSSI采样"""
+        now = int(timestamp if timestamp is not None else time.time())
+        with self.lock:
+            ring = self.rings.get(device_id)
+            if ring is None:
+                ring = self.rings[device_id] = RssiRing(self.ring_size)
+            ring.append(now, wifi_rssi)
+
+    def get_samples(self, device_id: int, since: Optional[int] = None) -> Optional[Tuple[array, array]]:
+        """获取设备的采样 (时间戳数组, RSSI数组)，设备无采样时返回None"""
+        with self.lock:
+            ring = self.rings.get(device_id)
+            if ring is None:
+                return None
+            return ring.snapshot(since)
+
+    def to_json(self, times: array, values: array) -> Dict:
+        """紧凑JSON格式：起始时间 + 相对偏移秒数 + RSSI值"""
+        start = times[0] if times else None
+        return {
+            "count": len(times),
+            "start": start,
+            "offsets": [t - start for t in times],
+            "rssi": values.tolist()
+        }
+
+    def to_blob(self, times: array, values: array) -> bytes:
+        """二进制格式：头(魔数'RSSI', 版本1, 采样数uint32) + 小端uint32时间戳 + int8 RSSI"""
+        if sys.byteorder != 'little':
+            times = array('I', times)
+            times.byteswap()
+        return RSSI_BLOB_HEADER.pack(RSSI_BLOB_MAGIC, 1, len(times)) + times.tobytes() + values.tobytes()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+设备发现调度
+
+向已知设备IP逐个发送立即上报探测，按配置的速率发送并加入随机抖动，设备按波次分组，
+波次之间留出应答时间，避免全部设备同时应答造成交换机和服务器接收缓冲溢出。
+最近已收到数据的设备直接跳过；每轮结束后只对没有应答的设备重新探测。
+没有任何已知设备时才发送一次广播。
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 单播探测速率(个/秒)
+PROBE_RATE = 20
+# 每个波次的设备数
+WAVE_SIZE = 32
+# 波次之间的间隔(秒)，留给本波次设备应答
+WAVE_INTERVAL = 2.0
+# 探测间隔的随机抖动比例(0~1)
+JITTER = 0.5
+# 在该时间(秒)内收到过数据的设备不再探测
+FRESH_WINDOW = 60
+# 每轮最后一个波次发出后等待应答的时间(秒)
+REPLY_TIMEOUT = 3.0
+# 最多探测轮数（第一轮之后只探测未应答的设备）
+MAX_ROUNDS = 3
+
+class DiscoveryScheduler:
+    """限速、分波次、带抖动的设备发现
+
+    get_targets() 返回 {IP: 最后一次收到该IP数据的时间戳(秒)或None}；
+    send_probe(ip) 向单个IP发送立即上报命令；send_broadcast() 发送广播探测；
+    on_complete(report) 在一次发现结束后调用。
+    """
+
+    def __init__(self, get_targets: Callable[[], Dict[str, Optional[float]]],
+                 send_probe: Callable[[str], bool],
+                 send_broadcast: Optional[Callable[[], bool]] = None,
+                 on_complete: Optional[Callable[[Dict], None]] = None,
+                 rate: float = PROBE_RATE, wave_size: int = WAVE_SIZE,
+                 wave_interval: float = WAVE_INTERVAL, jitter: float = JITTER,
+                 fresh_window: float = FRESH_WINDOW, reply_timeout: float = REPLY_TIMEOUT,
+                 max_rounds: int = MAX_ROUNDS):
+        self.get_targets = get_targets
+        self.send_probe = send_probe
+        self.send_broadcast = send_broadcast
+        self.on_complete = on_complete
+        self.rate = rate
+        self.wave_size = wave_size
+        self.wave_interval = wave_interval
+        self.jitter = jitter
+        self.fresh_window = fresh_window
+        self.reply_timeout = reply_timeout
+        self.max_rounds = max_rounds
+        self.lock = threading.Lock()
+        self.running = False
+        self.current = None
+        self.last_report = None
+        self.stop_event = threading.Event()
+
+    def _pace(self):
+        """两次探测之间的等待：平均 1/rate 秒，按抖动比例随机伸缩"""
+        interval = 1.0 / self.rate
+        self.stop_event.wait(interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _probe_round(self, ips, sent_at: Dict[str, float], report: Dict):
+        """按波次探测一轮"""
+        for start in range(0, len(ips), self.wave_size):
+            if start:
+                self.stop_event.wait(self.wave_interval)
+            for ip in ips[start:start + self.wave_size]:
+                if self.stop_event.is_set():
+                    return
+                try:
+                    if self.send_probe(ip):
+                        sent_at[ip] = time.time()
+                        report['probes_sent'] += 1
+                    else:
+                        report['send_errors'] += 1
+                except Exception as e:
+                    report['send_errors'] += 1
+                    logger.error(f"发送发现探测失败 {ip}: {e}")
+                self._pace()
+
+    def run(self, skip_fresh: bool = True) -> Dict:
+        """执行一次发现，返回统计报告"""
+        started = time.time()
+        targets = self.get_targets()
+        report = {
+            'started': started,
+            'finished': None,
+            'duration': None,
+            'known': len(targets),
+            'skipped_fresh': 0,
+            'probed': 0,
+            'probes_sent': 0,
+            'send_errors': 0,
+            'rounds': 0,
+            'round_stats': [],
+            'replied': 0,
+            'silent': [],
+            'loss_rate': None,
+            'last_reply_after': None,
+            'broadcast': False
+        }
+        with self.lock:
+            self.current = report
+
+        if not targets and self.send_broadcast is not None:
+            # 冷启动：没有已知设备，只能广播
+            report['broadcast'] = bool(self.send_broadcast())
+        else:
+            pending = [
+                ip for ip, heard in targets.items()
+                if not (skip_fresh and heard is not None and started - heard < self.fresh_window)
+            ]
+            report['skipped_fresh'] = len(targets) - len(pending)
+            report['probed'] = len(pending)
+            random.shuffle(pending)
+
+            first_sent = {}
+            last_reply = None
+            while pending and report['rounds'] < self.max_rounds and not self.stop_event.is_set():
+                report['rounds'] += 1
+                sent_at = {}
+                self._probe_round(pending, sent_at, report)
+                for ip, sent in sent_at.items():
+                    first_sent.setdefault(ip, sent)
+                self.stop_event.wait(self.reply_timeout)
+
+                # 探测发出后收到过该IP数据即视为已应答
+                heard_now = self.get_targets()
+                silent = []
+                for ip in pending:
+                    heard = heard_now.get(ip)
+                    if ip in sent_at and heard is not None and heard >= sent_at[ip]:
+                        report['replied'] += 1
+                        last_reply = heard if last_reply is None else max(last_reply, heard)
+                    else:
+                        silent.append(ip)
+                report['round_stats'].append({'probed': len(pending), 'replied': len(pending) - len(silent)})
+                pending = silent
+                if pending:
+                    logger.info(f"设备发现第 {report['rounds']} 轮: {len(pending)} 个IP未应答")
+
+            report['silent'] = sorted(pending)
+            if report['probed']:
+                report['loss_rate'] = round(len(pending) / report['probed'], 4)
+            if last_reply is not None:
+                report['last_reply_after'] = round(last_reply - started, 3)
+
+        report['finished'] = time.time()
+        report['duration'] = round(report['finished'] - started, 3)
+        logger.info(
+            f"设备发现完成: 已知 {report['known']}，跳过 {report['skipped_fresh']}，探测 {report['probed']}，"
+            f"应答 {report['replied']}，未应答 {len(report['silent'])}，{report['rounds']} 轮，"
+            f"耗时 {report['duration']}秒"
+        )
+        return report
+
+    def _run_and_finish(self, skip_fresh: bool):
+        try:
+            report = self.run(skip_fresh)
+            with self.lock:
+                self.last_report = report
+            if self.on_complete is not None:
+                self.on_complete(report)
+        except Exception as e:
+            logger.error(f"设备发现错误: {e}")
+        finally:
+            with self.lock:
+                self.running = False
+                self.current = None
+
+    def start(self, skip_fresh: bool = True, delay: float = 0) -> bool:
+        """在后台线程中执行一次发现，已有发现在进行时返回False"""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+
+        def worker():
+            if delay:
+                self.stop_event.wait(delay)
+            self._run_and_finish(skip_fresh)
+
+        threading.Thread(target=worker, daemon=True).start()
+        return True
+
+    def stop(self):
+        """中止正在进行的发现"""
+        self.stop_event.set()
+
+    def get_status(self) -> Dict:
+        """当前进度与上一次发现的报告"""
+        with self.lock:
+            current = dict(self.current) if self.current else None
+            return {
+                'running': self.running,
+                'current': current,
+                'last_report': self.last_report,
+                'config': {
+                    'rate': self.rate,
+                    'wave_size': self.wave_size,
+                    'wave_interval': self.wave_interval,
+                    'jitter': self.jitter,
+                    'fresh_window': self.fresh_window,
+                    'reply_timeout': self.reply_timeout,
+                    'max_rounds': self.max_rounds
+                }
+            }
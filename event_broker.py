@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者事件队列的默认容量
+SUBSCRIBER_QUEUE_SIZE = 256
+# 订阅者队列满时的处理策略: drop 丢弃最旧的非critical事件 / resync 清空队列并通知客户端重新同步
+OVERFLOW_DROP = "drop"
+OVERFLOW_RESYNC = "resync"
+# 批量模式下合并事件的等待窗口(秒)
+BATCH_WINDOW = 0.005
+# 报警事件从发布到写出的延迟目标(秒)
+ALARM_LATENCY_TARGET = 0.1
+# 每个订阅者保留的延迟采样数
+LATENCY_SAMPLES = 128
+# 断线重连补发用的最近事件环形缓冲容量
+HISTORY_SIZE = 1000
+# 长轮询单次返回的最大事件数
+POLL_LIMIT = 500
+# 事件严重级别，订阅时可指定最低级别
+SEVERITY_LEVELS = {"info": 0, "warning": 1, "critical": 2}
+
+def _normalize_event(event: Dict) -> Dict:
+    """将事件中的datetime转换为ISO字符串，保证可以JSON序列化"""
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in event.items()
+    }
+
+def _resync_payload() -> str:
+    """通知客户端重新拉取完整状态的事件"""
+    return json.dumps({'type': 'resync', 'timestamp': datetime.now().isoformat()})
+
+
+def _event_device_id(event: Dict) -> Optional[int]:
+    """事件所属的设备ID，非设备事件返回None"""
+    try:
+        return int(event['device_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _Entry:
+    """队列中的事件：已序列化的数据由所有订阅者共享"""
+
+    __slots__ = ('seq', 'id', 'published', 'payload', 'key', 'critical', 'type', 'device_id', 'severity')
+
+    def __init__(self, seq: int, event_id: str, published: float, payload: str, key, critical: bool,
+                 event_type: Optional[str], device_id: Optional[int], severity: int):
+        self.seq = seq
+        self.id = event_id
+        self.published = published
+        self.payload = payload
+        self.key = key
+        self.critical = critical
+        self.type = event_type
+        self.device_id = device_id
+        self.severity = severity
+
+
+class SubscriptionFilter:
+    """订阅过滤条件：事件类型集合、设备ID范围、最低严重级别
+
+    条件相同的订阅者共享同一个过滤器，发布时每个过滤器对每个事件只判断一次。
+    不带设备ID的系统事件不受设备范围限制。
+    """
+
+    def __init__(self, types: Optional[frozenset] = None, devices: Optional[Tuple] = None,
+                 min_severity: int = 0):
+        self.types = types
+        self.devices = devices
+        self.min_severity = min_severity
+        # 设备范围已排序合并，用起点列表二分查找
+        self._starts = [start for start, _ in devices] if devices else None
+        self.key = (types, devices, min_severity)
+
+    @classmethod
+    def parse(cls, types: Optional[str] = None, devices: Optional[str] = None,
+              severity: Optional[str] = None) -> 'SubscriptionFilter':
+        """解析查询参数：types=device_message,device_offline devices=1,5,10-20 severity=warning"""
+        type_set = None
+        if types:
+            type_set = frozenset(t.strip() for t in types.split(',') if t.strip()) or None
+
+        ranges = None
+        if devices:
+            spans = []
+            for part in devices.split(','):
+                part = part.strip()
+                if not part:
+                    continue
+                low, sep, high = part.partition('-')
+                try:
+                    start = int(low)
+                    end = int(high) if sep else start
+                except ValueError:
+                    raise ValueError(f"无效的设备范围: {part}")
+                if start > end:
+                    raise ValueError(f"无效的设备范围: {part}")
+                spans.append((start, end))
+            spans.sort()
+            merged = []
+            for start, end in spans:
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            ranges = tuple(merged) or None
+
+        min_severity = 0
+        if severity:
+            if severity not in SEVERITY_LEVELS:
+                raise ValueError(f"无效的严重级别: {severity}")
+            min_severity = SEVERITY_LEVELS[severity]
+
+        return cls(type_set, ranges, min_severity)
+
+    def matches(self, entry: _Entry) -> bool:
+        """判断事件是否满足过滤条件（类型条件由订阅索引预先筛选）"""
+        if entry.severity < self.min_severity:
+            return False
+        if self.devices is None or entry.device_id is None:
+            return True
+        index = bisect.bisect_right(self._starts, entry.device_id) - 1
+        return index >= 0 and entry.device_id <= self.devices[index][1]
+
+    def accepts(self, entry: _Entry) -> bool:
+        """完整判断，包括事件类型"""
+        if self.types is not None and entry.type not in self.types:
+            return False
+        return self.matches(entry)
+
+    def describe(self) -> Dict:
+        """过滤条件的可读形式"""
+        return {
+            'types': sorted(self.types) if self.types else None,
+            'devices': [f"{start}-{end}" if start != end else str(start) for start, end in self.devices]
+            if self.devices else None,
+            'min_severity': next(name for name, level in SEVERITY_LEVELS.items() if level == self.min_severity)
+        }
+
+
+ALL_EVENTS = SubscriptionFilter()
+
+
+class _SubscriptionGroup:
+    """过滤条件相同的一组订阅者"""
+
+    def __init__(self, subscription_filter: SubscriptionFilter):
+        self.filter = subscription_filter
+        self.members = {}
+
+
+class Subscriber:
+    """单个订阅者（一个SSE连接）的有界事件队列"""
+
+    def __init__(self, subscriber_id: int, lock: threading.Lock, maxlen: int, policy: str,
+                 subscription_filter: SubscriptionFilter = ALL_EVENTS):
+        self.id = subscriber_id
+        self.filter = subscription_filter
+        self.queue = deque()
+        self.maxlen = maxlen
+        self.policy = policy
+        self.condition = threading.Condition(lock)
+        self.created = time.time()
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.resync_pending = False
+        # 重新同步通知携带的事件ID，客户端之后从该位置继续
+        self.resync_id = None
+        self.closed = False
+        # 延迟探针：最近一次取出的事件，写出后计算发布到写出的耗时
+        self.inflight = []
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.alarm_latency_max = 0.0
+        self.slow_alarms = 0
+
+    def _offer(self, entry: _Entry):
+        """放入一个事件（调用方持有代理锁）
+
+        队列已满时，drop 策略丢弃最早的非 critical 事件；队列中只剩 critical 事件时，
+        新事件不是 critical 则丢弃新事件，否则与 resync 策略一样改为通知客户端重新同步。
+        """
+        if len(self.queue) >= self.maxlen:
+            if self.policy == OVERFLOW_RESYNC:
+                self._resync(entry)
+                return
+            victim = next((i for i, queued in enumerate(self.queue) if not queued.critical), None)
+            if victim is None:
+                if entry.critical:
+                    self._resync(entry)
+                else:
+                    self.dropped += 1
+                return
+            del self.queue[victim]
+            self.dropped += 1
+        self.queue.append(entry)
+        self.condition.notify()
+
+    def _resync(self, entry: _Entry):
+        """积压过多时不再补发，改为通知客户端重新拉取完整状态（调用方持有代理锁）"""
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        self.resync_pending = True
+        self.resync_id = entry.id
+        self.condition.notify()
+
+    def get(self, timeout: Optional[float] = None, window: float = 0) -> Optional[Tuple[str, str]]:
+        """取出下一帧要发送的 (事件ID, JSON字符串)，超时或订阅已关闭时返回None
+
+        window 大于0时为批量模式：收到第一个事件后再等待 window 秒，
+        期间到达的事件合并为一帧 {"type": "batch", "events": [...]}，
+        同一key的更新只保留最新一条，critical 事件始终逐条保留。
+        """
+        with self.condition:
+            # 阻塞等待，事件发布时立即被唤醒
+            self.condition.wait_for(
+                lambda: self.queue or self.resync_pending or self.closed, timeout
+            )
+            if self.queue and window > 0 and not self.resync_pending and not self.closed:
+                self.condition.wait_for(lambda: self.resync_pending or self.closed, window)
+            self.inflight = []
+            if self.resync_pending:
+                self.resync_pending = False
+                return self.resync_id, _resync_payload()
+            if not self.queue:
+                return None
+
+            if window <= 0:
+                entries = [self.queue.popleft()]
+                last_id = entries[0].id
+            else:
+                last_id = self.queue[-1].id
+                entries = self._coalesce(list(self.queue))
+                self.queue.clear()
+            self.delivered += len(entries)
+            self.inflight = [(entry.published, entry.critical) for entry in entries]
+            if len(entries) == 1:
+                return last_id, entries[0].payload
+            return last_id, '{"type": "batch", "events": [' + ', '.join(entry.payload for entry in entries) + ']}'
+
+    def _coalesce(self, entries: List[_Entry]) -> List[_Entry]:
+        """同一key的事件只保留最新一条，保持事件原有顺序（调用方持有代理锁）"""
+        seen = set()
+        kept = []
+        for entry in reversed(entries):
+            if entry.key is not None:
+                if entry.key in seen:
+                    self.coalesced += 1
+                    continue
+                seen.add(entry.key)
+            kept.append(entry)
+        kept.reverse()
+        return kept
+
+    def mark_flushed(self):
+        """上一帧已写出到连接，记录其中每个事件发布到写出的延迟"""
+        with self.condition:
+            inflight, self.inflight = self.inflight, []
+            now = time.monotonic()
+            for published, critical in inflight:
+                latency = now - published
+                self.latencies.append(latency)
+                if critical:
+                    self.alarm_latency_max = max(self.alarm_latency_max, latency)
+                    if latency > ALARM_LATENCY_TARGET:
+                        self.slow_alarms += 1
+                        logger.warning(f"报警事件推送延迟 {latency * 1000:.1f}ms 超过目标，订阅者 {self.id}")
+
+    def get_latency_stats(self) -> Dict:
+        """发布到写出的延迟统计(毫秒)（调用方持有代理锁）"""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {'samples': 0}
+        return {
+            'samples': len(samples),
+            'last_ms': round(self.latencies[-1] * 1000, 2),
+            'avg_ms': round(sum(samples) / len(samples) * 1000, 2),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+            'alarm_max_ms': round(self.alarm_latency_max * 1000, 2),
+            'slow_alarms': self.slow_alarms
+        }
+
+    def get_stats(self) -> Dict:
+        """订阅者统计（调用方持有代理锁）"""
+        return {
+            'id': self.id,
+            'lag': len(self.queue),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'resync_pending': self.resync_pending,
+            'connected_seconds': round(time.time() - self.created),
+            'filter': self.filter.describe(),
+            'latency': self.get_latency_stats()
+        }
+
+
+class EventBroker:
+    """SSE事件发布/订阅代理
+
+    每个订阅者有自己的有界队列，发布者只写一次，事件分发给所有订阅者；
+    慢订阅者队列写满后按策略丢弃最旧事件或要求重新同步，内存占用有上限。
+    最近的事件保留在环形缓冲中，客户端断线重连时按 Last-Event-ID 补发错过的事件。
+    """
+
+    def __init__(self, maxlen: int = SUBSCRIBER_QUEUE_SIZE, policy: str = OVERFLOW_DROP,
+                 history_size: int = HISTORY_SIZE):
+        self.maxlen = maxlen
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.ids = itertools.count(1)
+        self.published = 0
+        # 事件ID为 "<启动标识>-<序号>"，服务重启后旧ID不会被误认为仍可补发
+        self.boot = format(int(time.time()), 'x')
+        self.seq = 0
+        self.history = deque(maxlen=history_size)
+        self.replayed = 0
+        # 已断开订阅者的累计丢弃/合并数，保证总数不因断开而减少
+        self.dropped_closed = 0
+        self.coalesced_closed = 0
+        # 订阅索引：按过滤条件分组，再按事件类型索引到分组
+        self.groups = {}
+        self.groups_by_type = {}
+        self.groups_any_type = []
+        self.filter_checks = 0
+        # 长轮询请求共用一个条件变量，发布事件时一次通知全部唤醒
+        self.new_event = threading.Condition(self.lock)
+        self.pollers = 0
+        self.polls = 0
+
+    @property
+    def last_event_id(self) -> str:
+        """最近发布的事件ID（调用方持有代理锁）"""
+        return f"{self.boot}-{self.seq}"
+
+    def _parse_event_id(self, event_id: str) -> Optional[int]:
+        """解析事件ID中的序号，不属于本次启动或格式无效时返回None"""
+        boot, _, seq = str(event_id).strip().partition('-')
+        if boot != self.boot or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _missed_since(self, event_id: str) -> Optional[List[_Entry]]:
+        """返回指定事件ID之后错过的事件，缺口超出环形缓冲时返回None（调用方持有代理锁）"""
+        seq = self._parse_event_id(event_id)
+        if seq is None or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self.history or self.history[0].seq > seq + 1:
+            return None
+        # 缓冲中的序号连续，直接定位到第一条错过的事件
+        start = seq + 1 - self.history[0].seq
+        return [self.history[i] for i in range(start, len(self.history))]
+
+    def _rebuild_index(self):
+        """订阅者变化后重建按事件类型的分组索引（调用方持有代理锁）"""
+        by_type = {}
+        any_type = []
+        for group in self.groups.values():
+            if group.filter.types is None:
+                any_type.append(group)
+            else:
+                for event_type in group.filter.types:
+                    by_type.setdefault(event_type, []).append(group)
+        self.groups_by_type = by_type
+        self.groups_any_type = any_type
+
+    def subscribe(self, maxlen: Optional[int] = None, policy: Optional[str] = None,
+                  last_event_id: Optional[str] = None,
+                  subscription_filter: SubscriptionFilter = ALL_EVENTS) -> Subscriber:
+        """新增订阅者
+
+        last_event_id 为客户端重连时带回的最后事件ID：缺口仍在环形缓冲内时补发错过的事件，
+        否则（或补发量超过队列容量时）先发送一次重新同步通知。
+        subscription_filter 为订阅过滤条件，只有满足条件的事件会进入该订阅者的队列。
+        """
+        with self.lock:
+            group = self.groups.get(subscription_filter.key)
+            if group is None:
+                group = self.groups[subscription_filter.key] = _SubscriptionGroup(subscription_filter)
+                self._rebuild_index()
+            subscriber = Subscriber(next(self.ids), self.lock, maxlen or self.maxlen, policy or self.policy,
+                                    group.filter)
+            if last_event_id:
+                missed = self._missed_since(last_event_id)
+                if missed is not None:
+                    missed = [entry for entry in missed if group.filter.accepts(entry)]
+                if missed is None or len(missed) > subscriber.maxlen:
+                    subscriber.resync_pending = True
+                    subscriber.resync_id = self.last_event_id
+                else:
+                    subscriber.queue.extend(missed)
+                    self.replayed += len(missed)
+            self.subscribers[subscriber.id] = subscriber
+            group.members[subscriber.id] = subscriber
+            return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """移除订阅者"""
+        with self.lock:
+            if self.subscribers.pop(subscriber.id, None) is not None:
+                self.dropped_closed += subscriber.dropped
+                self.coalesced_closed += subscriber.coalesced
+                group = self.groups.get(subscriber.filter.key)
+                if group is not None:
+                    group.members.pop(subscriber.id, None)
+                    if not group.members:
+                        del self.groups[subscriber.filter.key]
+                        self._rebuild_index()
+            subscriber.closed = True
+            subscriber.condition.notify_all()
+
+    def publish(self, event: Dict, key=None, critical: bool = False, severity: str = "info"):
+        """发布事件给订阅了该事件的订阅者
+
+        事件只序列化一次，所有订阅者共享同一份数据。
+        key 相同的事件在批量模式下可被后来的事件取代（例如同一设备的状态更新）；
+        critical 事件（报警/恢复）从不合并，并按报警延迟目标统计推送延迟；
+        severity 为事件严重级别(info/warning/critical)，用于订阅过滤。
+        """
+        payload = json.dumps(_normalize_event(event), ensure_ascii=False)
+        event_type = event.get('type')
+        device_id = _event_device_id(event)
+        with self.lock:
+            self.published += 1
+            self.seq += 1
+            entry = _Entry(self.seq, self.last_event_id, time.monotonic(), payload,
+                           None if critical else key, critical,
+                           event_type, device_id, SEVERITY_LEVELS[severity])
+            self.history.append(entry)
+            # 只检查订阅了该类型的分组，每个分组判断一次后分发给组内所有订阅者
+            for groups in (self.groups_by_type.get(event_type, ()), self.groups_any_type):
+                for group in groups:
+                    self.filter_checks += 1
+                    if group.filter.matches(entry):
+                        for subscriber in group.members.values():
+                            subscriber._offer(entry)
+            if self.pollers:
+                self.new_event.notify_all()
+
+    def poll(self, after: Optional[str] = None, timeout: float = 0,
+             subscription_filter: SubscriptionFilter = ALL_EVENTS,
+             limit: int = POLL_LIMIT) -> Dict:
+        """长轮询：返回指定事件ID之后满足过滤条件的事件，没有时最多等待 timeout 秒
+
+        不指定 after 时从当前位置开始等待。返回 events(已序列化的JSON字符串列表)、
+        last_event_id(下次请求的 after)、resync(缺口超出环形缓冲，客户端需重新拉取完整状态)。
+        等待期间不占用线程以外的资源，事件发布时所有等待的请求被一次唤醒。
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.polls += 1
+            if after:
+                missed = self._missed_since(after)
+                if missed is None:
+                    return {'events': [], 'last_event_id': self.last_event_id, 'resync': True}
+                cursor = self._parse_event_id(after)
+            else:
+                cursor = self.seq
+
+            self.pollers += 1
+            try:
+                while True:
+                    if self.seq > cursor:
+                        # 等待期间缺口可能已超出环形缓冲
+                        if self.history[0].seq > cursor + 1:
+                            return {'events': [], 'last_event_id': self.last_event_id, 'resync': True}
+                        start = cursor + 1 - self.history[0].seq
+                        events = []
+                        for i in range(start, len(self.history)):
+                            entry = self.history[i]
+                            cursor = entry.seq
+                            if subscription_filter.accepts(entry):
+                                events.append(entry.payload)
+                                if len(events) >= limit:
+                                    break
+                        if events:
+                            return {'events': events, 'last_event_id': f"{self.boot}-{cursor}", 'resync': False}
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return {'events': [], 'last_event_id': f"{self.boot}-{cursor}", 'resync': False}
+                    self.new_event.wait(remaining)
+            finally:
+                self.pollers -= 1
+
+    def get_stats(self) -> Dict:
+        """获取订阅者数量、积压与丢弃统计"""
+        with self.lock:
+            subscribers: List[Dict] = [s.get_stats() for s in self.subscribers.values()]
+            latencies = [s['latency'] for s in subscribers if s['latency']['samples']]
+            return {
+                'subscribers': len(subscribers),
+                'published': self.published,
+                'last_event_id': self.last_event_id,
+                'history': len(self.history),
+                'replayed': self.replayed,
+                'pollers': self.pollers,
+                'polls': self.polls,
+                'filter_groups': len(self.groups),
+                'filter_checks': self.filter_checks,
+                'dropped': self.dropped_closed + sum(s['dropped'] for s in subscribers),
+                'coalesced': self.coalesced_closed + sum(s['coalesced'] for s in subscribers),
+                'max_lag': max((s['lag'] for s in subscribers), default=0),
+                'queue_size': self.maxlen,
+                'policy': self.policy,
+                'latency': {
+                    'max_ms': max((l['max_ms'] for l in latencies), default=None),
+                    'alarm_max_ms': max((l['alarm_max_ms'] for l in latencies), default=None),
+                    'alarm_target_ms': ALARM_LATENCY_TARGET * 1000,
+                    'slow_alarms': sum(l['slow_alarms'] for l in latencies)
+                },
+                'details': subscribers
+            }
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+增量备份
+
+每次备份生成一个快照目录，内含 manifest.json 记录每个文件的大小与CRC32。
+不可变文件（封存的日志段）在上一个快照中已存在且大小一致时直接硬链接，
+只有新增/变化的文件才会复制；SQLite数据库通过在线备份API分步复制。
+备份在低优先级线程上运行，复制速度受限，不会挤占采集和Web服务的磁盘I/O。
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 备份复制速度上限(字节/秒)
+BACKUP_RATE_LIMIT = 2 * 1024 * 1024
+# 复制文件时每次读写的块大小
+BACKUP_CHUNK_SIZE = 256 * 1024
+# SQLite在线备份每步复制的页数
+SQLITE_BACKUP_PAGES = 64
+# 限速分步复制因源库被写入而重新开始的次数上限，超过后改为一次性复制
+SQLITE_BACKUP_MAX_RESTARTS = 2
+# 快照清单文件名
+MANIFEST_NAME = "manifest.json"
+# 正在写入的快照目录后缀，完成后重命名去掉
+PARTIAL_SUFFIX = ".partial"
+
+def lower_thread_priority():
+    """降低当前线程的CPU调度优先级（Linux下nice值按线程生效）"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+def file_crc32(path: str, throttle: Optional["IOThrottle"] = None) -> int:
+    """计算文件的CRC32"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(BACKUP_CHUNK_SIZE)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+            if throttle:
+                throttle.consume(len(data))
+
+
+class _BackupRestarted(Exception):
+    """SQLite在线备份因源库被其他连接修改而重新开始"""
+
+
+class IOThrottle:
+    """按平均速率限制备份I/O：累计字节数超过速率允许的量时休眠"""
+
+    def __init__(self, rate: Optional[int] = BACKUP_RATE_LIMIT):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.total = 0
+
+    def consume(self, size: int):
+        if not self.rate:
+            return
+        self.total += size
+        delay = self.total / self.rate - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SnapshotWriter:
+    """写入一个快照目录
+
+    快照先写入 .<名称>.partial 临时目录，commit() 写出清单后再重命名为正式名称，
+    中途失败的快照不会被当作可用备份。同一目录同一前缀的快照由备份线程串行写入，
+    开始新快照前先删除进程中断遗留的临时目录。
+    """
+
+    def __init__(self, backup_dir: str, prefix: str, rate_limit: Optional[int] = BACKUP_RATE_LIMIT):
+        os.makedirs(backup_dir, exist_ok=True)
+        self.backup_dir = backup_dir
+        self.prefix = prefix
+        self.throttle = IOThrottle(rate_limit)
+        remove_partial_snapshots(backup_dir, prefix)
+
+        self.previous = find_latest_snapshot(backup_dir, prefix)
+        self.previous_files = load_manifest(self.previous)["files"] if self.previous else {}
+
+        name = f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        suffix = 1
+        while os.path.exists(os.path.join(backup_dir, name)):
+            name = f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{suffix}"
+            suffix += 1
+        self.path = os.path.join(backup_dir, name)
+        self.partial_path = os.path.join(backup_dir, f".{name}{PARTIAL_SUFFIX}")
+        os.makedirs(self.partial_path)
+
+        self.files = {}
+        self.stats = {"linked_files": 0, "copied_files": 0, "copied_bytes": 0}
+
+    def _target(self, rel_path: str) -> str:
+        target = os.path.join(self.partial_path, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return target
+
+    def add_immutable(self, rel_path: str, source_path: str):
+        """添加不可变文件：上一个快照中有同名同大小的文件时硬链接，否则复制"""
+        size = os.path.getsize(source_path)
+        previous = self.previous_files.get(rel_path)
+        target = self._target(rel_path)
+        if previous and previous["size"] == size:
+            try:
+                os.link(os.path.join(self.previous, rel_path), target)
+                self.files[rel_path] = previous
+                self.stats["linked_files"] += 1
+                return
+            except OSError:
+                pass
+        self.add_file(rel_path, source_path)
+
+    def add_file(self, rel_path: str, source_path: str):
+        """限速复制文件并计算CRC32"""
+        crc = 0
+        size = 0
+        with open(source_path, 'rb') as src, open(self._target(rel_path), 'wb') as dst:
+            while True:
+                data = src.read(BACKUP_CHUNK_SIZE)
+                if not data:
+                    break
+                dst.write(data)
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                self.throttle.consume(len(data))
+        self.files[rel_path] = {"size": size, "crc32": crc}
+        self.stats["copied_files"] += 1
+        self.stats["copied_bytes"] += size
+
+    def add_bytes(self, rel_path: str, data: bytes):
+        """写入调用方已读取到内存中的文件内容（用于需要在锁内读取的可变文件）"""
+        with open(self._target(rel_path), 'wb') as f:
+            f.write(data)
+        self.throttle.consume(len(data))
+        self.files[rel_path] = {"size": len(data), "crc32": zlib.crc32(data)}
+        self.stats["copied_files"] += 1
+        self.stats["copied_bytes"] += len(data)
+
+    def add_sqlite(self, rel_path: str, db_path: str):
+        """通过SQLite在线备份API分步复制数据库，每步之间按限速休眠，完成后做完整性检查
+
+        WAL模式下先在源连接上开启读事务固定快照，其他连接的提交只写入WAL，
+        分步复制不会被打断，复制期间也不阻塞写入。
+        其他日志模式下，其他连接在两步之间提交写入时SQLite会从头重新复制；数据库写入频繁、
+        限速复制总是被打断时，改为不限速的一次性复制（单步完成，期间持有读锁，不会被写入打断）。
+        """
+        target = self._target(rel_path)
+        src = sqlite3.connect(db_path, isolation_level=None)
+        dst = sqlite3.connect(target)
+        try:
+            page_size = src.execute('PRAGMA page_size').fetchone()[0]
+            snapshot = src.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+            if snapshot:
+                src.execute('BEGIN')
+                src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            restarts = 0
+
+            for _ in range(SQLITE_BACKUP_MAX_RESTARTS + 1):
+                last_remaining = None
+
+                def progress(status, remaining, total):
+                    nonlocal last_remaining
+                    if last_remaining is not None and remaining > last_remaining:
+                        raise _BackupRestarted()
+                    last_remaining = remaining
+                    self.throttle.consume(SQLITE_BACKUP_PAGES * page_size)
+
+                try:
+                    src.backup(dst, pages=SQLITE_BACKUP_PAGES, progress=progress)
+                    break
+                except _BackupRestarted:
+                    restarts += 1
+            else:
+                logger.info(f"数据库 {db_path} 在限速备份期间持续被写入（重新开始 {restarts} 次），改为一次性复制")
+                src.backup(dst, pages=-1)
+            if snapshot:
+                src.execute('COMMIT')
+            result = dst.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"备份数据库完整性检查失败: {result}")
+        finally:
+            dst.close()
+            src.close()
+
+        size = os.path.getsize(target)
+        self.files[rel_path] = {"size": size, "crc32": file_crc32(target)}
+        self.stats["copied_files"] += 1
+        self.stats["copied_bytes"] += size
+
+    def commit(self) -> str:
+        """写出清单并发布快照，返回快照路径"""
+        manifest = {
+            "created": datetime.now().isoformat(),
+            "base": os.path.basename(self.previous) if self.previous else None,
+            "files": self.files,
+            "stats": self.stats
+        }
+        with open(os.path.join(self.partial_path, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.rename(self.partial_path, self.path)
+        return self.path
+
+    def abort(self):
+        """放弃未完成的快照"""
+        shutil.rmtree(self.partial_path, ignore_errors=True)
+
+
+def load_manifest(snapshot_path: str) -> Dict:
+    """读取快照清单"""
+    with open(os.path.join(snapshot_path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def remove_partial_snapshots(backup_dir: str, prefix: str) -> int:
+    """删除未完成的快照临时目录，返回删除的数量"""
+    try:
+        names = [name for name in os.listdir(backup_dir)
+                 if name.startswith(f".{prefix}") and name.endswith(PARTIAL_SUFFIX)]
+    except OSError:
+        return 0
+    for name in names:
+        shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+        logger.info(f"已删除未完成的快照: {name}")
+    return len(names)
+
+def find_latest_snapshot(backup_dir: str, prefix: str) -> Optional[str]:
+    """查找最新的完整快照（有清单文件）"""
+    try:
+        names = sorted(name for name in os.listdir(backup_dir) if name.startswith(prefix))
+    except OSError:
+        return None
+    for name in reversed(names):
+        path = os.path.join(backup_dir, name)
+        if os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            return path
+    return None
+
+def verify_snapshot(snapshot_path: str, rate_limit: Optional[int] = None) -> bool:
+    """按清单校验快照中每个文件的大小与CRC32，SQLite文件另做完整性检查"""
+    try:
+        manifest = load_manifest(snapshot_path)
+    except (IOError, ValueError) as e:
+        logger.error(f"读取快照清单失败 {snapshot_path}: {e}")
+        return False
+
+    throttle = IOThrottle(rate_limit)
+    for rel_path, info in manifest["files"].items():
+        path = os.path.join(snapshot_path, rel_path)
+        try:
+            if os.path.getsize(path) != info["size"] or file_crc32(path, throttle) != info["crc32"]:
+                logger.error(f"快照文件校验失败: {path}")
+                return False
+        except OSError as e:
+            logger.error(f"快照文件缺失: {path}: {e}")
+            return False
+
+        if rel_path.endswith('.db'):
+            conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+            try:
+                if conn.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+                    logger.error(f"快照数据库完整性检查失败: {path}")
+                    return False
+            finally:
+                conn.close()
+    return True
+
+def restore_snapshot(snapshot_path: str, target_dir: str) -> bool:
+    """从快照恢复到目标目录（需在服务停止时执行）
+
+    先校验快照，复制到临时目录后再按清单校验一次，全部通过才替换目标目录，
+    原目录保留为 <目标目录>.before_restore。
+    """
+    if not verify_snapshot(snapshot_path):
+        return False
+
+    target_dir = os.path.abspath(target_dir)
+    staging = target_dir + ".restoring"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        manifest = load_manifest(snapshot_path)
+        for rel_path in manifest["files"]:
+            target = os.path.join(staging, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(snapshot_path, rel_path), target)
+        shutil.copy2(os.path.join(snapshot_path, MANIFEST_NAME), os.path.join(staging, MANIFEST_NAME))
+
+        if not verify_snapshot(staging):
+            logger.error(f"恢复数据校验失败，目标目录未改动: {target_dir}")
+            return False
+        os.remove(os.path.join(staging, MANIFEST_NAME))
+
+        previous = target_dir + ".before_restore"
+        if os.path.exists(target_dir):
+            shutil.rmtree(previous, ignore_errors=True)
+            os.rename(target_dir, previous)
+        os.rename(staging, target_dir)
+        logger.info(f"已从快照 {snapshot_path} 恢复到 {target_dir}")
+        return True
+    except (IOError, OSError) as e:
+        logger.error(f"从快照恢复失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def restore_sqlite(snapshot_path: str, rel_path: str, db_path: str) -> bool:
+    """从快照恢复SQLite数据库文件（需在服务停止时执行）
+
+    校验快照后复制到临时文件，完整性检查通过才替换原数据库，
+    原数据库保留为 <数据库>.before_restore，旧的WAL/SHM文件一并移除。
+    """
+    if not verify_snapshot(snapshot_path):
+        return False
+
+    staging = db_path + ".restoring"
+    try:
+        shutil.copy2(os.path.join(snapshot_path, rel_path), staging)
+        conn = sqlite3.connect(staging)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            logger.error(f"恢复的数据库完整性检查失败，原数据库未改动: {result}")
+            os.remove(staging)
+            return False
+
+        if os.path.exists(db_path):
+            os.replace(db_path, db_path + ".before_restore")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        os.replace(staging, db_path)
+        logger.info(f"已从快照 {snapshot_path} 恢复数据库 {db_path}")
+        return True
+    except (IOError, OSError, sqlite3.Error) as e:
+        logger.error(f"恢复数据库失败: {e}")
+        if os.path.exists(staging):
+            os.remove(staging)
+        return False
+
+
+class BackupScheduler:
+    """在低优先级后台线程上定期执行备份任务"""
+
+    def __init__(self, job: Callable[[], object], interval: int, name: str = "backup"):
+        self.job = job
+        self.interval = interval
+        self.name = name
+        self.stop_event = threading.Event()
+        self.last_result = None
+        self.thread = None
+
+    def _run(self):
+        lower_thread_priority()
+        while not self.stop_event.wait(self.interval):
+            started = time.time()
+            try:
+                self.last_result = self.job()
+                # 任务返回None表示没有需要备份的数据或已在任务内记录失败
+                if self.last_result is not None:
+                    logger.info(f"{self.name} 备份完成，用时 {time.time() - started:.1f}秒: {self.last_result}")
+                else:
+                    logger.info(f"{self.name} 本次未生成备份")
+            except Exception as e:
+                logger.error(f"{self.name} 备份失败: {e}")
+
+    def start(self):
+        """启动备份线程"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止备份线程"""
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    # 命令行: python incremental_backup.py verify <快照目录>
+    #         python incremental_backup.py restore <快照目录> <目标目录>
+    #         python incremental_backup.py restore-db <快照目录> <数据库文件名> <数据库路径>
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    if len(sys.argv) == 3 and sys.argv[1] == "verify":
+        ok = verify_snapshot(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == "restore":
+        ok = restore_snapshot(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 5 and sys.argv[1] == "restore-db":
+        ok = restore_sqlite(sys.argv[2], sys.argv[3], sys.argv[4])
+    else:
+        print("用法: incremental_backup.py verify <快照目录> | restore <快照目录> <目标目录> | "
+              "restore-db <快照目录> <数据库文件名> <数据库路径>")
+        sys.exit(2)
+    print("成功" if ok else "失败")
+    sys.exit(0 if ok else 1)
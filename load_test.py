@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Web服务负载测试
+
+先在没有事件流连接时测量普通请求的延迟作为基线，再保持若干个SSE连接并重复测量，
+对比两者的延迟分布，检查长连接是否挤占普通请求。只依赖标准库。
+
+    python load_test.py --host 127.0.0.1 --port 8081 --sse-clients 50
+"""
+
+import argparse
+import http.client
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SSEClient(threading.Thread):
+    """保持一个SSE连接并统计收到的事件数"""
+
+    def __init__(self, host: str, port: int, path: str):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.sock = None
+        self.status = None
+        self.events = 0
+        self.connected = threading.Event()
+        self.closed = False
+
+    def run(self):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=10)
+            self.sock.sendall(
+                f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Accept: text/event-stream\r\n\r\n".encode('ascii')
+            )
+            buffer = b''
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                if self.status is None and b'\r\n' in buffer:
+                    self.status = int(buffer.split(b' ', 2)[1])
+                    self.connected.set()
+                self.events += buffer.count(b'\n\n')
+                buffer = buffer[buffer.rfind(b'\n\n') + 2:] if b'\n\n' in buffer else buffer
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.connected.set()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+def timed_request(host: str, port: int, path: str) -> tuple:
+    """发送一次GET请求，返回 (耗时秒, 状态码)"""
+    start = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return time.perf_counter() - start, response.status
+    except OSError:
+        return time.perf_counter() - start, None
+
+
+def measure(host: str, port: int, path: str, requests: int, concurrency: int) -> dict:
+    """并发发送请求并统计延迟分布(毫秒)"""
+    with ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(lambda _: timed_request(host, port, path), range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(duration * 1000 for duration, status in results if status == 200)
+    if not latencies:
+        return {'ok': 0, 'errors': len(results)}
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        'ok': len(latencies),
+        'errors': len(results) - len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': latencies[-1]
+    }
+
+
+def print_result(title: str, result: dict):
+    if not result['ok']:
+        print(f"{title:<16} 全部失败 ({result['errors']} 个错误)")
+        return
+    print(f"{title:<16} 成功 {result['ok']:>5}  错误 {result['errors']:>3}  {result['rps']:8.1f} req/s  "
+          f"p50 {result['p50']:7.1f}ms  p95 {result['p95']:7.1f}ms  "
+          f"p99 {result['p99']:7.1f}ms  max {result['max']:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web服务负载测试：SSE长连接下的普通请求延迟")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--path', default='/api/devices', help="测量延迟的请求路径")
+    parser.add_argument('--sse-path', default='/events')
+    parser.add_argument('--sse-clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"目标 http://{args.host}:{args.port}{args.path}，{args.requests} 个请求，并发 {args.concurrency}")
+    baseline = measure(args.host, args.port, args.path, args.requests, args.concurrency)
+    print_result("无SSE连接", baseline)
+
+    clients = [SSEClient(args.host, args.port, args.sse_path) for _ in range(args.sse_clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.connected.wait(10)
+    streaming = sum(1 for client in clients if client.status == 200 and not client.closed)
+    rejected = sum(1 for client in clients if client.status not in (None, 200))
+    print(f"已建立SSE连接 {streaming}/{args.sse_clients}" + (f"，被拒绝 {rejected}" if rejected else ""))
+
+    loaded = measure(args.host, args.port, args.path, args.requests, args.concurrency)
+    print_result(f"{streaming}个SSE连接", loaded)
+
+    still_open = sum(1 for client in clients if not client.closed)
+    events = sum(client.events for client in clients)
+    print(f"测试结束时仍保持的SSE连接 {still_open}，共收到事件/心跳 {events} 条")
+    for client in clients:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
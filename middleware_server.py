@@ -6,19 +6,37 @@ import threading
 import time
 import json
 import logging
+import math
 import os
+import io
+import csv
+import zlib
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response
-from queue import Queue
+from logging.handlers import RotatingFileHandler
+from flask import Flask, request, jsonify, Response
+from itertools import islice
+from urllib.parse import urlencode
 import struct
-from device_logs import DeviceLogManager
+from device_logs import DeviceLogManager, encode_cursor, decode_cursor
+from device_metrics import MetricsRollup, RssiHistory
+from storage_quota import RetentionEngine, DataClass, DirectoryDataClass, parse_size
+from incremental_backup import BackupScheduler
+from event_broker import EventBroker, SubscriptionFilter, BATCH_WINDOW
+from pooled_server import run_pooled_server
+from web_assets import WebAssets
+from discovery import DiscoveryScheduler
+from command_pipeline import CommandPipeline, REJECT_CONFLICT
+
+# 应用日志轮转：单个文件最大大小与保留的历史文件数
+MAX_LOG_SIZE = "10MB"
+MAX_LOG_FILES = 5
 
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('middleware.log'),
+        RotatingFileHandler('middleware.log', maxBytes=parse_size(MAX_LOG_SIZE), backupCount=MAX_LOG_FILES),
         logging.StreamHandler()
     ]
 )
@@ -84,6 +102,43 @@ SERVER_IP = "192.168.0.25"  # 手动指定本机IP地址
 BROADCAST_PORT = 5439  # 发送下行帧的端口
 LISTEN_PORT = 5439     # 监听上行帧的端口
 WEB_PORT = 8081        # Web服务端口
+# Web服务运行模式: production 有界线程池 / development Flask开发服务器(每个连接一个线程)
+WEB_SERVER_MODE = "production"
+WEB_MAX_CONNECTIONS = 32      # 普通请求线程数
+WEB_STREAM_CONNECTIONS = 100  # SSE/长轮询连接上限，单独的线程池，不占用请求线程
+# 由流式线程池处理的长连接路径
+STREAM_PATHS = ('/events', '/api/events/poll', '/test_sse')
+
+# 磁盘配额（字节数或 "10MB" 形式），超出后从最旧的数据开始淘汰
+STORAGE_QUOTAS = {
+    'app_log': "60MB",       # middleware.log 及其轮转文件
+    'device_logs': "200MB",  # device_logs/ 设备日志段
+    'backups': "500MB",      # backup_logs/ 日志备份
+    'captures': "100MB"      # captures/ 抓包等诊断数据
+}
+BACKUP_RETENTION_DAYS = 7    # 备份保留天数
+BACKUP_INTERVAL = 3600       # 设备日志增量备份间隔(秒)
+
+# 日志导出：每次输出给客户端的数据块大小(字节)
+EXPORT_CHUNK_SIZE = 64 * 1024
+# CSV导出的固定列，其余字段合并为JSON写入extra列
+EXPORT_CSV_FIELDS = ['timestamp', 'device_id', 'type', 'message', 'wifi_rssi', 'source_ip']
+
+# 设备发现：单播探测速率(个/秒)、波次大小、波次间隔(秒)、跳过最近有数据设备的时间窗(秒)、最多探测轮数
+DISCOVERY_RATE = 20
+DISCOVERY_WAVE_SIZE = 32
+DISCOVERY_WAVE_INTERVAL = 2.0
+DISCOVERY_FRESH_WINDOW = 60
+DISCOVERY_MAX_ROUNDS = 3
+
+# 下行命令：首次等待应答时间(秒，之后指数退避)、最多发送次数、每个设备同时在途的命令数
+COMMAND_RETRY_TIMEOUT = 2.0
+COMMAND_MAX_ATTEMPTS = 4
+COMMAND_MAX_INFLIGHT_PER_DEVICE = 2
+
+# 事件长轮询：默认与最长等待时间(秒)
+POLL_TIMEOUT = 25
+POLL_MAX_TIMEOUT = 60
 
 # 协议帧定义
 FRAME_HEAD = 0xAA
@@ -100,6 +155,20 @@ CMD_HEARTBEAT = 0x03  # 心跳包
 CMD_MODIFY_ID = 0x04      # 修改设备ID
 CMD_IMMEDIATE_REPORT = 0x05  # 立即上报
 
+# 指标汇总中使用的命令名称
+CMD_NAMES = {
+    CMD_ONLINE: 'online',
+    CMD_ALARM: 'alarm',
+    CMD_RECOVER: 'recover',
+    CMD_HEARTBEAT: 'heartbeat'
+}
+
+# 设备消息事件的严重级别，用于SSE订阅过滤
+EVENT_SEVERITY = {
+    CMD_ALARM: 'critical',
+    CMD_RECOVER: 'warning'
+}
+
 # 状态定义
 STATUS_NORMAL = 0x00  # 正常状态
 STATUS_ALARM = 0x01   # 报警状态
@@ -109,18 +178,23 @@ STATUS_RECOVER = 0x02 # 恢复状态
 ID_BROADCAST = 0xFF  # 广播ID
 
 class DeviceManager:
-    def __init__(self, sse_queue=None):
+    def __init__(self, event_broker=None):
         self.devices = {}  # 设备信息存储
         self.lock = threading.Lock()
         self.pending_id_changes = {}  # 跟踪正在进行的ID修改: {source_ip: {'old_id': old_id, 'new_id': new_id, 'timestamp': timestamp}}
-        self.sse_queue = sse_queue  # SSE事件队列
+        self.event_broker = event_broker  # SSE事件发布/订阅代理
         self.log_manager = DeviceLogManager()  # 设备日志管理器
+        self.metrics = MetricsRollup()  # 设备指标时序汇总
+        self.rssi_history = RssiHistory()  # 设备RSSI采样环形缓冲
+        self.discovery = None  # 设备发现调度器，首次发现时创建
         self.devices_file = 'device_cache.json'  # 设备信息缓存文件
         
         # 启动时加载设备信息
         self.load_devices_from_file()
         
     def update_device(self, device_id, cmd, status, wifi_rssi, source_ip):
+        # 日志在释放锁之后入队，日志队列已满时不阻塞其它设备的上报与接口查询
+        log_entries = []
         with self.lock:
             now = datetime.now()
             
@@ -141,7 +215,7 @@ class DeviceManager:
             if cmd == CMD_ONLINE:
                 conflict_detected = self._check_id_conflict(device_id, source_ip)
                 if conflict_detected:
-                    # 处理ID冲突 - 需要在UDPServer中调用，因为需要udp_client
+                    # 处理ID冲突 - 需要在UDPServer中调用，因为需要下行命令队列
                     logger.info(f"ID冲突检测：设备 {device_id} (IP: {source_ip}) 与现有设备冲突")
                     # 返回特殊标记表示需要处理ID冲突
                     return {'conflict': True, 'device_id': device_id, 'source_ip': source_ip}
@@ -172,10 +246,10 @@ class DeviceManager:
                 logger.info(f"设备 {device_id} 重新上线 (IP: {source_ip})")
                 
                 # 添加重新上线日志
-                self.log_manager.add_log_entry(device_id, 'online', '设备重新上线', wifi_rssi, source_ip)
+                log_entries.append(('online', '设备重新上线'))
                 
                 # 发送设备重新上线的SSE事件
-                if self.sse_queue is not None:
+                if self.event_broker is not None:
                     online_message = {
                         'type': 'device_online',
                         'timestamp': now.isoformat(),
@@ -183,7 +257,7 @@ class DeviceManager:
                         'source_ip': source_ip,
                         'message': f'设备 {device_id} 重新上线 (IP: {source_ip})'
                     }
-                    self.sse_queue.put(online_message)
+                    self.event_broker.publish(online_message)
                     logger.info(f"设备重新上线SSE消息已发送: {device_id}")
             
             device['last_seen'] = now
@@ -193,29 +267,36 @@ class DeviceManager:
             # 更新设备状态 - 确保所有命令都正确设置状态
             if cmd == CMD_ONLINE:
                 device['status'] = 'online'
-                self.log_manager.add_log_entry(device_id, 'online', '设备上线', wifi_rssi, source_ip)
+                log_entries.append(('online', '设备上线'))
             elif cmd == CMD_ALARM:
                 device['status'] = 'alarm'
                 device['alarm_count'] += 1
-                self.log_manager.add_log_entry(device_id, 'alarm', '设备报警', wifi_rssi, source_ip)
+                log_entries.append(('alarm', '设备报警'))
             elif cmd == CMD_RECOVER:
                 device['status'] = 'recover'
                 device['recover_count'] += 1
-                self.log_manager.add_log_entry(device_id, 'recover', '设备恢复', wifi_rssi, source_ip)
+                log_entries.append(('recover', '设备恢复'))
             elif cmd == CMD_HEARTBEAT:
                 device['status'] = 'heartbeat'
                 device['heartbeat_count'] += 1
-                self.log_manager.add_log_entry(device_id, 'heartbeat', '设备心跳', wifi_rssi, source_ip)
+                log_entries.append(('heartbeat', '设备心跳'))
             else:
                 # 对于未知命令，保持当前状态，但更新最后在线时间
                 if device['status'] == 'unknown':
                     device['status'] = 'online'  # 如果之前是unknown，改为online
-                self.log_manager.add_log_entry(device_id, 'unknown', f'未知命令: {cmd:02X}', wifi_rssi, source_ip)
+                log_entries.append(('unknown', f'未知命令: {cmd:02X}'))
+            
+            self.metrics.record(device_id, CMD_NAMES.get(cmd, 'unknown'), wifi_rssi, now.timestamp())
+            self.rssi_history.record(device_id, wifi_rssi, now.timestamp())
             
             # 设备状态发生变化时，异步保存设备信息
             threading.Thread(target=self.save_devices_to_file, daemon=True).start()
             
-            return device.copy()
+            result = device.copy()
+        
+        for log_type, message in log_entries:
+            self.log_manager.enqueue_log_entry(device_id, log_type, message, wifi_rssi, source_ip)
+        return result
     
     def get_device(self, device_id):
         with self.lock:
@@ -325,8 +406,8 @@ class DeviceManager:
                     }
                     
                     # 将消息添加到SSE队列
-                    if self.sse_queue is not None:
-                        self.sse_queue.put(device_change_message)
+                    if self.event_broker is not None:
+                        self.event_broker.publish(device_change_message)
                         logger.info(f"发送设备ID修改SSE事件: {old_id} -> {device_id} (IP: {source_ip})")
                 
                 # 清除待处理的ID修改记录
@@ -355,6 +436,32 @@ class DeviceManager:
                 logger.warning(f"清理过期的ID修改记录: {ip}")
                 del self.pending_id_changes[ip]
     
+    def on_command_complete(self, command):
+        """下行命令得到应答或重发用尽：清理失败的ID修改记录并通知前端"""
+        acked = command['state'] == 'acked'
+        if not acked and command['cmd'] == CMD_MODIFY_ID:
+            # 设备没有以新ID上报，不再等待ID迁移
+            with self.lock:
+                for ip, change_info in list(self.pending_id_changes.items()):
+                    if change_info['old_id'] == command['device_id'] and change_info['new_id'] == command['reply_id']:
+                        logger.warning(f"ID修改无应答，清除修改记录: {ip} 从 {change_info['old_id']} 到 {change_info['new_id']}")
+                        del self.pending_id_changes[ip]
+        
+        if self.event_broker is not None:
+            if acked:
+                message = f"{command['name']}命令已确认: 设备 {command['device_id']}，发送 {command['attempts']} 次，耗时 {command['latency']}秒"
+            else:
+                message = f"{command['name']}命令无应答: 设备 {command['device_id']} ({command['target_ip']})，已发送 {command['attempts']} 次"
+            result_message = {
+                'type': 'command_result',
+                'timestamp': datetime.now().isoformat(),
+                'device_id': command['device_id'],
+                'success': acked,
+                'message': message,
+                'command': command
+            }
+            self.event_broker.publish(result_message, severity="info" if acked else "warning")
+    
     def check_offline_devices(self, offline_timeout=180):
         """检查离线设备 (默认3分钟)"""
         with self.lock:
@@ -370,20 +477,15 @@ class DeviceManager:
                         newly_offline_devices.append(device_id)
                         logger.info(f"设备 {device_id} 离线 (超过 {offline_timeout} 秒无响应)")
             
-            # 为离线设备添加日志记录
+            # 离线日志在释放锁之后入队
+            log_entries = []
             for device_id in newly_offline_devices:
                 device = self.devices.get(device_id)
                 if device:
-                    self.log_manager.add_log_entry(
-                        device_id, 
-                        'offline', 
-                        '设备离线（超时无响应）', 
-                        device.get('wifi_rssi', 0), 
-                        device.get('source_ip', '')
-                    )
+                    log_entries.append((device_id, device.get('wifi_rssi', 0), device.get('source_ip', '')))
             
             # 发送离线设备的SSE事件
-            if self.sse_queue is not None:
+            if self.event_broker is not None:
                 for device_id in newly_offline_devices:
                     device = self.devices.get(device_id)
                     offline_message = {
@@ -393,10 +495,12 @@ class DeviceManager:
                         'source_ip': device.get('source_ip', '') if device else '',
                         'message': f'设备 {device_id} 离线（超过 {offline_timeout} 秒无响应）'
                     }
-                    self.sse_queue.put(offline_message)
+                    self.event_broker.publish(offline_message, severity="warning")
                     logger.info(f"设备离线SSE消息已发送: {device_id}")
-            
-            return newly_offline_devices
+        
+        for device_id, wifi_rssi, source_ip in log_entries:
+            self.log_manager.enqueue_log_entry(device_id, 'offline', '设备离线（超时无响应）', wifi_rssi, source_ip)
+        return newly_offline_devices
     
     def _check_id_conflict(self, device_id: int, source_ip: str) -> bool:
         """检查设备ID是否冲突"""
@@ -416,7 +520,7 @@ class DeviceManager:
             return True
         return False
     
-    def _handle_id_conflict(self, device_id: int, source_ip: str, udp_client) -> int:
+    def _handle_id_conflict(self, device_id: int, source_ip: str, commands) -> int:
         """处理ID冲突，返回新分配的ID"""
         # 生成新的ID
         new_id = self._generate_available_id()
@@ -424,15 +528,15 @@ class DeviceManager:
             logger.error(f"无法为设备 {device_id} (IP: {source_ip}) 分配新ID：所有ID已被使用")
             return 0  # 返回0表示失败
         
-        # 发送ID修改命令
-        success = udp_client.modify_device_id(device_id, new_id, source_ip)
+        # 发送ID修改命令，等待设备以新ID上报，超时重发
+        command, error, _ = commands.submit(CMD_MODIFY_ID, device_id, new_id, source_ip, reply_id=new_id)
         
-        if success:
+        if command is not None:
             # 注册ID修改操作
             self.register_id_change(source_ip, device_id, new_id)
             
             # 发送ID冲突处理的SSE事件
-            if self.sse_queue is not None:
+            if self.event_broker is not None:
                 conflict_message = {
                     'type': 'id_conflict',
                     'timestamp': datetime.now().isoformat(),
@@ -441,10 +545,10 @@ class DeviceManager:
                     'source_ip': source_ip,
                     'message': f'检测到ID冲突，设备 {device_id} 已自动修改为 {new_id}'
                 }
-                self.sse_queue.put(conflict_message)
+                self.event_broker.publish(conflict_message, severity="warning")
             
             # 添加冲突处理日志
-            self.log_manager.add_log_entry(
+            self.log_manager.enqueue_log_entry(
                 new_id, 'conflict', 
                 f'ID冲突自动处理：原ID {device_id} 改为 {new_id}', 
                 0, source_ip
@@ -452,7 +556,7 @@ class DeviceManager:
             
             return new_id
         else:
-            logger.error(f"发送ID修改命令失败：设备 {device_id} (IP: {source_ip}) -> {new_id}")
+            logger.error(f"发送ID修改命令失败：设备 {device_id} (IP: {source_ip}) -> {new_id}: {error}")
             return 0  # 返回0表示失败
     
     def _generate_available_id(self) -> int:
@@ -539,7 +643,7 @@ class DeviceManager:
                 self.devices.clear()
     
     def broadcast_immediate_report(self, udp_client):
-        """广播立即上报命令以重新发现设备"""
+        """广播立即上报命令以发现未知设备（所有设备会同时应答，仅在没有已知设备时使用）"""
         try:
             logger.info("发送广播立即上报命令，重新发现设备...")
             
@@ -548,64 +652,76 @@ class DeviceManager:
             
             if success:
                 logger.info("广播立即上报命令已发送")
-                
-                # 如果有缓存的设备，也向它们的IP单独发送
-                with self.lock:
-                    unique_ips = set()
-                    for device in self.devices.values():
-                        if device['source_ip'] not in unique_ips:
-                            unique_ips.add(device['source_ip'])
-                            udp_client.immediate_report(ID_BROADCAST, device['source_ip'])
-                
-                if unique_ips:
-                    logger.info(f"向 {len(unique_ips)} 个已知IP地址发送了立即上报命令")
             else:
                 logger.error("发送广播立即上报命令失败")
+            return success
         except Exception as e:
             logger.error(f"广播立即上报命令错误: {e}")
+            return False
     
-    def start_device_discovery(self, udp_client):
-        """启动设备发现流程"""
-        def discovery_worker():
-            # 等待2秒让服务器完全启动
-            time.sleep(2)
-            
-            # 第一次立即发现
-            self.broadcast_immediate_report(udp_client)
-            
-            # 等待5秒让设备响应
-            time.sleep(5)
-            
-            # 再次发送以确保发现所有设备
-            self.broadcast_immediate_report(udp_client)
-            
-            # 保存当前设备状态
-            self.save_devices_to_file()
-            
-            # 发送设备重新发现的SSE事件
-            if self.sse_queue is not None:
-                discovery_message = {
-                    'type': 'device_discovery',
-                    'timestamp': datetime.now().isoformat(),
-                    'message': '设备重新发现完成，请刷新页面查看最新设备状态'
-                }
-                self.sse_queue.put(discovery_message)
+    def get_discovery_targets(self):
+        """已知设备IP及最后一次收到该IP数据的时间戳"""
+        with self.lock:
+            targets = {}
+            for device in self.devices.values():
+                ip = device.get('source_ip')
+                if not ip:
+                    continue
+                heard = device['last_seen'].timestamp() if isinstance(device['last_seen'], datetime) else None
+                if ip not in targets or (heard is not None and (targets[ip] is None or heard > targets[ip])):
+                    targets[ip] = heard
+            return targets
+    
+    def _get_discovery(self, udp_client):
+        """创建（首次调用时）设备发现调度器"""
+        if self.discovery is None:
+            self.discovery = DiscoveryScheduler(
+                self.get_discovery_targets,
+                lambda ip: udp_client.immediate_report(ID_BROADCAST, ip),
+                lambda: self.broadcast_immediate_report(udp_client),
+                self._on_discovery_complete,
+                rate=DISCOVERY_RATE,
+                wave_size=DISCOVERY_WAVE_SIZE,
+                wave_interval=DISCOVERY_WAVE_INTERVAL,
+                fresh_window=DISCOVERY_FRESH_WINDOW,
+                max_rounds=DISCOVERY_MAX_ROUNDS
+            )
+        return self.discovery
+    
+    def _on_discovery_complete(self, report):
+        """一次设备发现结束：保存设备状态并通知前端"""
+        self.save_devices_to_file()
         
-        # 启动发现线程
-        discovery_thread = threading.Thread(target=discovery_worker, daemon=True)
-        discovery_thread.start()
-        logger.info("设备发现流程已启动")
+        if self.event_broker is not None:
+            discovery_message = {
+                'type': 'device_discovery',
+                'timestamp': datetime.now().isoformat(),
+                'message': (
+                    f"设备重新发现完成: 探测 {report['probed']} 个IP，应答 {report['replied']}，"
+                    f"未应答 {len(report['silent'])}，耗时 {report['duration']}秒"
+                ),
+                'report': report
+            }
+            self.event_broker.publish(discovery_message)
+    
+    def start_device_discovery(self, udp_client, skip_fresh=True, delay=2):
+        """启动设备发现流程，已有发现在进行时返回False"""
+        # 默认等待2秒让服务器完全启动
+        started = self._get_discovery(udp_client).start(skip_fresh=skip_fresh, delay=delay)
+        if started:
+            logger.info("设备发现流程已启动")
+        else:
+            logger.info("设备发现正在进行中，忽略本次请求")
+        return started
     
     def start_periodic_discovery(self, udp_client, interval=300):
-        """启动定期设备发现（默认5分钟间隔）"""
+        """启动定期设备发现（默认5分钟间隔），只探测最近没有收到数据的设备"""
         def periodic_worker():
             while True:
                 time.sleep(interval)  # 等待指定间隔
                 try:
                     logger.info("执行定期设备发现...")
-                    self.broadcast_immediate_report(udp_client)
-                    # 保存当前设备状态
-                    self.save_devices_to_file()
+                    self._get_discovery(udp_client).start(skip_fresh=True)
                 except Exception as e:
                     logger.error(f"定期设备发现错误: {e}")
         
@@ -615,9 +731,10 @@ class DeviceManager:
         logger.info(f"定期设备发现已启动，间隔: {interval}秒")
 
 class UDPServer:
-    def __init__(self, device_manager, sse_queue):
+    def __init__(self, device_manager, event_broker, command_pipeline=None):
         self.device_manager = device_manager
-        self.sse_queue = sse_queue
+        self.event_broker = event_broker
+        self.command_pipeline = command_pipeline  # 下行命令队列，上行帧用于确认在途命令
         self.socket = None
         self.running = False
         
@@ -684,6 +801,10 @@ class UDPServer:
             # 记录接收到的帧
             logger.info(f"收到上行帧 from {addr}: {data.hex()} - 设备ID: {device_id}, 指令: {self.get_cmd_name(cmd)}")
             
+            # 确认等待该设备应答的下行命令
+            if self.command_pipeline is not None:
+                self.command_pipeline.on_uplink(addr[0], device_id, cmd)
+            
             # 更新设备信息
             device = self.device_manager.update_device(device_id, cmd, status, wifi, addr[0])
             
@@ -693,9 +814,7 @@ class UDPServer:
                 conflict_device_id = device['device_id']
                 conflict_source_ip = device['source_ip']
                 
-                # 创建全局udp_client引用
-                global udp_client
-                new_id = self.device_manager._handle_id_conflict(conflict_device_id, conflict_source_ip, udp_client)
+                new_id = self.device_manager._handle_id_conflict(conflict_device_id, conflict_source_ip, self.command_pipeline)
                 
                 if new_id > 0:
                     logger.info(f"ID冲突处理：设备 {conflict_device_id} (IP: {conflict_source_ip}) 被分配新ID: {new_id}")
@@ -709,7 +828,7 @@ class UDPServer:
                         'source_ip': conflict_source_ip,
                         'message': f'设备ID冲突已自动处理: {conflict_device_id} -> {new_id}'
                     }
-                    self.sse_queue.put(conflict_message)
+                    self.event_broker.publish(conflict_message, severity="warning")
                 else:
                     logger.error(f"ID冲突处理失败：设备 {conflict_device_id} (IP: {conflict_source_ip})")
                 
@@ -747,8 +866,13 @@ class UDPServer:
                 'device_info': device_info_serializable
             }
             
-            # 推送到SSE队列
-            self.sse_queue.put(sse_message)
+            # 推送到SSE队列：同一设备的状态更新可被后续更新取代，报警/恢复始终逐条推送
+            self.event_broker.publish(
+                sse_message,
+                key=f"device:{device_id}",
+                critical=cmd in (CMD_ALARM, CMD_RECOVER),
+                severity=EVENT_SEVERITY.get(cmd, "info")
+            )
             logger.info(f"SSE消息已发送: 设备 {device_id} - {self.get_cmd_name(cmd)}")
             
         except Exception as e:
@@ -761,7 +885,7 @@ class UDPServer:
                 'device_id': device_id if 'device_id' in locals() else 'unknown',
                 'source_ip': addr[0] if 'addr' in locals() else 'unknown'
             }
-            self.sse_queue.put(error_message)
+            self.event_broker.publish(error_message, severity="warning")
     
     def get_cmd_name(self, cmd):
         cmd_names = {
@@ -814,16 +938,46 @@ class UDPClient:
         return self.send_frame(CMD_IMMEDIATE_REPORT, device_id, 0x00, 0x00, target_ip)
 
 # 全局对象
-sse_queue = Queue()
-device_manager = DeviceManager(sse_queue)
+event_broker = EventBroker()
+device_manager = DeviceManager(event_broker)
 udp_client = UDPClient()
+command_pipeline = CommandPipeline(
+    lambda cmd, device_id, status, target_ip: udp_client.send_frame(cmd, device_id, status, 0x00, target_ip),
+    device_manager.on_command_complete,
+    udp_client.get_cmd_name,
+    retry_timeout=COMMAND_RETRY_TIMEOUT,
+    max_attempts=COMMAND_MAX_ATTEMPTS,
+    max_inflight_per_device=COMMAND_MAX_INFLIGHT_PER_DEVICE
+)
+retention_engine = RetentionEngine()
+
+def setup_retention_engine():
+    """注册各类磁盘数据的配额并启动保留策略引擎"""
+    log_manager = device_manager.log_manager
+    retention_engine.register(DirectoryDataClass(
+        'app_log', parse_size(STORAGE_QUOTAS['app_log']), '.', prefix='middleware.log', keep=1
+    ))
+    retention_engine.register(DataClass(
+        'device_logs', parse_size(STORAGE_QUOTAS['device_logs']),
+        log_manager.get_disk_usage, log_manager.evict_oldest_segment
+    ))
+    retention_engine.register(DirectoryDataClass(
+        'backups', parse_size(STORAGE_QUOTAS['backups']), 'backup_logs',
+        prefix='device_logs_backup_', max_age=BACKUP_RETENTION_DAYS * 86400
+    ))
+    retention_engine.register(DirectoryDataClass(
+        'captures', parse_size(STORAGE_QUOTAS['captures']), 'captures'
+    ))
+    retention_engine.start()
 
 # Flask应用
 app = Flask(__name__)
+# 静态资源哈希命名、页面骨架缓存与响应压缩
+web_assets = WebAssets(app)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return web_assets.render_shell('index.html')
 
 @app.route('/api/devices')
 def get_devices():
@@ -895,24 +1049,25 @@ def modify_device_id():
                 'message': f'新ID {new_id} 已被其他设备使用，请选择其他ID'
             }), 400
         
-        # 发送修改ID命令
-        success = udp_client.modify_device_id(current_id, new_id, target_ip)
+        # 发送修改ID命令：设备以新ID上报即为完成，无应答时自动重发
+        command, error, reason = command_pipeline.submit(CMD_MODIFY_ID, current_id, new_id, target_ip, reply_id=new_id)
         
-        if success:
-            # 注册ID修改操作
-            device_manager.register_id_change(device_ip, current_id, new_id)
-            
-            logger.info(f"设备ID修改命令已发送: {current_id} -> {new_id} (IP: {device_ip})")
-            
-            return jsonify({
-                'success': True,
-                'message': f'设备ID修改命令已发送: {current_id} -> {new_id}。请等待设备响应（通常需要几秒钟）'
-            })
-        else:
+        if command is None:
             return jsonify({
                 'success': False,
-                'message': '发送修改ID命令失败'
-            }), 500
+                'message': error
+            }), 409 if reason == REJECT_CONFLICT else 429
+        
+        # 注册ID修改操作
+        device_manager.register_id_change(device_ip, current_id, new_id)
+        
+        logger.info(f"设备ID修改命令已发送: {current_id} -> {new_id} (IP: {device_ip})")
+        
+        return jsonify({
+            'success': True,
+            'message': f'设备ID修改命令已发送: {current_id} -> {new_id}（命令 #{command["id"]}）。请等待设备响应（通常需要几秒钟）',
+            'command': command
+        })
             
     except Exception as e:
         logger.error(f"修改设备ID错误: {e}")
@@ -935,19 +1090,32 @@ def immediate_report():
                 'message': '设备ID不能为空'
             }), 400
         
-        # 发送立即上报命令
-        success = udp_client.immediate_report(device_id, target_ip)
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'立即上报命令已发送给设备 {device_id}'
-            })
-        else:
+        # 广播ID无法确认由哪个设备应答，直接发送
+        if device_id == ID_BROADCAST:
+            if udp_client.immediate_report(device_id, target_ip):
+                return jsonify({
+                    'success': True,
+                    'message': '立即上报命令已广播'
+                })
             return jsonify({
                 'success': False,
                 'message': '发送立即上报命令失败'
             }), 500
+        
+        # 发送立即上报命令：收到该设备上报即为完成，无应答时自动重发
+        command, error, reason = command_pipeline.submit(CMD_IMMEDIATE_REPORT, device_id, 0x00, target_ip, reply_id=device_id)
+        
+        if command is None:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 409 if reason == REJECT_CONFLICT else 429
+        
+        return jsonify({
+            'success': True,
+            'message': f'立即上报命令已发送给设备 {device_id}（命令 #{command["id"]}）',
+            'command': command
+        })
             
     except Exception as e:
         logger.error(f"立即上报错误: {e}")
@@ -956,14 +1124,49 @@ def immediate_report():
             'message': f'服务器错误: {str(e)}'
         }), 500
 
+@app.route('/api/commands')
+def get_commands():
+    """获取在途与最近完成的下行命令及其状态"""
+    device_id = request.args.get('device_id', type=int)
+    return jsonify({
+        'success': True,
+        'commands': command_pipeline.list_commands(device_id),
+        'stats': command_pipeline.get_stats()
+    })
+
+@app.route('/api/commands/<int:command_id>')
+def get_command(command_id):
+    """获取单个下行命令的完成状态"""
+    command = command_pipeline.get_command(command_id)
+    if command is None:
+        return jsonify({
+            'success': False,
+            'message': '命令不存在或记录已过期'
+        }), 404
+    return jsonify({
+        'success': True,
+        'command': command
+    })
+
+@app.route('/api/discovery/status')
+def get_discovery_status():
+    """获取设备发现进度与上一次发现的完成时间、应答丢失统计"""
+    if device_manager.discovery is None:
+        return jsonify({'success': True, 'status': {'running': False, 'current': None, 'last_report': None}})
+    return jsonify({'success': True, 'status': device_manager.discovery.get_status()})
+
 @app.route('/api/rediscover_devices', methods=['POST'])
 def rediscover_devices():
     """手动重新发现设备"""
     try:
         logger.info("接收到手动重新发现设备请求")
         
-        # 启动设备发现流程
-        device_manager.start_device_discovery(udp_client)
+        # 启动设备发现流程：手动发现时不跳过最近有数据的设备
+        if not device_manager.start_device_discovery(udp_client, skip_fresh=False, delay=0):
+            return jsonify({
+                'success': True,
+                'message': '设备发现正在进行中，请等待结果'
+            })
         
         return jsonify({
             'success': True,
@@ -985,19 +1188,25 @@ def get_device_logs(device_id):
         log_type = request.args.get('type', None)
         start_time = request.args.get('start_time', None)
         end_time = request.args.get('end_time', None)
+        cursor = request.args.get('cursor', None)
         
-        if log_type or start_time or end_time:
-            logs = device_manager.log_manager.search_logs(
-                device_id, log_type, start_time, end_time, limit
-            )
-        else:
-            logs = device_manager.log_manager.get_device_logs(device_id, limit)
+        # 默认返回最近的limit条，next翻向更早的日志，prev翻向更新的日志
+        page = device_manager.log_manager.get_device_logs_page(
+            device_id, limit, cursor, log_type, start_time, end_time
+        )
         
         return jsonify({
             'success': True,
-            'logs': logs,
-            'count': len(logs)
+            'logs': page['logs'],
+            'count': len(page['logs']),
+            'next': build_page_link(request.path, request.args.to_dict(), page['next']),
+            'prev': build_page_link(request.path, request.args.to_dict(), page['prev'])
         })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"获取设备日志错误: {e}")
         return jsonify({
@@ -1021,42 +1230,421 @@ def get_device_log_summary(device_id):
             'message': f'服务器错误: {str(e)}'
         }), 500
 
+@app.route('/api/logs/summary')
+def get_fleet_log_summary():
+    """获取所有设备的日志汇总摘要"""
+    try:
+        summary = device_manager.log_manager.get_fleet_log_summary()
+        return jsonify({
+            'success': True,
+            'summary': summary
+        })
+    except Exception as e:
+        logger.error(f"获取全局日志摘要错误: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/logs/storage')
+def get_log_storage_stats():
+    """获取日志存储统计（压缩率、读取吞吐）"""
+    try:
+        stats = device_manager.log_manager.get_storage_stats()
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
+    except Exception as e:
+        logger.error(f"获取日志存储统计错误: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/storage/quotas')
+def get_storage_quotas():
+    """获取各类磁盘数据的配额、占用与淘汰统计"""
+    return jsonify({
+        'success': True,
+        'quotas': retention_engine.get_stats()
+    })
+
+def parse_time_param(value):
+    """解析时间参数，支持epoch秒或ISO格式字符串"""
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+@app.route('/api/device/<int:device_id>/metrics')
+def get_device_metrics(device_id):
+    """获取设备指标时序（报警/心跳计数、RSSI趋势）
+    
+    from/to 为epoch秒或ISO时间，默认最近24小时；step 为分组秒数（须为60秒的整数倍），
+    自动选择能满足查询的最粗汇总层级。
+    """
+    try:
+        now = int(time.time())
+        start = parse_time_param(request.args['from']) if 'from' in request.args else now - 86400
+        end = parse_time_param(request.args['to']) if 'to' in request.args else now + 1
+        step = request.args.get('step', None, type=int)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': '时间参数格式错误'
+        }), 400
+    
+    if step is not None and step <= 0:
+        return jsonify({
+            'success': False,
+            'message': 'step必须为正整数'
+        }), 400
+    
+    try:
+        result = device_manager.metrics.query(device_id, start, end, step)
+        return jsonify({
+            'success': True,
+            'device_id': device_id,
+            'from': start,
+            'to': end,
+            'tier': result['tier'],
+            'step': result['step'],
+            'points': result['points']
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"获取设备指标错误: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/device/<int:device_id>/rssi')
+def get_device_rssi_history(device_id):
+    """获取设备RSSI采样历史
+    
+    format=json(默认) 返回起始时间+偏移+RSSI的紧凑JSON，
+    format=binary 返回二进制数据，since 只返回该epoch秒之后的采样。
+    """
+    try:
+        since = request.args.get('since', None, type=int)
+        samples = device_manager.rssi_history.get_samples(device_id, since)
+        if samples is None:
+            return jsonify({
+                'success': False,
+                'message': f'设备 {device_id} 没有RSSI采样'
+            }), 404
+        
+        times, values = samples
+        if request.args.get('format', 'json') == 'binary':
+            return Response(device_manager.rssi_history.to_blob(times, values),
+                            mimetype='application/octet-stream')
+        
+        result = device_manager.rssi_history.to_json(times, values)
+        result.update({'success': True, 'device_id': device_id})
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"获取设备RSSI历史错误: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+def parse_device_ids(value):
+    """解析设备ID集合参数，如 "1,3,10-20"，返回排序后的ID列表
+    
+    范围限制在有效设备ID(1-254)之内，起点大于终点时抛出ValueError。
+    """
+    device_ids = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            low, high = (int(x) for x in part.split('-', 1))
+            if low > high:
+                raise ValueError(f"设备ID范围起点大于终点: {part}")
+            device_ids.update(range(max(low, 1), min(high, ID_BROADCAST - 1) + 1))
+        else:
+            device_ids.add(int(part))
+    return sorted(device_ids)
+
+def build_page_link(path, args, cursor):
+    """构造带游标的翻页链接（保留其余查询参数）"""
+    if not cursor:
+        return None
+    args = dict(args, cursor=cursor)
+    return f"{path}?{urlencode(args)}"
+
+def iter_export_rows(entries, export_format):
+    """将日志条目逐条编码为CSV或NDJSON文本行"""
+    if export_format == 'ndjson':
+        for entry in entries:
+            yield json.dumps(entry, ensure_ascii=False) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_FIELDS + ['extra'])
+    for entry in entries:
+        extra = {key: value for key, value in entry.items() if key not in EXPORT_CSV_FIELDS}
+        writer.writerow([entry.get(field, '') for field in EXPORT_CSV_FIELDS] +
+                        [json.dumps(extra, ensure_ascii=False) if extra else ''])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@app.route('/api/logs/export')
+def export_logs():
+    """批量导出日志（CSV/NDJSON，流式输出，可选gzip压缩）
+    
+    参数: format=csv|ndjson, start_time/end_time, devices(如 "1,3,10-20"), type, gzip=1。
+    按时间顺序对各设备日志做惰性归并，内存占用与导出量无关；
+    只在获取段列表时短暂持有设备锁，不会在整个导出期间阻塞写入。
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({
+            'success': False,
+            'message': '导出格式必须为 csv 或 ndjson'
+        }), 400
+    
+    try:
+        devices_arg = request.args.get('devices', None)
+        device_ids = parse_device_ids(devices_arg) if devices_arg else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': '设备ID格式错误'
+        }), 400
+    
+    log_type = request.args.get('type', None)
+    start_time = request.args.get('start_time', None)
+    end_time = request.args.get('end_time', None)
+    use_gzip = request.args.get('gzip', 0, type=int) == 1
+    
+    def generate():
+        entries = device_manager.log_manager.iter_timeline(device_ids, log_type, start_time, end_time)
+        # wbits=31 输出gzip格式
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        chunk = []
+        size = 0
+        try:
+            for line in iter_export_rows(entries, export_format):
+                data = line.encode('utf-8')
+                chunk.append(data)
+                size += len(data)
+                if size < EXPORT_CHUNK_SIZE:
+                    continue
+                data = b''.join(chunk)
+                chunk, size = [], 0
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+            
+            # 全部数据输出后才写入gzip结尾，导出中途出错时客户端收到的是不完整的下载
+            data = b''.join(chunk)
+            if compressor:
+                data = compressor.compress(data) + compressor.flush()
+            if data:
+                yield data
+        except Exception as e:
+            logger.error(f"日志导出错误: {e}")
+            raise
+    
+    filename = f"device_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if use_gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@app.route('/api/logs')
+def get_fleet_logs():
+    """全设备合并时间线（流式输出，按时间排序，支持游标翻页）"""
+    try:
+        limit = max(0, min(request.args.get('limit', 100, type=int), 10000))
+        log_type = request.args.get('type', None)
+        start_time = request.args.get('start_time', None)
+        end_time = request.args.get('end_time', None)
+        reverse = request.args.get('order', 'asc') == 'desc'
+        devices_arg = request.args.get('devices', None)
+        device_ids = parse_device_ids(devices_arg) if devices_arg else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': '设备ID格式错误'
+        }), 400
+    
+    # 游标记录边界条目的排序键，before/after 决定本次的遍历方向
+    cursor = request.args.get('cursor', None)
+    after_key = None
+    iterate_reverse = reverse
+    if cursor:
+        try:
+            data = decode_cursor(cursor)
+            timestamp, cursor_device, seq, offset = data['key']
+            after_key = (str(timestamp), int(cursor_device), int(seq), int(offset))
+        except (ValueError, KeyError, TypeError):
+            return jsonify({
+                'success': False,
+                'message': f'无效的游标: {cursor}'
+            }), 400
+        iterate_reverse = data['dir'] == 'before'
+    
+    path = request.path
+    link_args = request.args.to_dict()
+
+    def generate():
+        keyed = device_manager.log_manager.iter_timeline_keyed(
+            device_ids, log_type, start_time, end_time, iterate_reverse, after_key
+        )
+        count = 0
+        has_more = False
+        first_key = last_key = None
+        error = None
+        # 响应头已发出，查询结果（success）写在结尾，中途出错时客户端据此判断本页不完整
+        yield '{"logs": ['
+        try:
+            if iterate_reverse != reverse:
+                # 逆着输出顺序翻页时先取出一页（最多limit条）再按请求顺序输出
+                page = list(islice(keyed, limit + 1))
+                has_more = len(page) > limit
+                page = page[:limit]
+                page.reverse()
+                keyed = iter(page)
+            
+            for key, entry in keyed:
+                if count >= limit:
+                    has_more = True
+                    break
+                if first_key is None:
+                    first_key = key
+                last_key = key
+                yield (',' if count else '') + json.dumps(entry, ensure_ascii=False)
+                count += 1
+        except Exception as e:
+            logger.error(f"合并时间线查询错误: {e}")
+            error = f'查询日志失败: {e}'
+        
+        # next 沿输出顺序继续，prev 反向；遍历方向上是否有更多由多取的一条判断
+        next_link = prev_link = None
+        if count and error is None:
+            forward_more = has_more if iterate_reverse == reverse else cursor is not None
+            backward_more = cursor is not None if iterate_reverse == reverse else has_more
+            if forward_more:
+                next_link = build_page_link(path, link_args, encode_cursor({
+                    'dir': 'before' if reverse else 'after', 'key': list(last_key)
+                }))
+            if backward_more:
+                prev_link = build_page_link(path, link_args, encode_cursor({
+                    'dir': 'after' if reverse else 'before', 'key': list(first_key)
+                }))
+        trailer = f'], "count": {count}, "next": {json.dumps(next_link)}, "prev": {json.dumps(prev_link)}'
+        if error is None:
+            yield trailer + ', "success": true}'
+        else:
+            yield trailer + f', "success": false, "message": {json.dumps(error, ensure_ascii=False)}}}'
+
+    return Response(generate(), mimetype='application/json')
+
 @app.route('/events')
 def events():
     """SSE事件流"""
+    # 订阅过滤：types=事件类型列表 devices=设备ID/范围列表 severity=最低严重级别
+    try:
+        subscription_filter = SubscriptionFilter.parse(
+            request.args.get('types'), request.args.get('devices'), request.args.get('severity')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    # batch=1 时短时间内到达的事件合并为一帧发送
+    window = BATCH_WINDOW if request.args.get('batch') == '1' else 0
+    # 浏览器自动重连时通过请求头带回最后收到的事件ID，页面重建连接时通过参数带回
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
     def event_stream():
-        while True:
-            try:
-                # 获取队列中的消息
-                if not sse_queue.empty():
-                    message = sse_queue.get(timeout=1)
-                    # 确保消息是JSON可序列化的
-                    if isinstance(message, dict):
-                        # 处理datetime对象
-                        for key, value in message.items():
-                            if isinstance(value, datetime):
-                                message[key] = value.isoformat()
-                    yield f"data: {json.dumps(message, ensure_ascii=False)}\n\n"
-                else:
-                    # 发送心跳包
-                    heartbeat_message = {
-                        'type': 'heartbeat', 
+        # 每个连接独立订阅，所有打开的页面都能收到全部事件；重连时补发错过的事件
+        subscriber = event_broker.subscribe(last_event_id=last_event_id, subscription_filter=subscription_filter)
+        try:
+            # 连接建立后立即发送一次心跳，响应头随之发出，浏览器即可触发onopen
+            frame = None
+            while True:
+                if frame is None:
+                    heartbeat = json.dumps({
+                        'type': 'heartbeat',
                         'timestamp': datetime.now().isoformat()
-                    }
-                    yield f"data: {json.dumps(heartbeat_message, ensure_ascii=False)}\n\n"
-                    time.sleep(10)
-            except Exception as e:
-                logger.error(f"SSE事件流错误: {e}")
-                # 发送错误消息
-                error_message = {
-                    'type': 'error',
-                    'message': f'SSE连接错误: {str(e)}',
-                    'timestamp': datetime.now().isoformat()
-                }
-                yield f"data: {json.dumps(error_message, ensure_ascii=False)}\n\n"
-                break
+                    })
+                    yield f"data: {heartbeat}\n\n"
+                else:
+                    event_id, payload = frame
+                    yield f"id: {event_id}\ndata: {payload}\n\n"
+                # yield返回时该帧已写出到连接，记录发布到写出的延迟
+                subscriber.mark_flushed()
+                # 阻塞等待新事件，发布即唤醒；10秒内没有事件才发送心跳
+                frame = subscriber.get(timeout=10, window=window)
+        except Exception as e:
+            logger.error(f"SSE事件流错误: {e}")
+            # 发送错误消息
+            error_message = {
+                'type': 'error',
+                'message': f'SSE连接错误: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }
+            yield f"data: {json.dumps(error_message, ensure_ascii=False)}\n\n"
+        finally:
+            event_broker.unsubscribe(subscriber)
     
-    return Response(event_stream(), content_type='text/event-stream')
+    # 禁止中间代理缓存或缓冲事件流
+    return Response(event_stream(), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def build_poll_response(result):
+    """组装长轮询响应：事件在发布时已序列化，直接拼接，不再重复编码"""
+    body = (
+        '{"success": true, "events": [' + ', '.join(result['events']) + '], '
+        f'"last_event_id": {json.dumps(result["last_event_id"])}, '
+        f'"resync": {json.dumps(result["resync"])}}}'
+    )
+    return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/events/poll')
+def poll_events():
+    """事件长轮询：供无法使用SSE的客户端获取 after 之后的事件，没有新事件时最多等待 timeout 秒"""
+    try:
+        timeout = float(request.args.get('timeout', POLL_TIMEOUT))
+        if not math.isfinite(timeout):
+            raise ValueError('timeout 必须为有限数值')
+        timeout = min(max(timeout, 0), POLL_MAX_TIMEOUT)
+        subscription_filter = SubscriptionFilter.parse(
+            request.args.get('types'), request.args.get('devices'), request.args.get('severity')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    result = event_broker.poll(request.args.get('after'), timeout, subscription_filter)
+    return build_poll_response(result)
+
+@app.route('/api/events/stats')
+def get_event_stats():
+    """获取SSE订阅者数量、积压与丢弃统计"""
+    stats = event_broker.get_stats()
+    http_server = app.config.get('HTTP_SERVER')
+    if http_server is not None:
+        stats['http'] = http_server.get_stats()
+    return jsonify({
+        'success': True,
+        'stats': stats
+    })
 
 @app.route('/test_sse')
 def test_sse():
@@ -1077,7 +1665,7 @@ def test_sse():
 
 def start_udp_server():
     """启动UDP服务器"""
-    udp_server = UDPServer(device_manager, sse_queue)
+    udp_server = UDPServer(device_manager, event_broker, command_pipeline)
     udp_server.start()
 
 def cleanup_expired_records():
@@ -1115,6 +1703,15 @@ def main():
     offline_check_thread = threading.Thread(target=check_offline_devices, daemon=True)
     offline_check_thread.start()
     
+    # 启动磁盘配额与保留策略引擎
+    setup_retention_engine()
+    
+    # 启动设备日志增量备份（低优先级线程）
+    backup_scheduler = BackupScheduler(
+        lambda: device_manager.log_manager.backup_logs('backup_logs'), BACKUP_INTERVAL, '设备日志'
+    )
+    backup_scheduler.start()
+    
     # 启动设备重新发现流程
     device_manager.start_device_discovery(udp_client)
     
@@ -1122,7 +1719,13 @@ def main():
     device_manager.start_periodic_discovery(udp_client, 300)
     
     # 启动Flask应用
-    app.run(host='0.0.0.0', port=WEB_PORT, debug=False, threaded=True)
+    if WEB_SERVER_MODE == "production":
+        run_pooled_server(app, '0.0.0.0', WEB_PORT, WEB_MAX_CONNECTIONS, WEB_STREAM_CONNECTIONS, STREAM_PATHS)
+    else:
+        app.run(host='0.0.0.0', port=WEB_PORT, debug=False, threaded=True)
+    
+    # 退出前写出尚未落盘的指标汇总
+    device_manager.metrics.stop()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
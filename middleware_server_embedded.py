@@ -11,16 +11,25 @@ import threading
 import time
 import json
 import logging
+import math
 import os
 import signal
 import sys
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response
-from queue import Queue, Empty
+from flask import Flask, request, jsonify, Response
+from queue import Queue, Empty, Full
 import struct
 import sqlite3
 from pathlib import Path
+from urllib.parse import urlencode
+from logging.handlers import RotatingFileHandler
 import gc
+from storage_quota import RetentionEngine, DataClass, DirectoryDataClass, parse_size
+from incremental_backup import SnapshotWriter, BackupScheduler
+from event_broker import EventBroker, SubscriptionFilter
+from device_logs import encode_cursor, decode_cursor
+from pooled_server import run_pooled_server
+from web_assets import WebAssets
 
 # 嵌入式环境默认配置
 DEFAULT_CONFIG = {
@@ -29,6 +38,8 @@ DEFAULT_CONFIG = {
         "listen_port": 5439,
         "web_port": 8081,
         "max_connections": 50,
+        "stream_connections": 100,
+        "server_mode": "production",
         "socket_timeout": 30,
         "buffer_size": 1024
     },
@@ -46,12 +57,25 @@ DEFAULT_CONFIG = {
         "queue_size": 500,
         "batch_size": 10,
         "flush_interval": 5,
+        "sse_batch_window": 0.005,
     },
     "storage": {
         "database_path": "/var/lib/adc_alarm_system/devices.db",
         "backup_enabled": True,
         "backup_interval": 3600,
         "sync_interval": 60,
+        "log_retention_days": 7,
+        "cleanup_chunk_size": 500,
+        "heartbeat_aggregation": True,
+        "heartbeat_bucket_seconds": 300,
+        "backup_retention": 7,
+        # 各类磁盘数据的配额，超出后从最旧的数据开始淘汰
+        "quotas": {
+            "app_log": "20MB",
+            "database": "100MB",
+            "backups": "200MB",
+            "captures": "50MB",
+        },
     },
     "system": {
         "log_path": "/var/log/adc_alarm_system",
@@ -69,7 +93,11 @@ def setup_logging():
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
-            logging.FileHandler(log_dir / "middleware.log"),
+            RotatingFileHandler(
+                log_dir / "middleware.log",
+                maxBytes=parse_size(DEFAULT_CONFIG["resources"]["max_log_size"]),
+                backupCount=DEFAULT_CONFIG["resources"]["max_log_files"]
+            ),
             logging.StreamHandler()
         ]
     )
@@ -98,19 +126,36 @@ FRAME_HEAD = 0xAA
 FRAME_TAIL = 0x55
 FRAME_LENGTH = 6
 
+# 上行指令定义
+CMD_ONLINE = 0x00     # 上线
+CMD_ALARM = 0x01      # 报警
+CMD_RECOVER = 0x02    # 恢复
+CMD_HEARTBEAT = 0x03  # 心跳包
+CMD_OFFLINE = 0xFE    # 离线（服务器生成的日志记录，非设备帧）
+
+# 设备事件的严重级别，用于SSE订阅过滤
+EVENT_SEVERITY = {
+    CMD_ALARM: 'critical',
+    CMD_RECOVER: 'warning'
+}
+
 # 系统配置
 SERVER_ID = 0  # 服务器ID设为0，忽略此ID的设备信息
 
 # Flask应用
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'embedded_adc_alarm_system'
+# 静态资源哈希命名、页面骨架缓存与响应压缩
+web_assets = WebAssets(app)
 
 # 全局变量
 device_manager = None
 udp_server = None
 udp_client = None
-sse_queue = Queue(maxsize=DEFAULT_CONFIG["performance"]["queue_size"])
+event_broker = EventBroker(DEFAULT_CONFIG["performance"]["queue_size"],
+                           history_size=DEFAULT_CONFIG["performance"]["queue_size"])
 shutdown_event = threading.Event()
+retention_engine = RetentionEngine()
 
 def check_server_initialized():
     """检查服务器是否已初始化"""
@@ -118,12 +163,234 @@ def check_server_initialized():
         return False
     return True
 
+class EmbeddedDBWriter:
+    """嵌入式环境的SQLite批量写入器
+    
+    持有唯一的长连接(WAL模式)，从有界队列中取出写入请求，
+    按 batch_size / flush_interval 合并为一次事务提交。
+    开启心跳聚合时，device_logs 只保存状态变化的完整记录，
+    心跳按设备和时间区间合并到 heartbeat_aggregates。
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.batch_size = max(1, DEFAULT_CONFIG["performance"]["batch_size"])
+        self.flush_interval = DEFAULT_CONFIG["performance"]["flush_interval"]
+        self.queue = Queue(maxsize=DEFAULT_CONFIG["performance"]["queue_size"])
+        self.aggregate_heartbeats = DEFAULT_CONFIG["storage"]["heartbeat_aggregation"]
+        self.bucket_seconds = DEFAULT_CONFIG["storage"]["heartbeat_bucket_seconds"]
+        self.thread = None
+        self.stats_lock = threading.Lock()  # 丢弃计数由多个UDP帧处理线程更新
+        self.stats = {
+            'frames_written': 0,
+            'commits': 0,
+            'dropped': 0,
+            'log_rows': 0,
+            'heartbeats_aggregated': 0
+        }
+    
+    def start(self):
+        """启动写入线程"""
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"数据库写入线程已启动 (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+    
+    def stop(self, timeout=5):
+        """停止写入线程，提交剩余数据"""
+        if self.thread and self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join(timeout=timeout)
+    
+    def submit(self, device_id, device_data, logged_at, transition=False):
+        """提交一条设备帧写入请求（不阻塞调用方）
+        
+        transition=True 时即使是心跳也保存完整日志（如设备首次出现）。
+        """
+        return self._put(('frame', device_id, device_data, logged_at, transition))
+    
+    def submit_log(self, device_id, device_data, logged_at):
+        """只写入一条完整日志，不更新设备表（如离线记录）"""
+        return self._put(('log', device_id, device_data, logged_at, True))
+    
+    def _put(self, item):
+        """放入写入队列"""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            with self.stats_lock:
+                self.stats['dropped'] += 1
+            logger.warning(f"数据库写入队列已满，丢弃设备 {item[1]} 的记录")
+            return False
+    
+    def submit_task(self, task):
+        """提交需要在写入连接上执行的维护任务，task(conn)"""
+        try:
+            self.queue.put_nowait(('task', task))
+            return True
+        except Full:
+            logger.warning("数据库写入队列已满，维护任务推迟到下一轮")
+            return False
+    
+    def _connect(self):
+        """创建写入连接"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def _writer_loop(self):
+        """写入循环"""
+        conn = self._connect()
+        pending = []
+        deadline = None
+        # 合并批次时取到的维护任务或停止标记，留到下一轮按原顺序处理；
+        # 不能放回队列：写入线程是唯一的消费者，队列被帧处理线程填满后会永久阻塞
+        carry = None
+        
+        try:
+            while True:
+                if carry is not None:
+                    item, carry = carry, None
+                else:
+                    timeout = self.flush_interval if not pending else max(0, deadline - time.time())
+                    try:
+                        item = self.queue.get(timeout=timeout)
+                    except Empty:
+                        item = None
+                
+                if item is self._STOP:
+                    break
+                
+                if item is not None and item[0] == 'task':
+                    # 维护任务前先提交已积累的数据，保持写入顺序
+                    self._flush(conn, pending)
+                    pending = []
+                    try:
+                        item[1](conn)
+                    except Exception as e:
+                        logger.error(f"数据库维护任务失败: {e}")
+                    continue
+                
+                if item is not None:
+                    if not pending:
+                        deadline = time.time() + self.flush_interval
+                    pending.append(item)
+                    # 尽量一次取完队列中已到达的数据
+                    while len(pending) < self.batch_size:
+                        try:
+                            more = self.queue.get_nowait()
+                        except Empty:
+                            break
+                        if more is self._STOP or more[0] == 'task':
+                            carry = more
+                            break
+                        pending.append(more)
+                
+                if pending and (len(pending) >= self.batch_size or time.time() >= deadline):
+                    self._flush(conn, pending)
+                    pending = []
+        finally:
+            self._flush(conn, pending)
+            conn.close()
+            logger.info("数据库写入线程已停止")
+    
+    def _flush(self, conn, pending):
+        """将一批设备帧写入数据库，单次提交"""
+        if not pending:
+            return
+        
+        device_rows = {}
+        log_rows = []
+        aggregates = {}
+        for kind, device_id, device_data, logged_at, transition in pending:
+            row = (
+                device_id,
+                device_data['cmd'],
+                device_data['status'],
+                device_data['wifi_rssi'],
+                device_data['source_ip']
+            )
+            if kind == 'frame':
+                # 同一批次内设备表只需保留最新状态
+                device_rows[device_id] = row + (device_data['last_seen'],)
+            
+            if (self.aggregate_heartbeats and not transition
+                    and device_data['cmd'] == CMD_HEARTBEAT):
+                # 心跳先在批次内按 (设备, 时间区间) 合并
+                bucket = logged_at - logged_at % self.bucket_seconds
+                rssi = device_data['wifi_rssi']
+                agg = aggregates.get((device_id, bucket))
+                if agg is None:
+                    aggregates[(device_id, bucket)] = [
+                        device_id, bucket, 1, rssi, rssi, rssi,
+                        logged_at, logged_at, device_data['source_ip']
+                    ]
+                else:
+                    agg[2] += 1
+                    agg[3] = min(agg[3], rssi)
+                    agg[4] = max(agg[4], rssi)
+                    agg[5] += rssi
+                    agg[7] = logged_at
+                    agg[8] = device_data['source_ip']
+            else:
+                log_rows.append(row + (logged_at,))
+        
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO devices 
+                    (id, cmd, status, wifi_rssi, source_ip, last_seen, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', list(device_rows.values()))
+                
+                conn.executemany('''
+                    INSERT INTO device_logs 
+                    (device_id, cmd, status, wifi_rssi, source_ip, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', log_rows)
+                
+                conn.executemany('''
+                    INSERT INTO heartbeat_aggregates
+                    (device_id, bucket_start, count, rssi_min, rssi_max, rssi_sum,
+                     first_seen, last_seen, source_ip)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (device_id, bucket_start) DO UPDATE SET
+                        count = count + excluded.count,
+                        rssi_min = min(rssi_min, excluded.rssi_min),
+                        rssi_max = max(rssi_max, excluded.rssi_max),
+                        rssi_sum = rssi_sum + excluded.rssi_sum,
+                        first_seen = min(first_seen, excluded.first_seen),
+                        last_seen = max(last_seen, excluded.last_seen),
+                        source_ip = excluded.source_ip
+                ''', list(aggregates.values()))
+            
+            with self.stats_lock:
+                self.stats['frames_written'] += len(pending)
+                self.stats['commits'] += 1
+                self.stats['log_rows'] += len(log_rows)
+                self.stats['heartbeats_aggregated'] += len(pending) - len(log_rows)
+        except Exception as e:
+            logger.error(f"批量写入数据库失败: {e}")
+    
+    def get_stats(self):
+        """获取写入统计"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queue_size'] = self.queue.qsize()
+        stats['commits_per_frame'] = (
+            stats['commits'] / stats['frames_written'] if stats['frames_written'] else 0
+        )
+        return stats
+
 class EmbeddedDeviceManager:
     """嵌入式环境优化的设备管理器"""
     
-    def __init__(self, sse_queue=None):
+    def __init__(self, event_broker=None):
         self.devices = {}
-        self.sse_queue = sse_queue
+        self.event_broker = event_broker
         self.lock = threading.RLock()
         self.db_path = DEFAULT_CONFIG["storage"]["database_path"]
         self.max_devices = DEFAULT_CONFIG["resources"]["max_devices"]
@@ -136,6 +403,10 @@ class EmbeddedDeviceManager:
         # 加载设备数据
         self._load_devices_from_db()
         
+        # 启动数据库写入线程
+        self.db_writer = EmbeddedDBWriter(self.db_path)
+        self.db_writer.start()
+        
         # 启动清理线程
         self._start_cleanup_thread()
     
@@ -145,6 +416,8 @@ class EmbeddedDeviceManager:
             Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
             
             with sqlite3.connect(self.db_path) as conn:
+                # WAL模式下只读查询不会阻塞写入线程
+                conn.execute('PRAGMA journal_mode=WAL')
                 conn.execute('''
                     CREATE TABLE IF NOT EXISTS devices (
                         id INTEGER PRIMARY KEY,
@@ -166,11 +439,50 @@ class EmbeddedDeviceManager:
                         status INTEGER,
                         wifi_rssi INTEGER,
                         source_ip TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        timestamp INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                         FOREIGN KEY (device_id) REFERENCES devices (id)
                     )
                 ''')
                 
+                # 旧版本以文本存储时间戳，一次性转换为整数秒(UTC epoch)
+                schema_version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if schema_version < 1:
+                    conn.execute('''
+                        UPDATE device_logs
+                        SET timestamp = CAST(strftime('%s', timestamp) AS INTEGER)
+                        WHERE typeof(timestamp) = 'text'
+                    ''')
+                    conn.execute('PRAGMA user_version = 1')
+                
+                conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_device_logs_timestamp
+                    ON device_logs (timestamp)
+                ''')
+                conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_device_logs_device_timestamp
+                    ON device_logs (device_id, timestamp)
+                ''')
+                
+                # 心跳聚合表：每个设备每个时间区间一行
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS heartbeat_aggregates (
+                        device_id INTEGER NOT NULL,
+                        bucket_start INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        rssi_min INTEGER,
+                        rssi_max INTEGER,
+                        rssi_sum INTEGER,
+                        first_seen INTEGER NOT NULL,
+                        last_seen INTEGER NOT NULL,
+                        source_ip TEXT,
+                        PRIMARY KEY (device_id, bucket_start)
+                    )
+                ''')
+                conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_heartbeat_aggregates_bucket
+                    ON heartbeat_aggregates (bucket_start)
+                ''')
+                
                 conn.commit()
                 logger.info("数据库初始化完成")
                 
@@ -178,11 +490,18 @@ class EmbeddedDeviceManager:
             logger.error(f"数据库初始化失败: {e}")
             raise
     
+    def _get_read_connection(self):
+        """获取只读数据库连接（用于API查询）"""
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
     def _load_devices_from_db(self):
         """从数据库加载设备数据"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            conn = self._get_read_connection()
+            try:
                 cursor = conn.execute('''
                     SELECT * FROM devices 
                     ORDER BY last_seen DESC 
@@ -202,43 +521,135 @@ class EmbeddedDeviceManager:
                     self.devices[row['id']] = device_data
                 
                 logger.info(f"从数据库加载了 {len(self.devices)} 个设备")
+            finally:
+                conn.close()
                 
         except Exception as e:
             logger.error(f"从数据库加载设备失败: {e}")
     
-    def _save_device_to_db(self, device_id, device_data):
-        """保存设备到数据库"""
+    def _save_device_to_db(self, device_id, device_data, transition=False):
+        """保存设备到数据库（交给写入线程批量提交）"""
+        # 日志时间取帧到达时间(整数秒)
+        logged_at = int(time.time())
+        self.db_writer.submit(device_id, dict(device_data), logged_at, transition)
+    
+    def get_device_logs(self, device_id, limit=100, expand_heartbeats=False, cursor=None):
+        """查询设备日志（只读连接，键集游标分页）
+        
+        状态变化记录与心跳聚合记录按时间合并返回；
+        expand_heartbeats=True 时把聚合记录还原为逐条心跳（时间均匀分布，RSSI取平均值）。
+        每条记录的位置为 (timestamp, kind, key)：状态记录 kind=0、key=id，
+        聚合记录 kind=1、timestamp与key均取bucket_start。bucket_start不随心跳更新变化，
+        游标在聚合桶仍在累计时也不会跳过或重复记录，查询可直接使用 (device_id, bucket_start) 主键。
+        返回 {'logs', 'next', 'prev'}，next 翻向更早的日志，prev 翻向更新的日志。
+        """
+        direction, position = 'before', None
+        if cursor:
+            data = decode_cursor(cursor)
+            try:
+                direction = data['dir']
+                position = tuple(int(value) for value in data['pos'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"无效的游标: {cursor}")
+            if len(position) != 3:
+                raise ValueError(f"无效的游标: {cursor}")
+        
+        before = direction == 'before'
+        order = 'DESC' if before else 'ASC'
+        op = '<' if before else '>'
+        limit = max(limit, 0)
+        
+        conn = self._get_read_connection()
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT OR REPLACE INTO devices 
-                    (id, cmd, status, wifi_rssi, source_ip, last_seen, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (
-                    device_id,
-                    device_data['cmd'],
-                    device_data['status'],
-                    device_data['wifi_rssi'],
-                    device_data['source_ip'],
-                    device_data['last_seen']
-                ))
-                
-                conn.execute('''
-                    INSERT INTO device_logs 
-                    (device_id, cmd, status, wifi_rssi, source_ip)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    device_id,
-                    device_data['cmd'],
-                    device_data['status'],
-                    device_data['wifi_rssi'],
-                    device_data['source_ip']
-                ))
-                
-                conn.commit()
-                
-        except Exception as e:
-            logger.error(f"保存设备到数据库失败: {e}")
+            log_sql = 'SELECT id, device_id, cmd, status, wifi_rssi, source_ip, timestamp FROM device_logs WHERE device_id = ?'
+            agg_sql = 'SELECT * FROM heartbeat_aggregates WHERE device_id = ?'
+            log_params = [device_id]
+            agg_params = [device_id]
+            if position:
+                log_sql += f' AND (timestamp, 0, id) {op} (?, ?, ?)'
+                log_params.extend(position)
+                # 聚合记录位置为 (bucket_start, 1, bucket_start)，展开比较后只剩bucket_start条件；
+                # 向新翻页且游标位于同一时刻的状态记录(kind=0)时，该时刻的聚合桶排在其后
+                agg_op = '>=' if not before and position[1] == 0 else op
+                agg_sql += f' AND bucket_start {agg_op} ?'
+                agg_params.append(position[0])
+            
+            cursor = conn.execute(
+                f'{log_sql} ORDER BY timestamp {order}, id {order} LIMIT ?',
+                log_params + [limit + 1]
+            )
+            items = [((row['timestamp'], 0, row['id']), dict(row)) for row in cursor]
+            
+            cursor = conn.execute(
+                f'{agg_sql} ORDER BY bucket_start {order} LIMIT ?',
+                agg_params + [limit + 1]
+            )
+            items.extend(((row['bucket_start'], 1, row['bucket_start']), dict(row)) for row in cursor)
+        finally:
+            conn.close()
+        
+        # 两路结果各取 limit+1 条，合并后多出的一条说明该方向还有更多
+        items.sort(key=lambda item: item[0], reverse=before)
+        has_more = len(items) > limit
+        items = items[:limit]
+        items.sort(key=lambda item: item[0])
+        
+        logs = []
+        for pos, item in items:
+            if pos[1] == 0:
+                del item['id']
+                logs.append(item)
+            elif expand_heartbeats:
+                logs.extend(self._expand_heartbeat_aggregate(item))
+            else:
+                logs.append({
+                    'device_id': item['device_id'],
+                    'cmd': CMD_HEARTBEAT,
+                    'type': 'heartbeat_aggregate',
+                    'count': item['count'],
+                    'rssi_min': item['rssi_min'],
+                    'rssi_max': item['rssi_max'],
+                    'rssi_avg': round(item['rssi_sum'] / item['count'], 1),
+                    'source_ip': item['source_ip'],
+                    'first_seen': datetime.fromtimestamp(item['first_seen']).isoformat(),
+                    'last_seen': datetime.fromtimestamp(item['last_seen']).isoformat(),
+                    'timestamp': item['bucket_start']
+                })
+        for log in logs:
+            log['timestamp'] = datetime.fromtimestamp(log['timestamp']).isoformat()
+        
+        next_cursor = prev_cursor = None
+        if items:
+            if (has_more if before else position is not None):
+                next_cursor = encode_cursor({'dir': 'before', 'pos': list(items[0][0])})
+            if (position is not None if before else has_more):
+                prev_cursor = encode_cursor({'dir': 'after', 'pos': list(items[-1][0])})
+        return {'logs': logs, 'next': next_cursor, 'prev': prev_cursor}
+    
+    def _expand_heartbeat_aggregate(self, agg):
+        """将一条心跳聚合记录展开为逐条心跳记录"""
+        count = agg['count']
+        first_seen = agg['first_seen']
+        span = agg['last_seen'] - first_seen
+        rssi_avg = round(agg['rssi_sum'] / count)
+        
+        entries = []
+        for i in range(count):
+            offset = round(span * i / (count - 1)) if count > 1 else span
+            entries.append({
+                'device_id': agg['device_id'],
+                'cmd': CMD_HEARTBEAT,
+                'status': 0,
+                'wifi_rssi': rssi_avg,
+                'source_ip': agg['source_ip'],
+                'timestamp': first_seen + offset,
+                'aggregated': True
+            })
+        return entries
+    
+    def close(self):
+        """关闭设备管理器，提交未写入的数据"""
+        self.db_writer.stop()
     
     def _start_cleanup_thread(self):
         """启动清理线程"""
@@ -273,6 +684,12 @@ class EmbeddedDeviceManager:
                         expired_devices.append(device_id)
                 
                 for device_id in expired_devices:
+                    # 离线是状态变化，保存一条完整日志
+                    self.db_writer.submit_log(
+                        device_id,
+                        dict(self.devices[device_id], cmd=CMD_OFFLINE),
+                        int(current_time)
+                    )
                     del self.devices[device_id]
                     logger.info(f"清理过期设备: {device_id}")
                 
@@ -280,17 +697,104 @@ class EmbeddedDeviceManager:
             logger.error(f"清理过期设备失败: {e}")
     
     def _cleanup_old_logs(self):
-        """清理旧日志"""
+        """清理旧日志
+        
+        按时间戳索引分块删除，每块作为写入线程上的独立任务执行，
+        块与块之间会先处理已排队的设备帧，单次持有写锁的时间很短。
+        """
+        retention = DEFAULT_CONFIG["storage"]["log_retention_days"] * 86400
+        cutoff = int(time.time()) - retention
+        
+        self.db_writer.submit_task(self._make_cleanup_task('device_logs', 'timestamp', cutoff))
+        self.db_writer.submit_task(
+            self._make_cleanup_task('heartbeat_aggregates', 'bucket_start', cutoff)
+        )
+    
+    def _make_cleanup_task(self, table, column, cutoff):
+        """生成分块删除任务：每次最多删除 cleanup_chunk_size 行"""
+        chunk_size = DEFAULT_CONFIG["storage"]["cleanup_chunk_size"]
+        
+        def cleanup_task(conn):
+            with conn:
+                cursor = conn.execute(f'''
+                    DELETE FROM {table}
+                    WHERE rowid IN (
+                        SELECT rowid FROM {table}
+                        WHERE {column} < ?
+                        ORDER BY {column}
+                        LIMIT ?
+                    )
+                ''', (cutoff, chunk_size))
+            
+            # 本块删满说明还有过期数据，排到队尾继续
+            if cursor.rowcount >= chunk_size:
+                self.db_writer.submit_task(cleanup_task)
+        
+        return cleanup_task
+    
+    def backup_database(self, backup_dir):
+        """通过SQLite在线备份API分步备份数据库，返回快照路径（失败时返回None）"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    DELETE FROM device_logs 
-                    WHERE timestamp < datetime('now', '-7 days')
-                ''')
-                conn.commit()
-                
+            writer = SnapshotWriter(backup_dir, 'devices_')
+        except OSError as e:
+            logger.error(f"创建数据库备份失败: {e}")
+            return None
+        
+        try:
+            writer.add_sqlite('devices.db', self.db_path)
+            return writer.commit()
         except Exception as e:
-            logger.error(f"清理旧日志失败: {e}")
+            writer.abort()
+            logger.error(f"数据库备份失败: {e}")
+            return None
+    
+    def get_database_usage(self):
+        """数据库有效数据占用的字节数（不含空闲页）"""
+        conn = self._get_read_connection()
+        try:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        finally:
+            conn.close()
+        return (page_count - freelist_count) * page_size
+    
+    def evict_oldest_logs(self):
+        """在写入线程上删除最旧的一块日志记录并等待完成
+        
+        状态记录与心跳聚合记录中较旧的一方优先删除，每次最多 cleanup_chunk_size 行。
+        删除后释放量由调用方重新统计，返回None；没有可删除的记录时返回0。
+        """
+        chunk_size = DEFAULT_CONFIG["storage"]["cleanup_chunk_size"]
+        done = threading.Event()
+        result = {'rows': 0}
+        
+        def evict_task(conn):
+            try:
+                oldest_log = conn.execute('SELECT MIN(timestamp) FROM device_logs').fetchone()[0]
+                oldest_agg = conn.execute('SELECT MIN(bucket_start) FROM heartbeat_aggregates').fetchone()[0]
+                if oldest_log is None and oldest_agg is None:
+                    return
+                if oldest_agg is None or (oldest_log is not None and oldest_log <= oldest_agg):
+                    table, column = 'device_logs', 'timestamp'
+                else:
+                    table, column = 'heartbeat_aggregates', 'bucket_start'
+                with conn:
+                    cursor = conn.execute(f'''
+                        DELETE FROM {table}
+                        WHERE rowid IN (
+                            SELECT rowid FROM {table}
+                            ORDER BY {column}
+                            LIMIT ?
+                        )
+                    ''', (chunk_size,))
+                result['rows'] = cursor.rowcount
+            finally:
+                done.set()
+        
+        if not self.db_writer.submit_task(evict_task) or not done.wait(30):
+            return 0
+        return None if result['rows'] else 0
     
     def update_device(self, device_id, cmd, status, wifi_rssi, source_ip):
         """更新设备信息"""
@@ -319,32 +823,31 @@ class EmbeddedDeviceManager:
                 'updated_at': current_time
             }
             
-            if device_id not in self.devices:
+            # 首次出现（或清理后重新出现）的设备属于状态变化，需要完整日志
+            is_new_device = device_id not in self.devices
+            if is_new_device:
                 device_data['created_at'] = current_time
             
             self.devices[device_id] = device_data
             
-            # 异步保存到数据库
-            threading.Thread(
-                target=self._save_device_to_db,
-                args=(device_id, device_data),
-                daemon=True
-            ).start()
+            # 交给写入线程批量保存到数据库
+            self._save_device_to_db(device_id, device_data, transition=is_new_device)
             
-            # 发送SSE事件
+            # 发送SSE事件：同一设备的状态更新可被后续更新取代，报警/恢复始终逐条推送
             self._send_sse_event({
                 'type': 'device_update',
                 'device_id': device_id,
                 'data': device_data
-            })
+            }, key=f"device:{device_id}", critical=cmd in (CMD_ALARM, CMD_RECOVER),
+               severity=EVENT_SEVERITY.get(cmd, "info"))
             
             logger.info(f"设备更新: ID={device_id}, CMD={cmd}, IP={source_ip}")
     
-    def _send_sse_event(self, event_data):
+    def _send_sse_event(self, event_data, key=None, critical=False, severity="info"):
         """发送SSE事件"""
-        if self.sse_queue:
+        if self.event_broker:
             try:
-                self.sse_queue.put_nowait(event_data)
+                self.event_broker.publish(event_data, key=key, critical=critical, severity=severity)
             except:
                 pass
     
@@ -374,9 +877,9 @@ class EmbeddedDeviceManager:
 class EmbeddedUDPServer:
     """嵌入式优化的UDP服务器"""
     
-    def __init__(self, device_manager, sse_queue):
+    def __init__(self, device_manager, event_broker):
         self.device_manager = device_manager
-        self.sse_queue = sse_queue
+        self.event_broker = event_broker
         self.socket = None
         self.running = False
         self.thread = None
@@ -490,7 +993,7 @@ class EmbeddedUDPClient:
 @app.route('/')
 def index():
     """主页"""
-    return render_template('index.html')
+    return web_assets.render_shell('index.html')
 
 @app.route('/api/devices')
 def get_devices():
@@ -622,31 +1125,150 @@ def immediate_report():
         logger.error(f"立即上报失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/device/<int:device_id>/logs')
+def get_device_logs(device_id):
+    """获取设备日志"""
+    try:
+        if not device_manager:
+            return jsonify({'success': False, 'error': '设备管理器未初始化'}), 500
+        
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        expand = request.args.get('expand', 0, type=int) == 1
+        cursor = request.args.get('cursor', None)
+        page = device_manager.get_device_logs(device_id, limit, expand_heartbeats=expand, cursor=cursor)
+        
+        def page_link(value):
+            if not value:
+                return None
+            return f"{request.path}?{urlencode(dict(request.args.to_dict(), cursor=value))}"
+        
+        return jsonify({
+            'success': True,
+            'logs': page['logs'],
+            'count': len(page['logs']),
+            'next': page_link(page['next']),
+            'prev': page_link(page['prev'])
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"获取设备日志失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/db/stats')
+def get_db_stats():
+    """获取数据库写入统计"""
+    if not device_manager:
+        return jsonify({'success': False, 'error': '设备管理器未初始化'}), 500
+    return jsonify({'success': True, 'stats': device_manager.db_writer.get_stats()})
+
+@app.route('/api/storage/quotas')
+def get_storage_quotas():
+    """获取各类磁盘数据的配额、占用与淘汰统计"""
+    return jsonify({'success': True, 'quotas': retention_engine.get_stats()})
+
+def setup_retention_engine():
+    """注册各类磁盘数据的配额并启动保留策略引擎"""
+    quotas = DEFAULT_CONFIG["storage"]["quotas"]
+    data_path = DEFAULT_CONFIG["system"]["data_path"]
+    
+    retention_engine.register(DirectoryDataClass(
+        'app_log', parse_size(quotas["app_log"]), DEFAULT_CONFIG["system"]["log_path"],
+        prefix='middleware.log', keep=1
+    ))
+    retention_engine.register(DataClass(
+        'database', parse_size(quotas["database"]),
+        device_manager.get_database_usage, device_manager.evict_oldest_logs
+    ))
+    retention_engine.register(DirectoryDataClass(
+        'backups', parse_size(quotas["backups"]), os.path.join(data_path, 'backups'),
+        prefix='devices_', max_age=DEFAULT_CONFIG["storage"]["backup_retention"] * 86400
+    ))
+    retention_engine.register(DirectoryDataClass(
+        'captures', parse_size(quotas["captures"]), os.path.join(data_path, 'captures')
+    ))
+    retention_engine.start()
+
 @app.route('/events')
 def events():
     """SSE事件流"""
+    # batch=1 时短时间内到达的事件合并为一帧发送
+    window = DEFAULT_CONFIG["performance"]["sse_batch_window"] if request.args.get('batch') == '1' else 0
+
+    try:
+        subscription_filter = SubscriptionFilter.parse(
+            request.args.get('types'), request.args.get('devices'), request.args.get('severity')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
     def event_stream():
-        while not shutdown_event.is_set():
-            try:
-                event = sse_queue.get(timeout=30)
-                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-            except Empty:
-                yield "data: {\"type\": \"heartbeat\"}\n\n"
-            except Exception as e:
-                logger.error(f"SSE事件流错误: {e}")
-                break
+        subscriber = event_broker.subscribe(last_event_id=last_event_id, subscription_filter=subscription_filter)
+        try:
+            # 连接建立后立即发送一次心跳，响应头随之发出
+            yield "data: {\"type\": \"heartbeat\"}\n\n"
+            while not shutdown_event.is_set():
+                frame = subscriber.get(timeout=30, window=window)
+                if frame is None:
+                    yield "data: {\"type\": \"heartbeat\"}\n\n"
+                else:
+                    event_id, payload = frame
+                    yield f"id: {event_id}\ndata: {payload}\n\n"
+                    subscriber.mark_flushed()
+        except Exception as e:
+            logger.error(f"SSE事件流错误: {e}")
+        finally:
+            event_broker.unsubscribe(subscriber)
     
-    return Response(event_stream(), mimetype='text/plain')
+    # 禁止中间代理缓存或缓冲事件流
+    return Response(event_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/events/poll')
+def poll_events():
+    """事件长轮询，供无法使用SSE的客户端使用"""
+    try:
+        timeout = float(request.args.get('timeout', 25))
+        if not math.isfinite(timeout):
+            raise ValueError('timeout 必须为有限数值')
+        timeout = min(max(timeout, 0), 60)
+        subscription_filter = SubscriptionFilter.parse(
+            request.args.get('types'), request.args.get('devices'), request.args.get('severity')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    result = event_broker.poll(request.args.get('after'), timeout, subscription_filter)
+    # 事件在发布时已序列化，直接拼接
+    body = (
+        '{"success": true, "events": [' + ', '.join(result['events']) + '], '
+        f'"last_event_id": {json.dumps(result["last_event_id"])}, '
+        f'"resync": {json.dumps(result["resync"])}}}'
+    )
+    return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/events/stats')
+def get_event_stats():
+    """获取SSE订阅者数量、积压与丢弃统计"""
+    stats = event_broker.get_stats()
+    if app.config.get('HTTP_SERVER') is not None:
+        stats['http'] = app.config['HTTP_SERVER'].get_stats()
+    return jsonify({'success': True, 'stats': stats})
 
 def signal_handler(signum, frame):
     """信号处理器"""
     logger.info(f"接收到信号 {signum}，正在关闭...")
     shutdown_event.set()
+    retention_engine.stop()
     
     if udp_server:
         udp_server.stop()
     if udp_client:
         udp_client.close()
+    if device_manager:
+        device_manager.close()
     
     sys.exit(0)
 
@@ -664,20 +1286,38 @@ def main():
         logger.info(f"监听端口: {LISTEN_PORT}")
         logger.info(f"Web端口: {WEB_PORT}")
         
-        device_manager = EmbeddedDeviceManager(sse_queue)
+        device_manager = EmbeddedDeviceManager(event_broker)
         udp_client = EmbeddedUDPClient()
-        udp_server = EmbeddedUDPServer(device_manager, sse_queue)
+        udp_server = EmbeddedUDPServer(device_manager, event_broker)
         
         udp_server.start()
+        setup_retention_engine()
+        
+        # 数据库定期备份（低优先级线程，分步复制）
+        if DEFAULT_CONFIG["storage"]["backup_enabled"]:
+            backup_dir = os.path.join(DEFAULT_CONFIG["system"]["data_path"], 'backups')
+            backup_scheduler = BackupScheduler(
+                lambda: device_manager.backup_database(backup_dir),
+                DEFAULT_CONFIG["storage"]["backup_interval"], '数据库'
+            )
+            backup_scheduler.start()
         
         logger.info("启动Web服务器...")
-        app.run(
-            host=SERVER_IP,
-            port=WEB_PORT,
-            debug=False,
-            threaded=True,
-            use_reloader=False
-        )
+        network = DEFAULT_CONFIG["network"]
+        if network["server_mode"] == "production":
+            run_pooled_server(
+                app, SERVER_IP, WEB_PORT,
+                network["max_connections"], network["stream_connections"],
+                ('/events', '/api/events/poll'), SOCKET_TIMEOUT
+            )
+        else:
+            app.run(
+                host=SERVER_IP,
+                port=WEB_PORT,
+                debug=False,
+                threaded=True,
+                use_reloader=False
+            )
         
     except Exception as e:
         logger.error(f"服务器启动失败: {e}")
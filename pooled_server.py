@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from werkzeug.serving import BaseWSGIServer
+
+logger = logging.getLogger(__name__)
+
+# 普通请求的套接字超时(秒)，避免慢客户端长期占用请求线程
+REQUEST_TIMEOUT = 30
+# 等待请求行到达的最长时间(秒)，浏览器预连接等空闲连接超时后关闭
+REQUEST_LINE_TIMEOUT = 10
+PEEK_SIZE = 2048
+# 已接受但尚未进入请求线程的连接数上限（等待请求行或等待空闲请求线程），达到上限时新连接留在内核监听队列中
+MAX_PENDING_CONNECTIONS = 128
+
+class PooledWSGIServer(BaseWSGIServer):
+    """有界线程池WSGI服务器
+
+    普通请求由 max_connections 个请求线程处理，不再像开发服务器那样为每个连接新建线程。
+    新连接先由分类线程在选择器上等待请求行到达，空闲连接只占用一个文件描述符，不占用请求线程；
+    SSE、长轮询等长连接请求交给独立的流式线程池（上限 stream_connections），流式连接已满时返回503。
+    连接按HTTP/1.0处理（每个连接一个请求），请求行即可决定整个连接由哪个线程池处理。
+    """
+
+    def __init__(self, host: str, port: int, app, max_connections: int, stream_connections: int,
+                 stream_paths: Iterable[str] = (), request_timeout: Optional[float] = REQUEST_TIMEOUT,
+                 request_line_timeout: float = REQUEST_LINE_TIMEOUT,
+                 max_pending: int = MAX_PENDING_CONNECTIONS):
+        super().__init__(host, port, app)
+        self.max_connections = max_connections
+        self.stream_connections = stream_connections
+        self.stream_paths = frozenset(stream_paths)
+        self.request_timeout = request_timeout
+        self.request_line_timeout = request_line_timeout
+        self.pending_slots = threading.BoundedSemaphore(max_pending)
+        self.stream_slots = threading.BoundedSemaphore(stream_connections)
+        self.request_pool = ThreadPoolExecutor(max_connections, thread_name_prefix='http')
+        self.stream_pool = ThreadPoolExecutor(stream_connections, thread_name_prefix='http-stream')
+        self.stats_lock = threading.Lock()
+        self.active_requests = 0
+        self.active_streams = 0
+        self.rejected_streams = 0
+        self.idle_closed = 0
+
+        # accept线程放入新连接并写唤醒字节，分类线程注册到选择器
+        self.incoming = deque()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        # 等待请求行的连接 {套接字: (客户端地址, 截止时间)}，按截止时间先后排列，只由分类线程访问
+        self.waiting = {}
+        self.closing = False
+        self.classify_thread = threading.Thread(target=self._classify_loop, name='http-classify', daemon=True)
+        self.classify_thread.start()
+
+    def process_request(self, request, client_address):
+        """由accept循环调用：新连接交给分类线程，待处理连接已满时阻塞accept"""
+        self.pending_slots.acquire()
+        self.incoming.append((request, client_address))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # 唤醒字节尚未读取时分类线程必然会被唤醒
+            pass
+
+    def _classify_loop(self):
+        """分类线程：等待新连接的请求行，按请求路径分派到请求线程池或流式线程池"""
+        while not self.closing:
+            timeout = None
+            if self.waiting:
+                deadline = next(iter(self.waiting.values()))[1]
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                events = self.selector.select(timeout)
+            except OSError as e:
+                logger.error(f"等待HTTP请求行失败: {e}")
+                continue
+            for key, _ in events:
+                if key.fileobj is self.wake_reader:
+                    self._register_incoming()
+                else:
+                    self._peek(key.fileobj)
+            self._expire_idle()
+
+    def _register_incoming(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        deadline = time.monotonic() + self.request_line_timeout
+        while self.incoming:
+            request, client_address = self.incoming.popleft()
+            try:
+                self.selector.register(request, selectors.EVENT_READ)
+            except (OSError, ValueError) as e:
+                logger.error(f"处理HTTP连接失败 {client_address}: {e}")
+                self._close_pending(request)
+                continue
+            self.waiting[request] = (client_address, deadline)
+
+    def _expire_idle(self):
+        """关闭超时仍未发来请求行的连接"""
+        now = time.monotonic()
+        while self.waiting:
+            request, (_, deadline) = next(iter(self.waiting.items()))
+            if deadline > now:
+                return
+            self._unregister(request)
+            with self.stats_lock:
+                self.idle_closed += 1
+            self._close_pending(request)
+
+    def _unregister(self, request):
+        del self.waiting[request]
+        try:
+            self.selector.unregister(request)
+        except (KeyError, ValueError):
+            pass
+
+    def _close_pending(self, request):
+        self.pending_slots.release()
+        self.shutdown_request(request)
+
+    def _peek(self, request):
+        """预读（不消费）请求行；请求行完整后解析路径并分派
+
+        请求行只到达一部分时把接收低水位提高到已到达的长度之上，其余部分到达前选择器不再报告可读，
+        不用轮询等待。
+        """
+        client_address = self.waiting[request][0]
+        try:
+            data = request.recv(PEEK_SIZE, socket.MSG_PEEK)
+            if data and b'\n' not in data and len(data) < PEEK_SIZE:
+                request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVLOWAT, len(data) + 1)
+                return
+        except OSError:
+            data = b''
+        self._unregister(request)
+        if not data:
+            self._close_pending(request)
+            return
+        try:
+            request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVLOWAT, 1)
+            self._dispatch(request, client_address, _request_path(data))
+        except Exception as e:
+            logger.error(f"处理HTTP连接失败 {client_address}: {e}")
+            self._close_pending(request)
+
+    def _dispatch(self, request, client_address, path: Optional[str]):
+        """区分普通请求与长连接请求"""
+        if path in self.stream_paths:
+            if not self.stream_slots.acquire(blocking=False):
+                with self.stats_lock:
+                    self.rejected_streams += 1
+                self.pending_slots.release()
+                self._reject(request)
+                return
+            request.settimeout(None)
+            try:
+                self.stream_pool.submit(self._handle_stream, request, client_address)
+            except RuntimeError:
+                # 服务器正在关闭
+                self.stream_slots.release()
+                raise
+            self.pending_slots.release()
+            return
+        # 请求线程全忙时在线程池队列中等待，开始处理时才释放待处理连接名额
+        self.request_pool.submit(self._handle_request, request, client_address)
+
+    def _handle_request(self, request, client_address):
+        """在请求线程中处理普通请求"""
+        self.pending_slots.release()
+        with self.stats_lock:
+            self.active_requests += 1
+        try:
+            request.settimeout(self.request_timeout)
+            self._handle(request, client_address)
+        finally:
+            with self.stats_lock:
+                self.active_requests -= 1
+
+    def _handle_stream(self, request, client_address):
+        """在流式线程池中处理长连接请求"""
+        with self.stats_lock:
+            self.active_streams += 1
+        try:
+            self._handle(request, client_address)
+        finally:
+            with self.stats_lock:
+                self.active_streams -= 1
+            self.stream_slots.release()
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _reject(self, request):
+        """流式连接已满，直接返回503"""
+        body = json.dumps({'success': False, 'message': '事件流连接数已满，请稍后重试'},
+                          ensure_ascii=False).encode('utf-8')
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            "Retry-After: 5\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('ascii')
+        try:
+            request.sendall(head + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def get_stats(self) -> dict:
+        """当前请求线程与流式连接的使用情况"""
+        with self.stats_lock:
+            return {
+                'max_connections': self.max_connections,
+                'active_requests': self.active_requests,
+                'stream_connections': self.stream_connections,
+                'active_streams': self.active_streams,
+                'rejected_streams': self.rejected_streams,
+                'waiting_connections': len(self.waiting),
+                'idle_closed': self.idle_closed
+            }
+
+    def server_close(self):
+        super().server_close()
+        self.closing = True
+        self._wake()
+        self.classify_thread.join(1)
+        for request in list(self.waiting):
+            self.shutdown_request(request)
+        self.waiting.clear()
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        self.request_pool.shutdown(wait=False)
+        self.stream_pool.shutdown(wait=False)
+
+
+def _request_path(data: bytes) -> Optional[str]:
+    """从预读的请求行中解析请求路径"""
+    parts = data.split(b'\r\n', 1)[0].split(b' ')
+    if len(parts) < 2:
+        return None
+    return parts[1].split(b'?', 1)[0].decode('latin-1')
+
+
+def run_pooled_server(app, host: str, port: int, max_connections: int, stream_connections: int,
+                      stream_paths: Iterable[str] = (), request_timeout: Optional[float] = REQUEST_TIMEOUT):
+    """以生产模式运行Flask应用，阻塞直到服务器停止"""
+    server = PooledWSGIServer(host, port, app, max_connections, stream_connections,
+                              stream_paths, request_timeout)
+    app.config['HTTP_SERVER'] = server
+    logger.info(f"Web服务器(生产模式)监听 {host}:{port}，请求线程 {max_connections}，事件流连接上限 {stream_connections}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
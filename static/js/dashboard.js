@@ -0,0 +1,1176 @@
+let devices = {};
+let totalMessages = 0;
+let eventSource = null;
+// 待重绘的设备ID，每帧(requestAnimationFrame)统一处理；fullRender 为true时对全部设备做一次对账
+const dirtyDevices = new Set();
+let fullRender = false;
+let statsDirty = false;
+let logDirty = false;
+let renderScheduled = false;
+// 每个设备一个卡片节点，只修改变化的字段
+const deviceCards = new Map();
+// 实时日志：有界列表，只渲染可见区域内的行
+const LOG_MAX_ENTRIES = 1000;
+const LOG_ROW_HEIGHT = 58;
+const LOG_OVERSCAN = 5;
+const logEntries = [];
+let logSpacer = null;
+// 最后收到的事件ID，重建连接时带给服务器以补发断线期间的事件
+let lastEventId = null;
+// 连续多次连接失败且未收到任何消息时（例如代理缓冲了事件流），改用长轮询
+const SSE_MAX_FAILURES = 3;
+let sseFailures = 0;
+let longPolling = false;
+
+// 初始化
+document.addEventListener('DOMContentLoaded', function() {
+    initLogList();
+    addLogEntry('系统', '正在连接事件流...', 'online');
+    if (new URLSearchParams(window.location.search).get('transport') === 'poll') {
+        startLongPoll();
+    } else {
+        initializeSSE();
+    }
+    loadDevices();
+    setupModals();
+});
+
+// 初始化SSE连接
+function initializeSSE() {
+    let url = '/events?batch=1';
+    if (lastEventId) {
+        url += '&last_event_id=' + encodeURIComponent(lastEventId);
+    }
+    eventSource = new EventSource(url);
+
+    eventSource.onopen = function(event) {
+        updateConnectionStatus('已连接', true);
+        addLogEntry('系统', '事件流连接成功', 'online');
+        console.log('SSE连接已建立');
+    };
+
+    eventSource.onmessage = function(event) {
+        sseFailures = 0;
+        if (event.lastEventId) {
+            lastEventId = event.lastEventId;
+        }
+        try {
+            console.log('收到SSE消息:', event.data);
+            handleServerEvent(JSON.parse(event.data));
+        } catch (e) {
+            console.error('解析SSE消息失败:', e, '原始数据:', event.data);
+            addLogEntry('系统', `SSE消息解析错误: ${e.message}`, 'alarm');
+        }
+    };
+
+    eventSource.onerror = function(event) {
+        updateConnectionStatus('连接错误', false);
+        addLogEntry('系统', '事件流连接错误', 'alarm');
+        console.error('SSE连接错误:', event);
+
+        sseFailures++;
+        if (sseFailures >= SSE_MAX_FAILURES) {
+            eventSource.close();
+            addLogEntry('系统', '事件流不可用，改用长轮询', 'online');
+            startLongPoll();
+            return;
+        }
+
+        // 尝试重新连接
+        setTimeout(function() {
+            if (eventSource.readyState === EventSource.CLOSED) {
+                addLogEntry('系统', '尝试重新连接事件流...', 'online');
+                initializeSSE();
+            }
+        }, 5000);
+    };
+}
+
+// 处理服务器推送的一条事件（SSE与长轮询共用）
+function handleServerEvent(data) {
+    if (data.type === 'heartbeat') {
+        // 心跳消息，不需要特殊处理
+    } else if (data.type === 'resync') {
+        // 事件积压过多或断线时间超出服务器缓冲，重新拉取完整设备列表
+        addLogEntry('系统', '事件缺失，重新同步设备列表', 'online');
+        loadDevices();
+    } else if (data.type === 'batch') {
+        handleEventBatch(data.events);
+    } else {
+        handleDeviceMessage(data);
+    }
+}
+
+// 长轮询：服务器在有新事件或超时后返回，随即发起下一次请求
+function startLongPoll() {
+    if (longPolling) return;
+    longPolling = true;
+    updateConnectionStatus('已连接(长轮询)', true);
+    pollEvents();
+}
+
+function pollEvents() {
+    let url = '/api/events/poll?timeout=25';
+    if (lastEventId) {
+        url += '&after=' + encodeURIComponent(lastEventId);
+    }
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.message || data.error);
+            }
+            updateConnectionStatus('已连接(长轮询)', true);
+            lastEventId = data.last_event_id;
+            if (data.resync) {
+                handleServerEvent({type: 'resync'});
+            } else if (data.events.length > 0) {
+                handleEventBatch(data.events);
+            }
+            pollEvents();
+        })
+        .catch(error => {
+            updateConnectionStatus('连接错误', false);
+            console.error('长轮询失败:', error);
+            setTimeout(pollEvents, 5000);
+        });
+}
+
+// 处理服务器合并发送的一批事件（重绘在下一帧统一进行）
+function handleEventBatch(events) {
+    events.forEach(handleDeviceMessage);
+}
+
+// 处理设备消息
+function handleDeviceMessage(data) {
+    totalMessages++;
+
+    // 检查是否是设备ID修改事件
+    if (data.type === 'device_id_change') {
+        handleDeviceIdChange(data);
+        return;
+    }
+
+    // 检查是否是设备离线/上线事件
+    if (data.type === 'device_offline' || data.type === 'device_online') {
+        handleDeviceStatusChange(data);
+        return;
+    }
+
+    // 检查是否是ID冲突事件
+    if (data.type === 'id_conflict') {
+        handleIdConflict(data);
+        return;
+    }
+
+    // 检查是否是设备重新发现事件
+    if (data.type === 'device_discovery') {
+        handleDeviceDiscovery(data);
+        return;
+    }
+
+    // 检查是否是下行命令结果事件
+    if (data.type === 'command_result') {
+        addLogEntry('系统', data.message, data.success ? 'online' : 'alarm');
+        return;
+    }
+
+    // 检查是否是错误事件
+    if (data.type === 'error') {
+        addLogEntry('系统', `错误: ${data.message}`, 'alarm');
+        return;
+    }
+
+    // 处理设备消息事件
+    if (data.type === 'device_message') {
+        // 更新设备信息
+        if (data.device_info) {
+            devices[data.device_id] = data.device_info;
+        }
+
+        // 添加日志条目
+        const logType = getLogType(data.command);
+        const logMessage = `${data.command_name} - RSSI: ${data.wifi_rssi}, IP: ${data.source_ip}`;
+        addLogEntry(`设备${data.device_id}`, logMessage, logType);
+
+        // 更新显示
+        updateDeviceGrid(data.device_id);
+        updateStats();
+        return;
+    }
+
+    // 处理其他类型的消息（向后兼容）
+    if (data.device_info) {
+        devices[data.device_id] = data.device_info;
+    }
+
+    // 添加日志条目
+    const logType = getLogType(data.command);
+    addLogEntry(
+        `设备${data.device_id}`,
+        `${data.command_name} - RSSI: ${data.wifi_rssi}, IP: ${data.source_ip}`,
+        logType
+    );
+
+    // 更新显示
+    updateDeviceGrid(data.device_id);
+    updateStats();
+}
+
+// 处理设备ID修改事件
+function handleDeviceIdChange(data) {
+    const oldDeviceId = data.old_device_id;
+    const newDeviceId = data.new_device_id;
+
+    // 立即从设备列表中移除旧设备
+    if (devices[oldDeviceId]) {
+        delete devices[oldDeviceId];
+        addLogEntry('系统', `设备ID修改检测: 移除旧设备 ${oldDeviceId}`, 'online');
+
+        // 立即更新显示
+        updateDeviceGrid(oldDeviceId);
+        updateStats();
+    }
+
+    // 添加ID修改日志
+    addLogEntry('系统', data.message, 'online');
+
+    // 启动自动刷新（确保获取最新的设备信息）
+    startAutoRefresh();
+}
+
+// 处理设备状态变化事件（离线/上线）
+function handleDeviceStatusChange(data) {
+    const deviceId = data.device_id;
+    const isOffline = data.type === 'device_offline';
+
+    // 更新设备状态
+    if (devices[deviceId]) {
+        devices[deviceId].is_offline = isOffline;
+        if (isOffline) {
+            devices[deviceId].offline_time = data.timestamp;
+        } else {
+            delete devices[deviceId].offline_time;
+        }
+
+        // 立即更新显示
+        updateDeviceGrid(deviceId);
+        updateStats();
+    }
+
+    // 添加状态变化日志
+    const logType = isOffline ? 'alarm' : 'online';
+    addLogEntry('系统', data.message, logType);
+}
+
+// 处理ID冲突事件
+function handleIdConflict(data) {
+    const oldDeviceId = data.old_device_id;
+    const newDeviceId = data.new_device_id;
+    const sourceIp = data.source_ip;
+
+    // 添加冲突处理日志
+    addLogEntry('系统', data.message, 'alarm');
+
+    // 显示ID冲突通知弹窗
+    showIdConflictNotification(oldDeviceId, newDeviceId, sourceIp);
+
+    // 启动自动刷新以获取最新设备信息
+    startAutoRefresh();
+}
+
+// 处理设备重新发现事件
+function handleDeviceDiscovery(data) {
+    // 添加发现完成日志
+    addLogEntry('系统', data.message, 'online');
+
+    // 刷新设备列表
+    loadDevices();
+
+    // 显示通知
+    showDiscoveryNotification();
+}
+
+// 显示设备重新发现通知
+function showDiscoveryNotification() {
+    // 创建临时通知元素
+    const notification = document.createElement('div');
+    notification.style.cssText = `
+        position: fixed;
+        top: 20px;
+        right: 20px;
+        background: linear-gradient(135deg, #28a745 0%, #20c997 100%);
+        color: white;
+        padding: 15px 20px;
+        border-radius: 10px;
+        box-shadow: 0 4px 15px rgba(0,0,0,0.2);
+        z-index: 10000;
+        font-size: 14px;
+        font-weight: bold;
+        animation: slideInRight 0.5s ease-out;
+    `;
+    notification.innerHTML = `
+        <div style="display: flex; align-items: center; gap: 10px;">
+            <span>🔄</span>
+            <span>设备重新发现完成！</span>
+            <button onclick="this.parentElement.parentElement.remove()" 
+                    style="background: none; border: none; color: white; font-size: 18px; cursor: pointer; margin-left: 10px;">×</button>
+        </div>
+    `;
+
+    document.body.appendChild(notification);
+
+    // 3秒后自动消失
+    setTimeout(() => {
+        if (notification.parentElement) {
+            notification.remove();
+        }
+    }, 3000);
+}
+
+// 获取日志类型
+function getLogType(command) {
+    const types = {
+        0: 'online',
+        1: 'alarm',
+        2: 'recover',
+        3: 'heartbeat'
+    };
+    return types[command] || 'online';
+}
+
+// 在下一帧统一重绘
+function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(renderFrame);
+}
+
+function renderFrame() {
+    renderScheduled = false;
+    if (fullRender || dirtyDevices.size > 0) {
+        renderDeviceGrid();
+    }
+    if (statsDirty) {
+        statsDirty = false;
+        renderStats();
+    }
+    if (logDirty) {
+        logDirty = false;
+        renderLog();
+    }
+}
+
+// 添加日志条目，返回条目对象（可修改后调用 refreshLogEntries 重绘）
+function addLogEntry(source, message, type, options = {}) {
+    const entry = {
+        time: new Date().toLocaleString(),
+        source: source,
+        message: message,
+        type: type,
+        title: options.title || '',
+        onClick: options.onClick || null
+    };
+    // 最新的条目在最前
+    logEntries.unshift(entry);
+    if (logEntries.length > LOG_MAX_ENTRIES) {
+        logEntries.length = LOG_MAX_ENTRIES;
+    }
+    refreshLogEntries();
+    return entry;
+}
+
+function refreshLogEntries() {
+    logDirty = true;
+    scheduleRender();
+}
+
+// 初始化日志列表：容器内只保留一个撑开滚动高度的占位层，行按需绝对定位
+function initLogList() {
+    const logContainer = document.getElementById('logContainer');
+    logContainer.innerHTML = '';
+    logContainer.classList.add('log-virtual');
+    logSpacer = document.createElement('div');
+    logSpacer.className = 'log-spacer';
+    logContainer.appendChild(logSpacer);
+    logContainer.addEventListener('scroll', refreshLogEntries);
+    logContainer.addEventListener('click', function(event) {
+        const row = event.target.closest('.log-entry');
+        const entry = row && logEntries[row.dataset.index];
+        if (entry && entry.onClick) {
+            entry.onClick();
+        }
+    });
+}
+
+// 只渲染可见区域内的日志行
+function renderLog() {
+    if (!logSpacer) return;
+    const logContainer = document.getElementById('logContainer');
+    logSpacer.style.height = `${logEntries.length * LOG_ROW_HEIGHT}px`;
+
+    const first = Math.max(0, Math.floor(logContainer.scrollTop / LOG_ROW_HEIGHT) - LOG_OVERSCAN);
+    const last = Math.min(logEntries.length,
+        Math.ceil((logContainer.scrollTop + logContainer.clientHeight) / LOG_ROW_HEIGHT) + LOG_OVERSCAN);
+
+    const rows = logSpacer.children;
+    const count = Math.max(0, last - first);
+    while (rows.length < count) {
+        const row = document.createElement('div');
+        row.innerHTML = '<div class="log-timestamp"></div><div><strong></strong> <span class="log-message"></span></div>';
+        logSpacer.appendChild(row);
+    }
+    while (rows.length > count) {
+        logSpacer.lastChild.remove();
+    }
+
+    for (let i = 0; i < count; i++) {
+        const index = first + i;
+        const entry = logEntries[index];
+        const row = rows[i];
+        row.className = `log-entry log-${entry.type}`;
+        row.dataset.index = index;
+        row.style.top = `${index * LOG_ROW_HEIGHT}px`;
+        row.style.cursor = entry.onClick ? 'pointer' : '';
+        row.title = entry.title || entry.message;
+        row.children[0].textContent = entry.time;
+        row.children[1].children[0].textContent = `${entry.source}:`;
+        row.children[1].children[1].textContent = entry.message;
+    }
+}
+
+// 标记设备需要重绘：传入设备ID时只处理该设备，否则对全部设备对账
+function updateDeviceGrid(deviceId) {
+    if (deviceId === undefined) {
+        fullRender = true;
+    } else {
+        dirtyDevices.add(String(deviceId));
+    }
+    scheduleRender();
+}
+
+function renderDeviceGrid() {
+    const deviceGrid = document.getElementById('deviceGrid');
+    let ids;
+    if (fullRender) {
+        ids = new Set([...Object.keys(devices), ...deviceCards.keys()]);
+    } else {
+        ids = dirtyDevices;
+    }
+
+    ids.forEach(id => {
+        const device = devices[id];
+        let card = deviceCards.get(id);
+        if (!device) {
+            if (card) {
+                card.root.remove();
+                deviceCards.delete(id);
+            }
+            return;
+        }
+        if (!card) {
+            card = createDeviceCard(id);
+            insertDeviceCard(deviceGrid, id, card);
+        }
+        patchDeviceCard(card, device);
+    });
+    fullRender = false;
+    dirtyDevices.clear();
+
+    // 没有设备时显示提示
+    let placeholder = deviceGrid.querySelector('.no-devices');
+    if (deviceCards.size === 0) {
+        if (!placeholder) {
+            placeholder = document.createElement('div');
+            placeholder.className = 'no-devices';
+            deviceGrid.appendChild(placeholder);
+        }
+        placeholder.textContent = '暂无设备数据';
+    } else if (placeholder) {
+        placeholder.remove();
+    }
+}
+
+// 按设备ID顺序插入卡片
+function insertDeviceCard(deviceGrid, id, card) {
+    let next = null;
+    deviceCards.forEach((other, otherId) => {
+        if (Number(otherId) > Number(id) && (!next || Number(otherId) < Number(next.id))) {
+            next = {id: otherId, root: other.root};
+        }
+    });
+    deviceGrid.insertBefore(card.root, next ? next.root : null);
+    deviceCards.set(id, card);
+}
+
+// 创建设备卡片，保存需要更新的节点引用
+function createDeviceCard(id) {
+    const root = document.createElement('div');
+    root.innerHTML = `
+        <div class="device-header">
+            <div class="device-id"></div>
+            <div class="device-status"></div>
+        </div>
+        <div class="device-info">
+            <div class="info-item">
+                <div class="info-label"></div>
+                <div class="info-value"></div>
+            </div>
+            <div class="info-item">
+                <div class="info-label">WiFi信号</div>
+                <div class="info-value"></div>
+            </div>
+            <div class="info-item">
+                <div class="info-label">来源IP</div>
+                <div class="info-value"></div>
+            </div>
+            <div class="info-item">
+                <div class="info-label">报警次数</div>
+                <div class="info-value"></div>
+            </div>
+        </div>
+        <div class="device-actions">
+            <button class="btn btn-primary" onclick="modifyDeviceId(${id})">修改ID</button>
+            <button class="btn btn-secondary" onclick="immediateReport(${id})">立即上报</button>
+            <button class="btn btn-secondary" onclick="showDeviceDetails(${id})">详情</button>
+        </div>
+    `;
+    const values = root.querySelectorAll('.info-value');
+    const buttons = root.querySelectorAll('.device-actions button');
+    return {
+        root: root,
+        title: root.querySelector('.device-id'),
+        status: root.querySelector('.device-status'),
+        timeLabel: root.querySelector('.info-label'),
+        time: values[0],
+        rssi: values[1],
+        ip: values[2],
+        alarms: values[3],
+        actions: [buttons[0], buttons[1]],
+        // 上次渲染的值，没有变化的字段不触碰DOM
+        state: {}
+    };
+}
+
+function setIfChanged(card, key, node, property, value) {
+    if (card.state[key] !== value) {
+        card.state[key] = value;
+        node[property] = value;
+    }
+}
+
+// 只更新变化的字段
+function patchDeviceCard(card, device) {
+    const isOffline = device.is_offline || false;
+    const statusClass = isOffline ? 'offline' : device.status;
+
+    setIfChanged(card, 'cardClass', card.root, 'className', isOffline ? 'device-card offline' : 'device-card');
+    setIfChanged(card, 'title', card.title, 'textContent', `设备 ${device.id} ${isOffline ? '(离线)' : ''}`);
+    setIfChanged(card, 'statusClass', card.status, 'className', `device-status status-${statusClass}`);
+    setIfChanged(card, 'statusText', card.status, 'textContent', isOffline ? '离线' : getStatusText(device.status));
+    setIfChanged(card, 'timeLabel', card.timeLabel, 'textContent', isOffline ? '离线时间' : '最后上线');
+    setIfChanged(card, 'time', card.time, 'textContent', formatTime(isOffline ? device.offline_time : device.last_seen));
+    setIfChanged(card, 'rssi', card.rssi, 'textContent', `${device.wifi_rssi} dBm`);
+    setIfChanged(card, 'ip', card.ip, 'textContent', String(device.source_ip));
+    setIfChanged(card, 'alarms', card.alarms, 'textContent', String(device.alarm_count));
+    if (card.state.disabled !== isOffline) {
+        card.state.disabled = isOffline;
+        card.actions.forEach(button => { button.disabled = isOffline; });
+    }
+}
+
+// 标记统计信息需要重绘
+function updateStats() {
+    statsDirty = true;
+    scheduleRender();
+}
+
+function renderStats() {
+    const deviceList = Object.values(devices);
+
+    const onlineDevices = deviceList.filter(device => 
+        !device.is_offline
+    ).length;
+
+    const offlineDevices = deviceList.filter(device => 
+        device.is_offline
+    ).length;
+
+    // 更新统计卡片
+    document.getElementById('statsTotalDevices').textContent = deviceList.length;
+    document.getElementById('statsOnlineDevices').textContent = onlineDevices;
+    document.getElementById('statsOfflineDevices').textContent = offlineDevices;
+    document.getElementById('statsTotalMessages').textContent = totalMessages;
+}
+
+// 获取状态文本
+function getStatusText(status) {
+    const statusMap = {
+        'online': '在线',
+        'alarm': '报警',
+        'recover': '恢复',
+        'heartbeat': '心跳'
+    };
+    return statusMap[status] || '未知';
+}
+
+// 格式化时间
+function formatTime(timeString) {
+    const date = new Date(timeString);
+    return date.toLocaleString();
+}
+
+// 更新连接状态
+function updateConnectionStatus(status, isConnected) {
+    const statusElement = document.getElementById('connectionStatus');
+    const dotElement = document.getElementById('connectionDot');
+
+    statusElement.textContent = status;
+    dotElement.style.backgroundColor = isConnected ? '#28a745' : '#dc3545';
+}
+
+
+
+// 加载设备列表
+function loadDevices() {
+    fetch('/api/devices')
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                data.devices.forEach(device => {
+                    devices[device.id] = device;
+                });
+                updateDeviceGrid();
+                updateStats();
+            }
+        })
+        .catch(error => {
+            console.error('加载设备列表失败:', error);
+        });
+}
+
+// 修改设备ID
+function modifyDeviceId(deviceId) {
+    document.getElementById('currentId').value = deviceId;
+    document.getElementById('newId').value = '';
+    document.getElementById('targetIp').value = '';
+    document.getElementById('newIdError').style.display = 'none';
+    document.getElementById('modifyIdModal').style.display = 'block';
+}
+
+// 检查新ID是否重复
+function checkNewIdDuplicate(newId, currentId) {
+    const errorDiv = document.getElementById('newIdError');
+
+    if (!newId || newId < 1 || newId > 254) {
+        errorDiv.style.display = 'none';
+        return false;
+    }
+
+    if (parseInt(newId) === parseInt(currentId)) {
+        errorDiv.textContent = '新ID不能与当前ID相同';
+        errorDiv.style.display = 'block';
+        return true;
+    }
+
+    // 检查是否与现有设备ID重复
+    const existingDevice = devices[newId];
+    if (existingDevice) {
+        if (existingDevice.is_offline) {
+            const offlineTime = new Date(existingDevice.offline_time);
+            const timeDiff = (Date.now() - offlineTime.getTime()) / 1000;
+            if (timeDiff < 300) { // 5分钟内
+                errorDiv.textContent = `ID ${newId} 已被离线设备使用（离线时间不足5分钟）`;
+                errorDiv.style.display = 'block';
+                return true;
+            }
+        } else {
+            errorDiv.textContent = `ID ${newId} 已被在线设备使用`;
+            errorDiv.style.display = 'block';
+            return true;
+        }
+    }
+
+    errorDiv.style.display = 'none';
+    return false;
+}
+
+// 立即上报
+function immediateReport(deviceId) {
+    const device = devices[deviceId];
+    if (!device) return;
+
+    fetch('/api/immediate_report', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            device_id: deviceId,
+            target_ip: device.source_ip || '255.255.255.255'
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            addLogEntry('系统', data.message, 'online');
+        } else {
+            addLogEntry('系统', `立即上报失败: ${data.message}`, 'alarm');
+        }
+    })
+    .catch(error => {
+        addLogEntry('系统', `立即上报请求失败: ${error.message}`, 'alarm');
+    });
+}
+
+// 重新发现设备
+function rediscoverDevices() {
+    // 禁用按钮避免重复点击
+    const button = event.target;
+    const originalText = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '🔄 发现中...';
+
+    fetch('/api/rediscover_devices', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            addLogEntry('系统', data.message, 'online');
+        } else {
+            addLogEntry('系统', `重新发现设备失败: ${data.message}`, 'alarm');
+        }
+    })
+    .catch(error => {
+        addLogEntry('系统', `重新发现设备请求失败: ${error.message}`, 'alarm');
+    })
+    .finally(() => {
+        // 10秒后恢复按钮
+        setTimeout(() => {
+            button.disabled = false;
+            button.innerHTML = originalText;
+        }, 10000);
+    });
+}
+
+// 测试SSE连接
+function testSSEConnection() {
+    const statusElement = document.getElementById('connectionStatus');
+    const dotElement = document.getElementById('connectionDot');
+
+    statusElement.textContent = '测试中...';
+    dotElement.style.backgroundColor = '#ffc107'; // 黄色表示测试中
+
+    const testMessage = 'SSE_TEST_MESSAGE';
+    const testEventSource = new EventSource('/test_sse');
+
+    testEventSource.onopen = function(event) {
+        statusElement.textContent = '已连接';
+        dotElement.style.backgroundColor = '#28a745'; // 绿色表示已连接
+        addLogEntry('系统', 'SSE连接测试成功', 'online');
+        testEventSource.close();
+    };
+
+    testEventSource.onerror = function(event) {
+        statusElement.textContent = '连接错误';
+        dotElement.style.backgroundColor = '#dc3545'; // 红色表示连接错误
+        addLogEntry('系统', 'SSE连接测试失败', 'alarm');
+        testEventSource.close();
+    };
+}
+
+// 设置模态框
+function setupModals() {
+    // 关闭模态框
+    document.querySelector('.close').onclick = closeModal;
+
+    // 点击模态框外部关闭
+    window.onclick = function(event) {
+        const modifyModal = document.getElementById('modifyIdModal');
+        const detailsModal = document.getElementById('deviceDetailsModal');
+        const conflictModal = document.getElementById('idConflictModal');
+
+        if (event.target === modifyModal) {
+            closeModal();
+        } else if (event.target === detailsModal) {
+            closeDeviceDetailsModal();
+        } else if (event.target === conflictModal) {
+            closeIdConflictModal();
+        }
+    };
+
+    // 新ID输入实时检查
+    document.getElementById('newId').addEventListener('input', function() {
+        const newId = this.value;
+        const currentId = document.getElementById('currentId').value;
+        checkNewIdDuplicate(newId, currentId);
+    });
+
+    // 修改ID表单提交
+    document.getElementById('modifyIdForm').onsubmit = function(e) {
+        e.preventDefault();
+
+        const formData = new FormData(e.target);
+        const currentId = parseInt(formData.get('currentId'));
+        const newId = parseInt(formData.get('newId'));
+        const targetIp = formData.get('targetIp') || '255.255.255.255';
+
+        // 提交前最后检查一次
+        if (checkNewIdDuplicate(newId, currentId)) {
+            addLogEntry('系统', '修改ID失败: 新ID已被使用或无效', 'alarm');
+            return;
+        }
+
+        const data = {
+            current_id: currentId,
+            new_id: newId,
+            target_ip: targetIp
+        };
+
+        fetch('/api/modify_device_id', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(data)
+        })
+        .then(response => response.json())
+        .then(result => {
+            if (result.success) {
+                addLogEntry('系统', result.message, 'online');
+                closeModal();
+                // 修改成功后，等待SSE消息触发自动刷新
+                addLogEntry('系统', '等待设备响应...', 'online');
+            } else {
+                addLogEntry('系统', `修改ID失败: ${result.message}`, 'alarm');
+            }
+        })
+        .catch(error => {
+            addLogEntry('系统', `修改ID请求失败: ${error.message}`, 'alarm');
+        });
+    };
+}
+
+// 关闭模态框
+function closeModal() {
+    document.getElementById('modifyIdModal').style.display = 'none';
+}
+
+// 全局变量，防止重复启动自动刷新
+let autoRefreshActive = false;
+let globalRefreshTimer = null;
+
+// 开始自动刷新倒计时
+function startAutoRefresh() {
+    // 如果已经有自动刷新在进行，取消之前的
+    if (autoRefreshActive && globalRefreshTimer) {
+        clearTimeout(globalRefreshTimer);
+        addLogEntry('系统', '取消之前的自动刷新，启动新的刷新流程', 'online');
+    }
+
+    autoRefreshActive = true;
+    let countdown = 3; // 3秒倒计时
+    let refreshTimer = null;
+    let countdownEntry = null;
+
+    // 创建倒计时条目，点击可立即刷新
+    function createCountdownEntry() {
+        return addLogEntry('系统', `设备ID修改成功，${countdown}秒后自动刷新设备列表... (点击此处可立即刷新)`, 'online', {
+            title: '点击立即刷新',
+            onClick: executeRefresh
+        });
+    }
+
+    function setCountdownText(text) {
+        countdownEntry.message = text;
+        refreshLogEntries();
+    }
+
+    // 更新倒计时显示
+    function updateCountdown() {
+        if (countdown > 0) {
+            if (!countdownEntry) {
+                countdownEntry = createCountdownEntry();
+            } else {
+                setCountdownText(`设备ID修改成功，${countdown}秒后自动刷新设备列表... (点击此处可立即刷新)`);
+            }
+            countdown--;
+            refreshTimer = setTimeout(updateCountdown, 1000);
+            globalRefreshTimer = refreshTimer; // 保存全局定时器引用
+        } else {
+            // 倒计时结束，执行刷新
+            executeRefresh();
+        }
+    }
+
+    // 执行刷新
+    function executeRefresh() {
+        if (refreshTimer) {
+            clearTimeout(refreshTimer);
+        }
+
+        // 清除全局刷新状态
+        autoRefreshActive = false;
+        globalRefreshTimer = null;
+
+        // 更新倒计时条目显示为刷新中
+        if (countdownEntry) {
+            countdownEntry.onClick = null;
+            countdownEntry.title = '';
+            setCountdownText('正在刷新设备列表...');
+        }
+
+        loadDevices();
+
+        // 延迟显示完成消息，让用户看到刷新效果
+        setTimeout(() => {
+            if (countdownEntry) {
+                setCountdownText('设备列表刷新完成');
+            }
+        }, 500);
+    }
+
+    // 开始倒计时
+    updateCountdown();
+}
+
+// 全局变量，用于存储当前详情页面的设备ID
+let currentDetailsDeviceId = null;
+
+// 显示设备详情
+function showDeviceDetails(deviceId) {
+    currentDetailsDeviceId = deviceId;
+    const device = devices[deviceId];
+
+    if (!device) {
+        alert('设备不存在');
+        return;
+    }
+
+    // 更新设备详情标题
+    document.getElementById('deviceDetailsTitle').textContent = `设备 ${deviceId} 详情`;
+
+    // 更新基本信息
+    document.getElementById('detailDeviceId').textContent = device.id;
+    document.getElementById('detailStatus').textContent = device.is_offline ? '离线' : getStatusText(device.status);
+    document.getElementById('detailFirstSeen').textContent = formatTime(device.first_seen);
+    document.getElementById('detailLastSeen').textContent = formatTime(device.last_seen);
+    document.getElementById('detailWifiRssi').textContent = device.wifi_rssi + ' dBm';
+    document.getElementById('detailSourceIp').textContent = device.source_ip;
+    document.getElementById('detailAlarmCount').textContent = device.alarm_count;
+    document.getElementById('detailRecoverCount').textContent = device.recover_count;
+    document.getElementById('detailHeartbeatCount').textContent = device.heartbeat_count;
+
+    // 加载日志摘要
+    loadDeviceLogSummary(deviceId);
+
+    // 加载设备日志
+    loadDeviceLogs(deviceId);
+
+    // 显示模态框
+    document.getElementById('deviceDetailsModal').style.display = 'block';
+}
+
+// 加载设备日志摘要
+function loadDeviceLogSummary(deviceId) {
+    fetch(`/api/device/${deviceId}/logs/summary`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                const summary = data.summary;
+                document.getElementById('summaryTotalLogs').textContent = summary.total_logs;
+                document.getElementById('summaryFirstLog').textContent = 
+                    summary.first_log ? formatTime(summary.first_log) : '-';
+                document.getElementById('summaryLastLog').textContent = 
+                    summary.last_log ? formatTime(summary.last_log) : '-';
+
+                // 更新日志类型统计
+                const typesContainer = document.getElementById('summaryTypes');
+                typesContainer.innerHTML = '';
+
+                const typeNames = {
+                    'online': '上线',
+                    'offline': '离线',
+                    'alarm': '报警',
+                    'recover': '恢复',
+                    'heartbeat': '心跳'
+                };
+
+                for (const [type, count] of Object.entries(summary.log_types)) {
+                    const badge = document.createElement('span');
+                    badge.className = `type-badge ${type}`;
+                    badge.textContent = `${typeNames[type] || type}: ${count}`;
+                    typesContainer.appendChild(badge);
+                }
+            }
+        })
+        .catch(error => {
+            console.error('加载日志摘要失败:', error);
+        });
+}
+
+// 加载设备日志
+function loadDeviceLogs(deviceId, logType = null) {
+    const url = `/api/device/${deviceId}/logs` + (logType ? `?type=${logType}` : '');
+
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                displayDeviceLogs(data.logs);
+            }
+        })
+        .catch(error => {
+            console.error('加载设备日志失败:', error);
+        });
+}
+
+// 显示设备日志
+function displayDeviceLogs(logs) {
+    const logsContainer = document.getElementById('deviceLogs');
+
+    if (logs.length === 0) {
+        logsContainer.innerHTML = '<div class="no-devices">暂无日志数据</div>';
+        return;
+    }
+
+    const typeNames = {
+        'online': '上线',
+        'offline': '离线',
+        'alarm': '报警',
+        'recover': '恢复',
+        'heartbeat': '心跳'
+    };
+
+    logsContainer.innerHTML = logs.map(log => `
+        <div class="device-log-entry">
+            <div class="log-time">${formatTime(log.timestamp)}</div>
+            <div class="log-type ${log.type}">${typeNames[log.type] || log.type}</div>
+            <div class="log-message">${log.message}</div>
+            <div class="log-details">
+                <span>RSSI: ${log.wifi_rssi}dBm</span>
+                <span>IP: ${log.source_ip}</span>
+            </div>
+        </div>
+    `).join('');
+}
+
+// 过滤设备日志
+function filterDeviceLogs() {
+    const logType = document.getElementById('logTypeFilter').value;
+    if (currentDetailsDeviceId) {
+        loadDeviceLogs(currentDetailsDeviceId, logType || null);
+    }
+}
+
+// 关闭设备详情模态框
+function closeDeviceDetailsModal() {
+    document.getElementById('deviceDetailsModal').style.display = 'none';
+    currentDetailsDeviceId = null;
+}
+
+// 全局变量，用于存储当前冲突信息
+let currentConflictInfo = null;
+
+// 显示ID冲突通知弹窗
+function showIdConflictNotification(oldDeviceId, newDeviceId, sourceIp) {
+    currentConflictInfo = {
+        oldDeviceId: oldDeviceId,
+        newDeviceId: newDeviceId,
+        sourceIp: sourceIp
+    };
+
+    // 更新弹窗内容
+    document.getElementById('conflictDetails').textContent = 
+        `检测到设备ID ${oldDeviceId} 与现有设备冲突，系统已自动处理。`;
+    document.getElementById('conflictOldId').textContent = oldDeviceId;
+    document.getElementById('conflictNewId').textContent = newDeviceId;
+    document.getElementById('conflictSourceIp').textContent = sourceIp;
+
+    // 清空手动修改输入框
+    document.getElementById('manualNewId').value = '';
+
+    // 显示弹窗
+    document.getElementById('idConflictModal').style.display = 'block';
+}
+
+// 关闭ID冲突通知弹窗
+function closeIdConflictModal() {
+    document.getElementById('idConflictModal').style.display = 'none';
+    currentConflictInfo = null;
+}
+
+// 应用手动ID修改
+function applyManualIdChange() {
+    if (!currentConflictInfo) {
+        alert('无冲突信息');
+        return;
+    }
+
+    const manualNewId = document.getElementById('manualNewId').value;
+    if (!manualNewId || manualNewId < 1 || manualNewId > 254) {
+        alert('请输入有效的设备ID (1-254)');
+        return;
+    }
+
+    const newIdNum = parseInt(manualNewId);
+    if (newIdNum === currentConflictInfo.newDeviceId) {
+        alert('新ID与当前ID相同，无需修改');
+        return;
+    }
+
+    // 检查新ID是否已被使用
+    const existingDevice = devices[newIdNum];
+    if (existingDevice) {
+        if (existingDevice.is_offline) {
+            const offlineTime = new Date(existingDevice.offline_time);
+            const timeDiff = (Date.now() - offlineTime.getTime()) / 1000;
+            if (timeDiff < 300) { // 5分钟内
+                alert(`ID ${newIdNum} 已被离线设备使用（离线时间不足5分钟），请选择其他ID`);
+                return;
+            }
+        } else {
+            alert(`ID ${newIdNum} 已被在线设备使用，请选择其他ID`);
+            return;
+        }
+    }
+
+    // 发送手动修改ID请求
+    const requestData = {
+        current_id: currentConflictInfo.newDeviceId,
+        new_id: newIdNum,
+        target_ip: currentConflictInfo.sourceIp
+    };
+
+    fetch('/api/modify_device_id', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(requestData)
+    })
+    .then(response => response.json())
+    .then(result => {
+        if (result.success) {
+            addLogEntry('系统', `手动修改ID成功: ${currentConflictInfo.newDeviceId} -> ${newIdNum}`, 'online');
+            closeIdConflictModal();
+            startAutoRefresh();
+        } else {
+            addLogEntry('系统', `手动修改ID失败: ${result.message}`, 'alarm');
+        }
+    })
+    .catch(error => {
+        addLogEntry('系统', `手动修改ID请求失败: ${error.message}`, 'alarm');
+    });
+}
+
+// 页面关闭时清理
+window.addEventListener('beforeunload', function() {
+    if (eventSource) {
+        eventSource.close();
+    }
+});
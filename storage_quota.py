@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 后台检查间隔(秒)
+CHECK_INTERVAL = 60
+# 每个数据类别单轮最多淘汰的条目数，剩余部分留到下一轮，避免长时间占用磁盘I/O
+MAX_EVICTIONS_PER_PASS = 20
+
+_SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(value) -> int:
+    """解析 "10MB" 形式的大小配置，返回字节数"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?B?)\s*', str(value).upper())
+    if not match:
+        raise ValueError(f"无效的大小配置: {value}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+def get_path_size(path: str, seen: Optional[set] = None) -> int:
+    """获取文件大小或目录(递归)总大小
+
+    传入 seen 时按inode去重，多个快照间硬链接共享的文件只计一次。
+    """
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+    except OSError:
+        return 0
+
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += get_path_size(entry.path, seen)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if seen is not None and stat.st_nlink > 1:
+                        if (stat.st_dev, stat.st_ino) in seen:
+                            continue
+                        seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+class DataClass:
+    """一类磁盘数据的配额
+
+    usage() 返回当前占用字节数；evict() 淘汰最旧的一份数据，返回释放的字节数，
+    没有可淘汰的数据时返回0，释放量未知时返回None（由引擎重新统计占用）；
+    expired() 返回是否存在超出保留时长、无论配额都应淘汰的数据。
+    """
+
+    def __init__(self, name: str, quota: int, usage: Callable[[], int],
+                 evict: Callable[[], Optional[int]], expired: Optional[Callable[[], bool]] = None):
+        self.name = name
+        self.quota = quota
+        self.usage = usage
+        self.evict = evict
+        self.expired = expired or (lambda: False)
+
+
+class DirectoryDataClass(DataClass):
+    """按目录管理的数据：目录下以prefix开头的文件或子目录，按修改时间从旧到新淘汰
+
+    keep 为始终保留的最新条目数（例如正在写入的日志文件），
+    max_age 为保留时长(秒)，超过的条目即使未超配额也会被淘汰。
+    以 "." + prefix 开头的隐藏条目（例如正在写入的快照临时目录）计入占用，但不会被淘汰。
+    """
+
+    def __init__(self, name: str, quota: int, directory: str, prefix: str = "",
+                 keep: int = 0, max_age: Optional[int] = None):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+        self.max_age = max_age
+        super().__init__(name, quota, self._usage, self._evict, self._expired)
+
+    def _list_entries(self) -> List[os.DirEntry]:
+        """列出可淘汰的条目，按修改时间从旧到新排序"""
+        try:
+            with os.scandir(self.directory) as it:
+                entries = [entry for entry in it if entry.name.startswith(self.prefix)]
+        except OSError:
+            return []
+
+        def mtime(entry):
+            try:
+                return entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                return 0
+
+        entries.sort(key=mtime)
+        return entries[:len(entries) - self.keep] if self.keep else entries
+
+    def _usage(self) -> int:
+        seen = set()
+        prefixes = (self.prefix, f".{self.prefix}") if self.prefix else ("",)
+        try:
+            with os.scandir(self.directory) as it:
+                return sum(get_path_size(entry.path, seen) for entry in it if entry.name.startswith(prefixes))
+        except OSError:
+            return 0
+
+    def _evict(self) -> Optional[int]:
+        entries = self._list_entries()
+        if not entries:
+            return 0
+        path = entries[0].path
+        if os.path.isdir(path):
+            # 目录中可能有与其他快照硬链接共享的文件，释放量由引擎重新统计
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        size = get_path_size(path)
+        os.remove(path)
+        return size
+
+    def _expired(self) -> bool:
+        if self.max_age is None:
+            return False
+        entries = self._list_entries()
+        if not entries:
+            return False
+        try:
+            return entries[0].stat(follow_symlinks=False).st_mtime < time.time() - self.max_age
+        except OSError:
+            return False
+
+
+class RetentionEngine:
+    """磁盘配额与保留策略引擎
+
+    后台线程定期统计每类数据的占用，超出配额或存在过期数据时从最旧的数据开始淘汰。
+    每轮每类最多淘汰 max_evictions 份，单次淘汰只涉及一个文件/日志段/数据块，
+    不会长时间阻塞数据写入。
+    """
+
+    def __init__(self, interval: int = CHECK_INTERVAL, max_evictions: int = MAX_EVICTIONS_PER_PASS):
+        self.interval = interval
+        self.max_evictions = max_evictions
+        self.classes = []
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, data_class: DataClass):
+        """注册一类数据"""
+        with self.lock:
+            self.classes.append(data_class)
+            self.stats[data_class.name] = {
+                "quota": data_class.quota,
+                "usage": None,
+                "evicted_items": 0,
+                "evicted_bytes": 0,
+                "last_check": None
+            }
+
+    def _enforce(self, data_class: DataClass):
+        """对一类数据执行一轮配额检查与淘汰"""
+        usage = data_class.usage()
+        evicted_items = 0
+        evicted_bytes = 0
+
+        while evicted_items < self.max_evictions:
+            over_quota = data_class.quota is not None and usage > data_class.quota
+            if not over_quota and not data_class.expired():
+                break
+            freed = data_class.evict()
+            if freed == 0:
+                break
+            evicted_items += 1
+            if freed is None:
+                new_usage = data_class.usage()
+                evicted_bytes += max(0, usage - new_usage)
+                usage = new_usage
+            else:
+                evicted_bytes += freed
+                usage -= freed
+
+        if evicted_items:
+            logger.info(f"存储配额 {data_class.name}: 淘汰 {evicted_items} 份数据，释放 {evicted_bytes} 字节")
+
+        with self.lock:
+            stats = self.stats[data_class.name]
+            stats["usage"] = usage
+            stats["evicted_items"] += evicted_items
+            stats["evicted_bytes"] += evicted_bytes
+            stats["last_check"] = time.time()
+
+    def run_once(self):
+        """对所有数据类别执行一轮检查"""
+        with self.lock:
+            classes = list(self.classes)
+        for data_class in classes:
+            try:
+                self._enforce(data_class)
+            except Exception as e:
+                logger.error(f"存储配额检查失败 {data_class.name}: {e}")
+
+    def _run(self):
+        """后台检查线程"""
+        while not self.stop_event.is_set():
+            self.run_once()
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        """启动后台检查线程"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止后台检查线程"""
+        self.stop_event.set()
+
+    def get_stats(self) -> Dict:
+        """获取各类数据的配额、占用与淘汰统计"""
+        with self.lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
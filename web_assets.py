@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Web静态资源与HTTP压缩
+
+static/ 下的资源在启动时计算内容哈希，以 /assets/<名称>.<哈希>.<扩展名> 提供并设置长期缓存，
+内容变化后URL随之变化，浏览器无需重新验证。渲染后的页面骨架缓存在内存中，以ETag协商缓存。
+JSON/HTML/CSS/JS响应超过阈值时按 Accept-Encoding 进行gzip/deflate压缩，
+压缩结果按资源版本(ETag或内容摘要)缓存，相同内容不重复压缩。
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from flask import Response, abort, render_template, request
+
+logger = logging.getLogger(__name__)
+
+# 小于该大小的响应不压缩(字节)
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+# 缓存的压缩结果条数上限
+COMPRESS_CACHE_SIZE = 128
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript')
+# 带内容哈希的资源URL永不变化，可长期缓存
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class _Asset:
+    __slots__ = ('path', 'mimetype', 'data', 'digest')
+
+    def __init__(self, path: str, mimetype: str, data: bytes, digest: str):
+        self.path = path
+        self.mimetype = mimetype
+        self.data = data
+        self.digest = digest
+
+
+class WebAssets:
+    """静态资源哈希命名、页面骨架缓存与响应压缩"""
+
+    def __init__(self, app, static_dir: Optional[str] = None, min_size: int = COMPRESS_MIN_SIZE,
+                 level: int = COMPRESS_LEVEL):
+        self.app = app
+        self.static_dir = static_dir or os.path.join(app.root_path, 'static')
+        self.min_size = min_size
+        self.level = level
+        self.assets = {}
+        self.urls = {}
+        self.shells = {}
+        self.compressed = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'compressed': 0, 'cache_hits': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+        self._scan()
+        app.add_url_rule('/assets/<path:filename>', 'hashed_asset', self.serve_asset)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.after_request(self.compress_response)
+
+    def _scan(self):
+        """读取静态资源并计算内容哈希"""
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha1(data).hexdigest()[:12]
+                stem, ext = os.path.splitext(rel)
+                hashed = f"{stem}.{digest}{ext}"
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                self.assets[hashed] = _Asset(path, mimetype, data, digest)
+                self.urls[rel] = f"/assets/{hashed}"
+        logger.info(f"已加载 {len(self.assets)} 个静态资源")
+
+    def url(self, name: str) -> str:
+        """模板中使用的资源URL，包含内容哈希"""
+        return self.urls[name]
+
+    def serve_asset(self, filename: str):
+        """提供带哈希的静态资源"""
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        response = Response(asset.data, mimetype=asset.mimetype)
+        response.set_etag(asset.digest, weak=True)
+        response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+        return response.make_conditional(request)
+
+    def render_shell(self, template: str) -> Response:
+        """返回缓存的页面骨架，首次请求时渲染"""
+        with self.lock:
+            cached = self.shells.get(template)
+        if cached is None:
+            body = render_template(template).encode('utf-8')
+            cached = (body, hashlib.sha1(body).hexdigest()[:12])
+            with self.lock:
+                self.shells[template] = cached
+        body, digest = cached
+        response = Response(body, mimetype='text/html')
+        response.set_etag(digest, weak=True)
+        # 页面骨架需要重新验证，以便资源哈希变化后立即生效
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == 'gzip':
+            # 固定mtime，相同内容的压缩结果一致
+            return gzip.compress(data, self.level, mtime=0)
+        return zlib.compress(data, self.level)
+
+    def _cached_compress(self, key: Tuple, data: bytes, encoding: str) -> bytes:
+        """按资源版本缓存压缩结果（LRU）"""
+        with self.lock:
+            body = self.compressed.get(key)
+            if body is not None:
+                self.compressed.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return body
+        body = self._compress(data, encoding)
+        with self.lock:
+            self.compressed[key] = body
+            if len(self.compressed) > COMPRESS_CACHE_SIZE:
+                self.compressed.popitem(last=False)
+        return body
+
+    def compress_response(self, response: Response) -> Response:
+        """after_request: 协商并压缩较大的文本响应"""
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code != 200
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        # 资源版本：有ETag时用ETag，否则用内容摘要
+        etag, _ = response.get_etag()
+        version = etag or hashlib.sha1(data).hexdigest()
+        body = self._cached_compress((request.path, version, encoding), data, encoding)
+        if len(body) >= len(data):
+            return response
+
+        with self.lock:
+            self.stats['compressed'] += 1
+            self.stats['bytes_in'] += len(data)
+            self.stats['bytes_out'] += len(body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def get_stats(self) -> Dict:
+        """压缩与缓存统计"""
+        with self.lock:
+            return dict(self.stats, cached_bodies=len(self.compressed), assets=len(self.assets))